@@ -0,0 +1,84 @@
+"""
+Compares memory use of positions_df in the default and compact modes, and checks how far compact mode's kinematics
+drift from the float64 ones. Run from the repo root with:
+
+    python -m benchmarks.bench_compact --rows 100000 1000000 10000000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import trajectorytools as tt
+from zebrafishanalysis.structs import NovelObjectRecognitionTest
+from zebrafishanalysis.video import VideoMetadata
+
+# A 1280x720 arena with the objects and wall roughly where they are in the real recordings
+VIDEO_METADATA: VideoMetadata = VideoMetadata('synthetic.mp4', 1280, 720, fps=60)
+OBJECT_LOCATIONS: tuple = ((400, 360), (880, 360))
+LEFT_WALL_COORDS: tuple = ((190, 100), (190, 610))
+
+
+def make_positions(num_frames: int,
+                   num_fish: int,
+                   seed: int = 0) -> np.ndarray:
+    """
+    Random walks kept inside the arena, standing in for a real recording
+    :return: np.ndarray: (frames, fish, 2) positions
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    walk: np.ndarray = np.cumsum(rng.normal(0, 3, (num_frames, num_fish, 2)), axis=0)
+    # Reflect off the walls of a 870x510 box
+    size: np.ndarray = np.array([870, 510])
+    return np.abs(walk % (2 * size) - size) + np.array([190, 100])
+
+
+def build(positions: np.ndarray,
+          compact: bool) -> tuple:
+    """
+    Builds a NovelObjectRecognitionTest, timing it
+    :return: tuple: (seconds taken, object)
+    """
+    raw: tt.Trajectories = tt.Trajectories.from_positions(positions.copy(), interpolate_nans=False)
+    raw.params['frame_rate'] = VIDEO_METADATA.fps
+    start: float = time.perf_counter()
+    tr = NovelObjectRecognitionTest(raw,
+                                    OBJECT_LOCATIONS,
+                                    LEFT_WALL_COORDS,
+                                    video_metadata=VIDEO_METADATA,
+                                    compact=compact)
+    return time.perf_counter() - start, tr
+
+
+def max_abs_error(full: pd.Series,
+                  compact: pd.Series) -> float:
+    """
+    Largest difference between the two modes, ignoring NaNs
+    """
+    return float(np.nanmax(np.abs(full.to_numpy(dtype=np.float64) - compact.to_numpy(dtype=np.float64))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--fish', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'default MB':>11} {'compact MB':>11} {'saving':>7} {'default (s)':>12} "
+          f"{'compact (s)':>12} {'distance err':>13} {'speed err':>10} {'dist_obj_a err':>15} {'pref diffs':>11}")
+    for rows in args.rows:
+        positions: np.ndarray = make_positions(rows // args.fish, args.fish)
+        default_time, default_tr = build(positions, compact=False)
+        compact_time, compact_tr = build(positions, compact=True)
+
+        default_mb: float = default_tr.positions_df.memory_usage(deep=True).sum() / 1e6
+        compact_mb: float = compact_tr.positions_df.memory_usage(deep=True).sum() / 1e6
+        distance_error: float = max_abs_error(default_tr.positions_df['distance'], compact_tr.positions_df['distance'])
+        speed_error: float = max_abs_error(default_tr.positions_df['speed'], compact_tr.positions_df['speed'])
+        dist_error: float = max_abs_error(default_tr.positions_df['dist_obj_a'], compact_tr.positions_df['dist_obj_a'])
+        # How many frames change which side of the usual exploration radius they're on
+        pref_diffs: int = int(np.abs(np.subtract(default_tr.determine_object_preference_by_frame(250),
+                                                 compact_tr.determine_object_preference_by_frame(250))).sum())
+
+        print(f"{rows:>10} {default_mb:>11.1f} {compact_mb:>11.1f} {1 - compact_mb / default_mb:>6.0%} "
+              f"{default_time:>12.3f} {compact_time:>12.3f} {distance_error:>13.2e} {speed_error:>10.2e} "
+              f"{dist_error:>15.2e} {pref_diffs:>11}")
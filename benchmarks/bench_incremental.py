@@ -0,0 +1,59 @@
+"""
+Compares removing a small artefact region with the incremental recalculation (only rows near removed points are
+worked out again) against recalculating every kinematic and derived column. Run from the repo root with:
+
+    python -m benchmarks.bench_incremental --rows 100000 1000000 10000000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.bench_compact import build, make_positions
+from zebrafishanalysis.structs import NovelObjectRecognitionTest
+
+# About the size of the 4-vertex regions in data_dicts.regions_to_remove_same
+ARTEFACT_REGION: list = [[842, 315], [915, 311], [917, 370], [843, 373]]
+
+
+def remove_fully(tr: NovelObjectRecognitionTest,
+                 vertices: list) -> pd.DataFrame:
+    """
+    What remove_polygon_from_frames did before, recalculating everything after blanking the points
+    :return: pd.DataFrame
+    """
+    df: pd.DataFrame = tr.positions_df.copy(deep=False)
+    inside: np.ndarray = tr.get_point_bools(vertices, df).to_numpy()
+    df['x_pos'] = np.where(inside, np.NaN, df['x_pos'].to_numpy())
+    df['y_pos'] = np.where(inside, np.NaN, df['y_pos'].to_numpy())
+    return tr._update_derived_columns(tr.calculate_speeds(df, gap_mode='split'))
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    """
+    :return: tuple: (seconds taken, result)
+    """
+    start: float = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--fish', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'removed':>8} {'full (s)':>9} {'incremental (s)':>16} {'speedup':>8} {'max diff':>9}")
+    for rows in args.rows:
+        _, tr = build(make_positions(rows // args.fish, args.fish), compact=False)
+        tr.determine_freezing(inplace=True)
+
+        full_time, full_df = timed(remove_fully, tr, ARTEFACT_REGION)
+        incremental_time, incremental_df = timed(tr.remove_polygon_from_frames, ARTEFACT_REGION)
+
+        removed: int = int(incremental_df['x_pos'].isna().sum())
+        diff: float = max(float(np.nanmax(np.abs(full_df[name].to_numpy(dtype=np.float64) -
+                                                 incremental_df[name].to_numpy(dtype=np.float64)), initial=0))
+                          for name in full_df.columns)
+        print(f"{rows:>10} {removed:>8} {full_time:>9.3f} {incremental_time:>16.3f} "
+              f"{full_time / incremental_time:>7.1f}x {diff:>9.1e}")
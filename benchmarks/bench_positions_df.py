@@ -0,0 +1,50 @@
+"""
+Compares the vectorized and looped construction of positions_df. The looped path is the original builder, untouched,
+so it gives int64 frame_id/fish_id where the vectorized one gives int32. Values are checked to be identical, and
+dtypes to differ only in that. Run from the repo root with:
+
+    python -m benchmarks.bench_positions_df --rows 100000 1000000 10000000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from zebrafishanalysis.structs import positions_to_dataframe
+
+
+def time_construction(positions: np.ndarray,
+                      vectorized: bool) -> tuple:
+    """
+    Builds a dataframe from positions, timing it
+    :param positions: (frames, fish, 2) array to convert
+    :param vectorized: Which construction path to use
+    :return: tuple: (seconds taken, resulting dataframe)
+    """
+    start: float = time.perf_counter()
+    df: pd.DataFrame = positions_to_dataframe(positions, vectorized=vectorized)
+    return time.perf_counter() - start, df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--fish', type=int, default=2)
+    parser.add_argument('--skip-loop-above', type=int, default=None,
+                        help="Don't run the looped path above this many rows (it's slow and memory hungry)")
+    args = parser.parse_args()
+
+    rng: np.random.Generator = np.random.default_rng(0)
+    print(f"{'rows':>10} {'vectorized (s)':>15} {'loop (s)':>10} {'speedup':>8} {'df MB':>8}")
+    for rows in args.rows:
+        positions: np.ndarray = rng.uniform(0, 1280, (rows // args.fish, args.fish, 2))
+        vec_time, vec_df = time_construction(positions, vectorized=True)
+        size_mb: float = vec_df.memory_usage(deep=True).sum() / 1e6
+
+        if args.skip_loop_above is not None and rows > args.skip_loop_above:
+            print(f"{rows:>10} {vec_time:>15.3f} {'-':>10} {'-':>8} {size_mb:>8.1f}")
+            continue
+
+        loop_time, loop_df = time_construction(positions, vectorized=False)
+        pd.testing.assert_frame_equal(vec_df, loop_df, check_dtype=False)
+        assert dict(loop_df.dtypes) == {**dict(vec_df.dtypes), 'frame_id': np.int64, 'fish_id': np.int64}
+        print(f"{rows:>10} {vec_time:>15.3f} {loop_time:>10.3f} {loop_time / vec_time:>7.0f}x {size_mb:>8.1f}")
@@ -0,0 +1,34 @@
+from data_dicts import *
+from helpers import *
+import zebrafishanalysis as za
+import os
+import pandas as pd
+
+# The hand measured walls and central regions for each trial, to check the automatic calibration against
+HAND_MEASURED: dict = {
+    ("nor_data", "same_obj", 1): (lengths_1m_same, central_regions_same_1_m),
+    ("nor_data", "diff_obj", 1): (lengths_1m_diff, central_regions_diff_1_m),
+    ("month_2", "same_obj", 2): (lengths_2m_same, central_regions_same_2_m),
+    ("month_2", "diff_obj", 2): (lengths_2m_diff, central_regions_diff_2_m),
+}
+
+def calibration_comparison() -> pd.DataFrame:
+    """
+    Calibrates every recording, and compares it against the hand measured dictionaries
+    :return: pd.DataFrame with a row per recording, see za.calibration_report
+    """
+    reports: list = []
+    for (data_dir, file_name, month), (lengths, central_regions) in HAND_MEASURED.items():
+        calibrations: dict = za.calibrate_experiment(data_dir, file_name, fish_ids=os.listdir(data_dir),
+                                                     cache=TRAJECTORY_CACHE)
+        report: pd.DataFrame = za.calibration_report(calibrations, lengths, central_regions)
+        report.insert(0, "trial", file_name)
+        report.insert(0, "month", month)
+        reports.append(report)
+    return pd.concat(reports).rename_axis("fish")
+
+
+if __name__ == "__main__":
+    comparison = calibration_comparison()
+    print(comparison.describe())
+    comparison.to_csv(os.getcwd() + "/calibration_report.csv")
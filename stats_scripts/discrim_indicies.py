@@ -16,17 +16,11 @@ def measures_helper(same_tr: za.NovelObjectRecognitionTest,
 
 
 if __name__ == "__main__":
-    same_fish_1m = {fish: load_fish(fish, same=True) for fish in os.listdir("nor_data")}
-    diff_fish_1m = {fish: load_fish(fish, same=False) for fish in os.listdir("nor_data")}
+    same_fish_1m = load_all_fish(same=True, metrics=())
+    diff_fish_1m = load_all_fish(same=False, metrics=())
 
-    remove_region(same_fish_1m, regions_to_remove_same)
-    remove_region(diff_fish_1m, regions_to_remove_diff)
-
-    same_fish_2m = {fish: load_fish(fish, same=True, month=2) for fish in os.listdir("month_2")}
-    diff_fish_2m = {fish: load_fish(fish, same=False, month=2) for fish in os.listdir("month_2")}
-
-    remove_region(same_fish_2m, regions_to_remove_same_two_month)
-    remove_region(diff_fish_2m, regions_to_remove_diff_two_month)
+    same_fish_2m = load_all_fish(same=True, month=2, metrics=())
+    diff_fish_2m = load_all_fish(same=False, month=2, metrics=())
 
     measures: dict = {fish: measures_helper(same, diff_fish_1m[fish]) for fish, same in same_fish_1m.items()}
     df_for_exp = pd.DataFrame(measures)
@@ -38,12 +32,6 @@ if __name__ == "__main__":
     full_measures: pd.DataFrame = df_for_exp.transpose()
     full_measures.to_csv(os.getcwd() + "/two_month_fish_measures.csv")
 
-    # Construct dictionaries that hold the number of frames for each video
-    num_frames_same_1m = {fish: tr.num_frames for fish, tr in same_fish_1m.items()}
-    num_frames_diff_1m = {fish: tr.num_frames for fish, tr in diff_fish_1m.items()}
-
-    get_sliced_measures(num_frames_same_1m, num_frames_diff_1m, "nor_data", "export")
-
-    num_frames_same_2m = {fish: tr.num_frames for fish, tr in same_fish_2m.items()}
-    num_frames_diff_2m = {fish: tr.num_frames for fish, tr in same_fish_2m.items()}
-    get_sliced_measures(num_frames_same_2m, num_frames_diff_2m, "month_2", "export_2month")
+    with export_dataset("windowed_measures") as writer:
+        get_sliced_measures(same_fish_1m, diff_fish_1m, writer, 1)
+        get_sliced_measures(same_fish_2m, diff_fish_2m, writer, 2)
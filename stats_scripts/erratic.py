@@ -2,29 +2,31 @@ from data_dicts import *
 from helpers import *
 import zebrafishanalysis as za
 import os
-import numpy as np
 
-def export_erratic(same_fish, diff_fish, month):
-    same_sd = za.calculate_avg_rolling_sd([fish.drop_errors('acceleration', 10000) for fish in same_fish.values()], 'acceleration_cm', window=60)
-    diff_sd = za.calculate_avg_rolling_sd([fish.drop_errors('acceleration', 10000) for fish in diff_fish.values()], 'acceleration_cm', window=60)
+# Only acceleration is used here, so there's no point calculating the other kinematics
+ACCELERATION_METRICS: tuple = ('acceleration', 'acceleration_cm')
+# Windows are in frames, so rows dropped by drop_errors leave holes in them. Half a window is still plenty for an sd
+ACCELERATION_WINDOW: int = 60
+ACCELERATION_MIN_PERIODS: int = 30
 
-    same_sd.to_csv(os.getcwd() + f"/acc_sds_same_{month}m.csv")
-    diff_sd.to_csv(os.getcwd() + f"/acc_sds_diff_{month}m.csv")
+def export_erratic(same_fish, diff_fish, month):
+    extension = za.EXPORT_FORMATS[EXPORT_FORMAT]
+    # Recordings are lined up by frame, so frames dropped by drop_errors don't shift the later ones
+    za.calculate_avg_rolling_sd([fish.drop_errors('acceleration', 10000) for fish in same_fish.values()], 'acceleration_cm',
+                                window=ACCELERATION_WINDOW, min_periods=ACCELERATION_MIN_PERIODS,
+                                output_path=os.getcwd() + f"/acc_sds_same_{month}m{extension}")
+    za.calculate_avg_rolling_sd([fish.drop_errors('acceleration', 10000) for fish in diff_fish.values()], 'acceleration_cm',
+                                window=ACCELERATION_WINDOW, min_periods=ACCELERATION_MIN_PERIODS,
+                                output_path=os.getcwd() + f"/acc_sds_diff_{month}m{extension}")
 
 
 if __name__ == "__main__":
-    same_fish_1m = {fish: load_fish(fish, same=True) for fish in os.listdir("nor_data")}
-    diff_fish_1m = {fish: load_fish(fish, same=False) for fish in os.listdir("nor_data")}
-
-    remove_region(same_fish_1m, regions_to_remove_same)
-    remove_region(diff_fish_1m, regions_to_remove_diff)
+    same_fish_1m = load_all_fish(same=True, metrics=ACCELERATION_METRICS)
+    diff_fish_1m = load_all_fish(same=False, metrics=ACCELERATION_METRICS)
 
     export_erratic(same_fish_1m, diff_fish_1m, 1)
 
-    same_fish_2m = {fish: load_fish(fish, same=True, month=2) for fish in os.listdir("month_2")}
-    diff_fish_2m = {fish: load_fish(fish, same=False, month=2) for fish in os.listdir("month_2")}
-
-    remove_region(same_fish_2m, regions_to_remove_same_two_month)
-    remove_region(diff_fish_2m, regions_to_remove_diff_two_month)
+    same_fish_2m = load_all_fish(same=True, month=2, metrics=ACCELERATION_METRICS)
+    diff_fish_2m = load_all_fish(same=False, month=2, metrics=ACCELERATION_METRICS)
 
     export_erratic(same_fish_2m, diff_fish_2m, 2)
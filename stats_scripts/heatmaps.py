@@ -0,0 +1,35 @@
+from helpers import *
+import zebrafishanalysis as za
+import os
+
+# Bins along each side of the video
+HEATMAP_BINS: int = 50
+
+
+def draw_month_heatmaps(same_fish: dict,
+                        diff_fish: dict,
+                        month: int) -> dict:
+    """
+    Draws the heatmap of every fish in both trials, the average of each trial, and same less diff, to
+    heatmaps/month_<month>
+    :param same_fish: dict of fish id: TrajectoryObject for the same object trial
+    :param diff_fish: dict of fish id: TrajectoryObject for the different object trial
+    :param month: Age of the fish, for the directory name
+    :return: dict of map name: path written
+    """
+    grid: za.HeatmapGrid = za.HeatmapGrid.covering(list(same_fish.values()) + list(diff_fish.values()), HEATMAP_BINS)
+    same_maps: dict = za.occupancy_maps(same_fish, grid)
+    diff_maps: dict = za.occupancy_maps(diff_fish, grid)
+
+    maps: dict = {f"same_{fish}": heatmap for fish, heatmap in same_maps.items()}
+    maps.update({f"diff_{fish}": heatmap for fish, heatmap in diff_maps.items()})
+    maps["same_average"] = za.average_map(same_maps)
+    maps["diff_average"] = za.average_map(diff_maps)
+    maps["same_less_diff"] = za.difference_map(same_maps, diff_maps)
+    return za.render_heatmaps(maps, grid, os.path.join(os.getcwd(), "heatmaps", f"month_{month}"))
+
+
+if __name__ == "__main__":
+    draw_month_heatmaps(load_all_fish(same=True, metrics=()), load_all_fish(same=False, metrics=()), 1)
+    draw_month_heatmaps(load_all_fish(same=True, month=2, metrics=()),
+                        load_all_fish(same=False, month=2, metrics=()), 2)
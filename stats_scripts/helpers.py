@@ -1,8 +1,16 @@
 from data_dicts import *
 import zebrafishanalysis as za
+import logging
 import os
 import pandas as pd
 
+# Processed trajectories and dataframes are cached here between runs, so repeat runs skip the smoothing etc. Call
+# TRAJECTORY_CACHE.invalidate() (or delete the directory) to force everything to be reprocessed.
+TRAJECTORY_CACHE: za.TrajectoryCache = za.TrajectoryCache(".za_cache")
+
+# Results are written as one dataset (directory) per analysis, read by plotting.r with arrow::open_dataset. Set to
+# 'csv' to get text files instead, or 'feather'
+EXPORT_FORMAT: str = 'parquet'
 
 def remove_region(tr: dict,
                   v_list: dict) -> None:
@@ -24,18 +32,22 @@ def rem_rg(tr: za.TrajectoryObject,
     :param v: Verticies to remove
     :return:
     """
-    for polygon_object in v:
-        tr.remove_polygon_from_frames(polygon_object.v, inplace=True)
+    # All the polygons go in at once, so kinematics only get recalculated the one time
+    tr.remove_polygon_from_frames([polygon_object.v for polygon_object in v], inplace=True)
 
 def load_fish(fish_id: str,
               same: bool,
               slicer: slice = None,
-              month: int = 1) -> za.NovelObjectRecognitionTest:
+              month: int = 1,
+              metrics: tuple = None,
+              cache: za.TrajectoryCache = TRAJECTORY_CACHE) -> za.NovelObjectRecognitionTest:
     """
     Loads in NORT objects. Some poor design choices here
     :param fish_id: ID of the fish to load
     :param same: If this is a same_obj or diff_obj test
     :param slicer: A slice to put through the object
+    :param metrics: Kinematic columns to calculate, defaults to all of them
+    :param cache: Cache of processed trajectories to use, or None to always load from scratch
     :return: NORT object
     """
     same_file: str = "same_obj"
@@ -59,15 +71,52 @@ def load_fish(fish_id: str,
 
     print(f"Loading fish {fish_id} {'same' if same is True else 'diff'} with slice {slicer if slicer else 'None'}")
     if same is True:
-        return za.NovelObjectRecognitionTest(za.load_gapless_trajectories(f"{data_dir}/{fish_id}/{same_file}{data_ext}"),
+        return za.NovelObjectRecognitionTest(za.load_gapless_trajectories(f"{data_dir}/{fish_id}/{same_file}{data_ext}",
+                                                                          cache=cache),
                                              video_path=f"{data_dir}/{fish_id}/{same_file}{vid_ext}",
                                              object_locations=same_obj_locations[fish_id], period=slicer,
-                                             left_wall_coords=lengths_same[fish_id])
+                                             left_wall_coords=lengths_same[fish_id], metrics=metrics,
+                                             cache=cache)
     else:
-        return za.NovelObjectRecognitionTest(za.load_gapless_trajectories(f"{data_dir}/{fish_id}/{diff_file}{data_ext}"),
+        return za.NovelObjectRecognitionTest(za.load_gapless_trajectories(f"{data_dir}/{fish_id}/{diff_file}{data_ext}",
+                                                                          cache=cache),
                                              video_path=f"{data_dir}/{fish_id}/{diff_file}{vid_ext}",
                                              object_locations=dff_obj_locations[fish_id], period=slicer,
-                                             left_wall_coords=lengths_diff[fish_id])
+                                             left_wall_coords=lengths_diff[fish_id], metrics=metrics,
+                                             cache=cache)
+
+def load_all_fish(same: bool,
+                  month: int = 1,
+                  metrics: tuple = None,
+                  workers: int = None) -> dict:
+    """
+    Loads every fish of a trial in parallel, with erroneous regions already removed
+    :param same: If this is a same_obj or diff_obj test
+    :param month: 1 or 2 month old fish
+    :param metrics: Kinematic columns to calculate, defaults to all of them
+    :param workers: Number of processes to load with, defaults to the number of CPUs
+    :return: dict of fish id: NORT object
+    """
+    if month == 1:
+        data_dir = "nor_data"
+        obj_locations = training_obj_locations if same else testing_obj_locations
+        lengths = lengths_1m_same if same else lengths_1m_diff
+        regions = regions_to_remove_same if same else regions_to_remove_diff
+    else:
+        data_dir = "month_2"
+        obj_locations = training_obj_locations_two_month if same else testing_obj_locations_two_month
+        lengths = lengths_2m_same if same else lengths_2m_diff
+        regions = regions_to_remove_same_two_month if same else regions_to_remove_diff_two_month
+
+    logging.info(f"Loading all {'same' if same is True else 'diff'} fish from {data_dir}")
+    return za.load_experiment(data_dir, "same_obj" if same else "diff_obj",
+                              object_locations=obj_locations,
+                              left_wall_coords=lengths,
+                              regions_to_remove=regions,
+                              fish_ids=os.listdir(data_dir),
+                              workers=workers,
+                              metrics=metrics,
+                              cache=TRAJECTORY_CACHE)
 
 def measures_helper(same_tr: za.NovelObjectRecognitionTest,
                     diff_tr: za.NovelObjectRecognitionTest) -> dict:
@@ -80,44 +129,45 @@ def measures_helper(same_tr: za.NovelObjectRecognitionTest,
     return za.get_recognition_indices(same_tr, diff_tr, 250)
 
 
-def get_sliced_measures(num_frames_same, num_frames_diff, dir, filename):
-    same_time_slices_1m = {}
-    diff_time_slices_1m = {}
-    for fish in os.listdir(dir):
-        last_i = 0
-        same_time_slices_1m[fish] = {}
-        diff_time_slices_1m[fish] = {}
-        for i in range(18000, num_frames_same[fish] + 18000, 18000):
-            # Here we're incrementing in 5 minute intervals from 0 to the maximum possible value
-            # Python is super-forgiving, so we can just blast past the max value and it'll give us an irregular slice
-            same_raw_1m = load_fish(fish, same=True, slicer=slice(last_i, i))
-            same_time_slices_1m[fish][last_i] = same_raw_1m
-            last_i = i
-        last_i = 0
-        for i in range(18000, num_frames_diff[fish] + 18000, 18000):
-            diff_raw_1m = load_fish(fish, same=False, slicer=slice(last_i, i))
-            diff_time_slices_1m[fish][last_i] = diff_raw_1m
-            last_i = i
-
-    # Okay, now we have two dictionaries with arrangement dict[fish][time_period]
-    sliced_measures_1m = {}
-    for fish_name, periods in same_time_slices_1m.items():
-        for period_name, tr_same in periods.items():
-            if period_name not in sliced_measures_1m:
-                sliced_measures_1m[period_name] = {}
-            # Try to get the correspnding timepoint for the same fish
-            tr_diff: za.NovelObjectRecognitionTest = diff_time_slices_1m[fish_name][period_name]
-            # Now we remove erroneous data. This is a really bad way of doing it, but whatever. todo: .get instead
-            try:
-                rem_rg(tr_same, regions_to_remove_same[fish_name])
-                rem_rg(tr_diff, regions_to_remove_diff[fish_name])
-            except KeyError:
-                pass
-            ms = measures_helper(tr_same, tr_diff)
-            sliced_measures_1m[period_name][fish_name] = measures_helper(tr_same, tr_diff)
-
-    # Now we have sliced measures, we'll put them into a csv so I can do proper statistics in R
-
-    for n, time_period in sliced_measures_1m.items():
-        df_for_exp = pd.DataFrame(time_period).transpose()
-        df_for_exp.to_csv(os.getcwd() + f"/{filename}_{n}.csv")
\ No newline at end of file
+def get_sliced_measures(same_fish: dict,
+                        diff_fish: dict,
+                        writer: za.DatasetWriter,
+                        month: int,
+                        window_frames: int = 18000) -> None:
+    """
+    Exports recognition indices for each 5 minute (18000 frame) window, a row per fish per window
+    :param same_fish: dict of fish id: same NovelObjectRecognitionTest obj, with erroneous regions already removed
+    :param diff_fish: dict of fish id: diff NovelObjectRecognitionTest obj, with erroneous regions already removed
+    :param writer: Dataset to add the measures to, see export_dataset
+    :param month: Age of the fish, written alongside the measures
+    :param window_frames: Length of each window in frames
+    :return:
+    """
+    # Each recording is loaded once, and the windows all come out of one pass over it, giving an arrangement of
+    # dict[fish][time_period]
+    sliced_measures_by_fish: dict = {fish: za.get_recognition_indices_by_window(same, diff_fish[fish], 250,
+                                                                                window_frames)
+                                     for fish, same in same_fish.items()}
+
+    # Swap it round to dict[time_period][fish]
+    sliced_measures: dict = {}
+    for fish_name, periods in sliced_measures_by_fish.items():
+        for period_name, measures in periods.items():
+            sliced_measures.setdefault(period_name, {})[fish_name] = measures
+
+    # Now we have sliced measures, we'll put them into the dataset so I can do proper statistics in R
+
+    for n, time_period in sliced_measures.items():
+        df_for_exp = pd.DataFrame(time_period).transpose().rename_axis('fish').reset_index()
+        writer.write(df_for_exp, month=month, window=n)
+
+
+def export_dataset(name: str,
+                   partition_by: tuple = ('month',)) -> za.DatasetWriter:
+    """
+    Opens the dataset an analysis writes its results to, in EXPORT_FORMAT
+    :param name: Directory of the dataset, in the working directory
+    :param partition_by: Keys to split it up by
+    :return: za.DatasetWriter, to use in a with block
+    """
+    return za.DatasetWriter(os.getcwd() + f"/{name}", partition_by, EXPORT_FORMAT)
@@ -9,6 +9,7 @@ library(ggpubr)
 library(rstatix)
 library(forcats)
 library(data.table)
+library(arrow)
 options(scipen=20000)
 
 # This is PURELY to make pretty charts. No real analysis is happening here, and most of the charts can be easily
@@ -24,6 +25,11 @@ scales::show_col(safe_colorblind_palette)
 
 # LOAD AND MEDDLE WITH DATA
 
+# Should match EXPORT_FORMAT in helpers.py
+export_format <- "parquet"
+# Extension of single file exports in each format, as EXPORT_FORMATS in export.py
+export_extension <- c(parquet = ".parquet", feather = ".arrow", csv = ".csv")[[export_format]]
+
 full_data_m_1 <- read.csv("all_fish_by_fish.csv")
 full_data_m_2 <- read.csv("two_month_fish_measures.csv")
 
@@ -40,18 +46,21 @@ full_data_m_2$age <- "2 month"
 
 full_data <- rbind(full_data_m_1, full_data_m_2)
 
-file_list <- list.files(pattern="export_\\d+.csv")
-
-period_data <- as_tibble(do.call(rbind, lapply(
-  file_list, function(x) cbind(read.csv(x), 
-                               period=strtoi(str_extract(x, "[0-9]+"))))))
-
-file_list2 <- list.files(pattern="export_2month_\\d+.csv")
-
-period_data2 <- as_tibble(
-  do.call(rbind, lapply(
-    file_list2, function(x) cbind(read.csv(x), 
-                                  period=strtoi(str_extract(x, "(?<=month_)[0-9]+"))))))
+windowed_measures <- open_dataset("windowed_measures", format = export_format)
+
+period_data <- windowed_measures %>% 
+  filter(month == 1) %>% 
+  collect() %>% 
+  select(-month) %>% 
+  dplyr::rename(X = fish, period = window) %>% 
+  as_tibble()
+
+period_data2 <- windowed_measures %>% 
+  filter(month == 2) %>% 
+  collect() %>% 
+  select(-month) %>% 
+  dplyr::rename(X = fish, period = window) %>% 
+  as_tibble()
 period_data$period = period_data$period / 60/60
 period_data2$period = period_data2$period / 60/60
 
@@ -327,14 +336,32 @@ dist_by_period[!rowSums(dist_by_period['period'] >= 144000),] %>%
 
 # SPEEDS
 
-same_speeds <- read.csv("speeds_same_1m.csv", header = FALSE)
-names(same_speeds) <- c("speed", "frame")
-diff_speeds <- read.csv("speeds_diff_1m.csv", header = FALSE)
-names(diff_speeds) <- c("speed", "frame")
-same_speeds$trial <- 'Training Phase'
-diff_speeds$trial <- 'Testing Phase'
-
-full_speeds <- rbind(same_speeds, diff_speeds)
+speeds <- open_dataset("speeds", format = export_format)
+
+# Training phase first, then testing, as the charts take their order from the data
+load_speeds <- function(age) {
+  speeds %>% 
+    filter(month == age, near == "all") %>% 
+    select(speed = speed_cm, frame = frame_id, trial) %>% 
+    collect() %>% 
+    arrange(desc(trial)) %>% 
+    mutate(trial = ifelse(trial == "same", "Training Phase", "Testing Phase")) %>% 
+    as.data.frame()
+}
+
+load_speeds_by_obj <- function(age) {
+  speeds %>% 
+    filter(month == age, near != "all") %>% 
+    select(speed = speed_cm, frame = frame_id, trial, near) %>% 
+    collect() %>% 
+    arrange(desc(trial), near) %>% 
+    mutate(trial = paste0(ifelse(trial == "same", "Training", "Testing"), ": Object ",
+                          toupper(str_sub(near, -1)))) %>% 
+    select(-near) %>% 
+    as.data.frame()
+}
+
+full_speeds <- load_speeds(1)
 
 full_s_bxp_fill <- c("Training Phase" = safe_colorblind_palette[2],
                      "Testing Phase" = safe_colorblind_palette[4])
@@ -356,19 +383,7 @@ full_speed_line <- full_speeds %>%
 annotation_custom(grobTree(textGrob("A", x=0.02,  y=0.95, hjust=0.0, gp=gpar(col="black", fontsize=10))))
 
 
-same_obj_a_v <- read.csv("speeds_same_obj_a.csv", header = FALSE)
-same_obj_b_v <- read.csv("speeds_same_obj_b.csv", header = FALSE)
-diff_obj_a_v <- read.csv("speeds_diff_obj_a.csv", header = FALSE)
-diff_obj_b_v <- read.csv("speeds_diff_obj_b.csv", header = FALSE)
-
-same_obj_a_v$trial <- 'Training: Object A'
-same_obj_b_v$trial <- 'Training: Object B'
-
-diff_obj_a_v$trial <- 'Testing: Object A'
-diff_obj_b_v$trial <- 'Testing: Object B'
-
-full_speeds_by_obj <- rbind(same_obj_a_v, same_obj_b_v, diff_obj_a_v, diff_obj_b_v)
-names(full_speeds_by_obj) <- c("speed", 'frame', 'trial')
+full_speeds_by_obj <- load_speeds_by_obj(1)
 
 full_speeds_by_obj %>% 
   ggplot() +
@@ -410,14 +425,7 @@ annotation_custom(grobTree(textGrob("B", x=0.02,  y=0.95, hjust=0.0, gp=gpar(col
 
 # Now all over again for 2 month fish
 
-same_speeds2 <- read.csv("speeds_same_2m.csv", header = FALSE)
-names(same_speeds2) <- c("speed", "frame")
-diff_speeds2 <- read.csv("speeds_diff_2m.csv", header = FALSE)
-names(diff_speeds2) <- c("speed", "frame")
-same_speeds2$trial <- 'Training Phase'
-diff_speeds2$trial <- 'Testing Phase'
-
-full_speeds2 <- rbind(same_speeds2, diff_speeds2)
+full_speeds2 <- load_speeds(2)
 
 full_s_bxp_fill <- c("Training Phase" = safe_colorblind_palette[2],
                      "Testing Phase" = safe_colorblind_palette[4])
@@ -437,19 +445,7 @@ full_speed_line2 <- full_speeds2 %>%
   scale_fill_manual(labels = c("Training Phase", "Testing Phase"), values = c(safe_colorblind_palette[2], safe_colorblind_palette[4])) +
 annotation_custom(grobTree(textGrob("D", x=0.02,  y=0.95, hjust=0.0, gp=gpar(col="black", fontsize=10))))
 
-same_obj_a_v2 <- read.csv("speeds_same_obj_a2.csv", header = FALSE)
-same_obj_b_v2 <- read.csv("speeds_same_obj_b2.csv", header = FALSE)
-diff_obj_a_v2 <- read.csv("speeds_diff_obj_a2.csv", header = FALSE)
-diff_obj_b_v2 <- read.csv("speeds_diff_obj_b2.csv", header = FALSE)
-
-same_obj_a_v2$trial <- 'Training: Object A'
-same_obj_b_v2$trial <- 'Training: Object B'
-
-diff_obj_a_v2$trial <- 'Testing: Object A'
-diff_obj_b_v2$trial <- 'Testing: Object B'
-
-full_speeds_by_obj2 <- rbind(same_obj_a_v2, same_obj_b_v2, diff_obj_a_v2, diff_obj_b_v2)
-names(full_speeds_by_obj2) <- c("speed", 'frame', 'trial')
+full_speeds_by_obj2 <- load_speeds_by_obj(2)
 
 full_speeds_by_obj2 %>% 
   ggplot() +
@@ -495,17 +491,22 @@ grid.arrange(full_speed_line, full_speed_bxp, obj_speeds, full_speed_line2, full
 
 # ACCELERATIONS!
 
-full_accs_1_m_s <- read.csv("acc_sds_same.csv")
-full_accs_1_m_d <- read.csv("acc_sds_diff.csv")
+# One column per recording plus the summary across them, which isn't a recording so is left out.
+# Melted before binding, so the trials don't need the same number of fish
+load_acc_sds <- function(name, trial) {
+  open_dataset(paste0(name, export_extension), format = export_format) %>% 
+    collect() %>% 
+    as.data.frame() %>% 
+    select(-any_of(c("n", "mean", "sd", "ci_low", "ci_high"))) %>% 
+    melt(id = "frame_id") %>% 
+    mutate(trial = trial)
+}
 
-full_accs_1_m_s$trial <- 'Training Phase'
-full_accs_1_m_d$trial <- 'Testing Phase'
-
-full_accs_1_m <- rbind(full_accs_1_m_s, full_accs_1_m_d)
+full_accs_1_m <- rbind(load_acc_sds("acc_sds_same_1m", 'Training Phase'),
+                       load_acc_sds("acc_sds_diff_1m", 'Testing Phase'))
 
 accs_1m_line <- full_accs_1_m %>% 
-  melt(id = c("X", 'trial')) %>% 
-  ggplot(aes(x = X/60/60, y = value, color = fct_inorder(trial), fill = fct_inorder(trial))) +
+  ggplot(aes(x = frame_id/60/60, y = value, color = fct_inorder(trial), fill = fct_inorder(trial))) +
   geom_smooth() +
   theme(
     plot.title = element_text(hjust = 0.5),
@@ -522,7 +523,6 @@ annotation_custom(grobTree(textGrob("A", x=0.02,  y=0.95, hjust=0.0, gp=gpar(col
 
 
 accs_1m_bxp <- full_accs_1_m %>% 
-  melt(id = c("X", 'trial')) %>% 
   ggplot(aes(x = fct_inorder(trial), y = value)) +
   geom_boxplot(outlier.shape = NA, fill = full_s_bxp_fill) +
   coord_cartesian(ylim = c(0, 5500)) +
@@ -533,17 +533,11 @@ axis.title.x = element_blank()) +
   stat_compare_means(comparisons = list(c("Training Phase", "Testing Phase")), label = "p.signif", method = "t.test", label.y = 4500) +
   annotation_custom(grobTree(textGrob("B", x=0.02,  y=0.95, hjust=0.0, gp=gpar(col="black", fontsize=10))))
 
-full_accs_2_m_s <- read.csv("acc_sds_same2.csv")
-full_accs_2_m_d <- read.csv("acc_sds_diff2.csv")
-
-full_accs_2_m_s$trial <- 'Training Phase'
-full_accs_2_m_d$trial <- 'Testing Phase'
-
-full_accs_2_m <- rbind(full_accs_2_m_s, full_accs_2_m_d)
+full_accs_2_m <- rbind(load_acc_sds("acc_sds_same_2m", 'Training Phase'),
+                       load_acc_sds("acc_sds_diff_2m", 'Testing Phase'))
   
 accs_2m_line <- full_accs_2_m %>% 
-  melt(id = c("X", "trial")) %>% 
-    ggplot(aes(x = X/60/60, y = value, color = fct_inorder(trial), fill = fct_inorder(trial))) +
+    ggplot(aes(x = frame_id/60/60, y = value, color = fct_inorder(trial), fill = fct_inorder(trial))) +
     geom_smooth() +
     theme(
       plot.title = element_text(hjust = 0.5),
@@ -561,7 +555,6 @@ accs_2m_line <- full_accs_2_m %>%
   
   
 accs_2m_bxp <- full_accs_2_m %>% 
-  melt(id = c("X", "trial")) %>% 
     ggplot(aes(x = fct_inorder(trial), y = value)) +
     geom_boxplot(outlier.shape = NA, fill = full_s_bxp_fill) +
     coord_cartesian(ylim = c(0, 5000)) +
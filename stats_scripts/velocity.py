@@ -1,52 +1,55 @@
 from data_dicts import *
 from helpers import *
 import zebrafishanalysis as za
-import os
-import numpy as np
 
-def export_speeds(same_fish, diff_fish, month):
-    speeds_same = [fish.drop_errors(factor='speed', cutoff=2500)[['speed_cm', 'frame_id']].to_numpy()
-                  for fish in same_fish.values()]
-    speeds_diff = [fish.drop_errors(factor='speed', cutoff=2500)[['speed_cm', 'frame_id']].to_numpy()
-                  for fish in diff_fish.values()]
+# velocity only ever looks at these, so there's no point calculating the other kinematics
+SPEED_METRICS: tuple = ('speed', 'speed_cm')
 
-    np.savetxt(f"speeds_same_{month}m.csv", np.vstack(speeds_same), delimiter=',')
-    np.savetxt(f"speeds_diff_{month}m.csv", np.vstack(speeds_diff), delimiter=',')
+def write_speeds(writer, speeds, trial, month, near='all'):
+    # One table per fish, so the fish stays with its speeds in the dataset
+    for fish, df in speeds.items():
+        writer.write(df, fish=fish, near=near, month=month, trial=trial)
 
-def speeds_restricted(same_fish, diff_fish, month):
-    speeds_same_obj_a = [fish.trim_based_on_objs('obj_a', 200, df = fish.drop_errors(factor='speed', cutoff=2500))[['speed_cm', 'frame_id']].to_numpy()
-                  for fish in same_fish.values()]
-    speeds_same_obj_b = [fish.trim_based_on_objs('obj_b', 200, df = fish.drop_errors(factor='speed', cutoff=2500))[['speed_cm', 'frame_id']].to_numpy()
-                  for fish in same_fish.values()]
+def export_speeds(same_fish, diff_fish, month, writer):
+    speeds_same = za.BatchQuery(same_fish).drop_errors('speed', 2500).select('speed_cm', 'frame_id').to_dataframe()
+    speeds_diff = za.BatchQuery(diff_fish).drop_errors('speed', 2500).select('speed_cm', 'frame_id').to_dataframe()
 
-    speeds_diff_obj_a = [fish.trim_based_on_objs('obj_a', 200, df = fish.drop_errors(factor='speed', cutoff=2500))[['speed_cm', 'frame_id']].to_numpy()
-                  for fish in diff_fish.values()]
-    speeds_diff_obj_b = [fish.trim_based_on_objs('obj_b', 200, df = fish.drop_errors(factor='speed', cutoff=2500))[['speed_cm', 'frame_id']].to_numpy()
-                  for fish in diff_fish.values()]
+    write_speeds(writer, speeds_same, 'same', month)
+    write_speeds(writer, speeds_diff, 'diff', month)
 
-    np.savetxt(f"speeds_same_obj_a_{month}m.csv", np.vstack(speeds_same_obj_a), delimiter=',')
-    np.savetxt(f"speeds_same_obj_b_{month}m.csv", np.vstack(speeds_same_obj_b), delimiter=',')
+def speeds_restricted(same_fish, diff_fish, month, writer):
+    # The speed filter is the same for both objects, so it's worked out once per fish and reused
+    same_without_errors = za.BatchQuery(same_fish).drop_errors('speed', 2500).select('speed_cm', 'frame_id')
+    diff_without_errors = za.BatchQuery(diff_fish).drop_errors('speed', 2500).select('speed_cm', 'frame_id')
 
-    np.savetxt(f"speeds_diff_obj_a_{month}m.csv", np.vstack(speeds_diff_obj_a), delimiter=',')
-    np.savetxt(f"speeds_diff_obj_b_{month}m.csv", np.vstack(speeds_diff_obj_b), delimiter=',')
+    speeds_same_obj_a = same_without_errors.near('obj_a', 200).to_dataframe()
+    speeds_same_obj_b = same_without_errors.near('obj_b', 200).to_dataframe()
+
+    speeds_diff_obj_a = diff_without_errors.near('obj_a', 200).to_dataframe()
+    speeds_diff_obj_b = diff_without_errors.near('obj_b', 200).to_dataframe()
+
+    write_speeds(writer, speeds_same_obj_a, 'same', month, 'obj_a')
+    write_speeds(writer, speeds_same_obj_b, 'same', month, 'obj_b')
+
+    write_speeds(writer, speeds_diff_obj_a, 'diff', month, 'obj_a')
+    write_speeds(writer, speeds_diff_obj_b, 'diff', month, 'obj_b')
 
 if __name__ == "__main__":
-    same_fish_1m = {fish: load_fish(fish, same=True) for fish in os.listdir("nor_data")}
-    diff_fish_1m = {fish: load_fish(fish, same=False) for fish in os.listdir("nor_data")}
+    # Every speed goes in the one dataset, with near saying whether it's all of them or just those near an object
+    writer = export_dataset("speeds", ('month', 'trial'))
 
-    remove_region(same_fish_1m, regions_to_remove_same)
-    remove_region(diff_fish_1m, regions_to_remove_diff)
+    same_fish_1m = load_all_fish(same=True, metrics=SPEED_METRICS)
+    diff_fish_1m = load_all_fish(same=False, metrics=SPEED_METRICS)
 
-    export_speeds(same_fish_1m, diff_fish_1m, 1)
-    speeds_restricted(same_fish_1m, diff_fish_1m, 1)
+    export_speeds(same_fish_1m, diff_fish_1m, 1, writer)
+    speeds_restricted(same_fish_1m, diff_fish_1m, 1, writer)
 
-    same_fish_2m = {fish: load_fish(fish, same=True, month=2) for fish in os.listdir("month_2")}
-    diff_fish_2m = {fish: load_fish(fish, same=False, month=2) for fish in os.listdir("month_2")}
+    same_fish_2m = load_all_fish(same=True, month=2, metrics=SPEED_METRICS)
+    diff_fish_2m = load_all_fish(same=False, month=2, metrics=SPEED_METRICS)
 
-    remove_region(same_fish_2m, regions_to_remove_same_two_month)
-    remove_region(diff_fish_2m, regions_to_remove_diff_two_month)
+    export_speeds(same_fish_2m, diff_fish_2m, 2, writer)
+    speeds_restricted(same_fish_2m, diff_fish_2m, 2, writer)
 
-    export_speeds(same_fish_2m, diff_fish_2m, 2)
-    speeds_restricted(same_fish_2m, diff_fish_2m, 2)
+    writer.close()
 
 
@@ -1,5 +1,24 @@
+from zebrafishanalysis.cache import *
+from zebrafishanalysis.compact import *
+from zebrafishanalysis.derived import *
+from zebrafishanalysis.export import *
+from zebrafishanalysis.frames import *
+from zebrafishanalysis.gaps import *
+from zebrafishanalysis.heatmaps import *
+from zebrafishanalysis.kinematics import *
+from zebrafishanalysis.occupancy import *
+from zebrafishanalysis.polygons import *
+from zebrafishanalysis.query import *
+from zebrafishanalysis.rolling import *
+from zebrafishanalysis.storage import *
+from zebrafishanalysis.video import *
+from zebrafishanalysis.views import *
 from zebrafishanalysis.utils import *
 from zebrafishanalysis.structs import *
 from zebrafishanalysis.stats import *
+from zebrafishanalysis.batch import *
+from zebrafishanalysis.streaming import *
+from zebrafishanalysis.artefacts import *
+from zebrafishanalysis.calibration import *
 
 pd.options.mode.chained_assignment = None  # default='warn'
@@ -0,0 +1,133 @@
+import numpy as np
+from scipy import ndimage
+from zebrafishanalysis.batch import map_experiment
+from zebrafishanalysis.cache import TrajectoryCache
+from zebrafishanalysis.kinematics import fish_offsets
+from zebrafishanalysis.occupancy import bin_positions
+from zebrafishanalysis.structs import TrajectoryObject
+
+
+def artefact_regions(x: np.ndarray,
+                     y: np.ndarray,
+                     offsets: np.ndarray = None,
+                     frame_ids: np.ndarray = None,
+                     cell_size: float = 10.,
+                     dwell_mads: float = 10.,
+                     min_frames: int = 600,
+                     max_speed_sd: float = 0.1,
+                     step_clip: float = 1.,
+                     padding: float = None) -> list:
+    """
+    Finds spots where the tracker has latched onto something static (a reflection, a mark on the tank) rather than
+    the fish, and proposes polygons for remove_polygon_from_frames to take them out, like the hand drawn ones in
+    data_dicts.
+    Positions are binned into cell_size cells. A real fish can sit in one place for a while, but it still wobbles
+    about; a tracker stuck on an artefact piles up frames in one cell while hardly moving at all. So cells are flagged
+    where both the dwell time is an outlier (more than dwell_mads scaled MADs above the median of the occupied cells,
+    and at least min_frames) and the sd of the step length of the frames in them is under max_speed_sd. Step lengths
+    are clipped at step_clip first, so the few big steps on and off a spot don't hide how still the tracker was in
+    between. Touching flagged cells are merged, and each group gives one rectangle around it.
+    :param x: X positions, with each fish's rows contiguous and in frame order
+    :param y: Y positions, same order
+    :param offsets: Fish boundaries, see fish_offsets. Defaults to treating positions as one fish
+    :param frame_ids: frame_id of each row. If given, no step is taken across missing frames
+    :param cell_size: Width/height of each cell in pixels
+    :param dwell_mads: How far out (in scaled MADs) a cell's dwell time has to be to count as abnormal
+    :param min_frames: Fewest frames a cell needs to be flagged, however unusual
+    :param max_speed_sd: Largest sd of step length (pixels per frame) in a flagged cell
+    :param step_clip: Step length (pixels per frame) to clip at before taking sds
+    :param padding: Pixels to pad each rectangle by, defaults to one cell
+    :return: list of polygons, each a list of [X, Y] vertices
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) == 0:
+        return []
+    if padding is None:
+        padding = cell_size
+
+    # Step length into each row, with no step at the start of each fish or across a gap
+    steps: np.ndarray = np.full(len(x), np.NaN)
+    steps[1:] = np.hypot(np.diff(x), np.diff(y))
+    starts: np.ndarray = np.zeros(len(x), dtype=bool)
+    starts[0] = True
+    if offsets is not None:
+        fish_starts: np.ndarray = np.asarray(offsets[:-1], dtype=np.int64)
+        starts[fish_starts[fish_starts < len(x)]] = True
+    if frame_ids is not None and len(x) > 1:
+        starts[1:] |= np.diff(np.asarray(frame_ids, dtype=np.int64)) != 1
+    steps[starts] = np.NaN
+    steps = np.minimum(steps, step_clip)
+
+    cells, shape = bin_positions(x, y, cell_size)
+    on_grid: np.ndarray = cells >= 0
+    size: int = shape[0] * shape[1]
+    dwell: np.ndarray = np.bincount(cells[on_grid], minlength=size)
+
+    moving: np.ndarray = on_grid & ~np.isnan(steps)
+    step_counts: np.ndarray = np.bincount(cells[moving], minlength=size)
+    step_sums: np.ndarray = np.bincount(cells[moving], weights=steps[moving], minlength=size)
+    step_squares: np.ndarray = np.bincount(cells[moving], weights=steps[moving] ** 2, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        step_means: np.ndarray = step_sums / step_counts
+        step_sds: np.ndarray = np.sqrt(np.maximum(step_squares / step_counts - step_means ** 2, 0))
+
+    occupied: np.ndarray = dwell[dwell > 0]
+    if len(occupied) == 0:
+        return []
+    median: float = float(np.median(occupied))
+    mad: float = 1.4826 * float(np.median(np.abs(occupied - median)))
+    flagged: np.ndarray = (dwell >= max(min_frames, median + dwell_mads * mad)) & (step_counts > 1) & \
+                          (step_sds <= max_speed_sd)
+
+    labels, _ = ndimage.label(flagged.reshape(shape), structure=np.ones((3, 3)))
+    regions: list = []
+    for rows, cols in ndimage.find_objects(labels):
+        x_min: float = cols.start * cell_size - padding
+        x_max: float = cols.stop * cell_size + padding
+        y_min: float = rows.start * cell_size - padding
+        y_max: float = rows.stop * cell_size + padding
+        regions.append([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]])
+    return regions
+
+
+def find_artefacts(tr: TrajectoryObject,
+                   **params) -> list:
+    """
+    artefact_regions for a loaded recording
+    :param tr: TrajectoryObject
+    :param params: Passed on to artefact_regions
+    :return: list of polygons, each a list of [X, Y] vertices
+    """
+    return artefact_regions(tr.column('x_pos'), tr.column('y_pos'), fish_offsets(tr.column('fish_id')),
+                            tr.column('frame_id'), **params)
+
+
+def find_experiment_artefacts(data_dir: str,
+                              file_name: str,
+                              fish_ids: list = None,
+                              workers: int = None,
+                              cache: TrajectoryCache = None,
+                              **params) -> dict:
+    """
+    Runs artefact_regions over every recording of one trial of an experiment in parallel, see map_experiment. The
+    result can go straight into load_experiment as regions_to_remove.
+    :param data_dir: Directory containing one directory per fish
+    :param file_name: Name of the trajectories/video files, without extension (e.g. same_obj)
+    :param fish_ids: Fish to check, defaults to every directory in data_dir
+    :param workers: Number of processes to use, defaults to the number of CPUs
+    :param cache: Cache of processed trajectories to use
+    :param params: Passed on to map_experiment (invert_y, data_ext, vid_ext) or artefact_regions
+    :return: dict of fish id: list of polygons
+    """
+    return map_experiment(_positions_artefact_regions, data_dir, file_name, fish_ids, workers, cache, **params)
+
+
+def _positions_artefact_regions(positions: np.ndarray,
+                                **params) -> list:
+    """
+    artefact_regions for a (frames, fish, 2) positions array, taken fish by fish as in positions_df
+    """
+    num_frames, num_fish, _ = positions.shape
+    return artefact_regions(positions[:, :, 0].T.ravel(), positions[:, :, 1].T.ravel(),
+                            np.arange(num_fish + 1) * num_frames, **params)
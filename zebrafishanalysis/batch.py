@@ -0,0 +1,234 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from zebrafishanalysis.cache import TrajectoryCache
+from zebrafishanalysis.structs import NovelObjectRecognitionTest
+from zebrafishanalysis.utils import load_gapless_trajectories
+from zebrafishanalysis.video import get_video_metadata
+
+# Arrays packed into shared memory are aligned to this many bytes
+_ALIGNMENT: int = 64
+# Workers hand arrays back in memory-mapped files here. /dev/shm is RAM backed, so nothing actually hits the disk
+_SHARED_DIR: str = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+# Attributes that are either rebuilt when positions_df is set or cheap to work out again, so aren't sent back
+_UNSHARED_ATTRIBUTES: tuple = ('positions', '_positions_df', '_occupancy_index', '_segment_index', '_query_cache',
+                               '_heatmap_cache')
+
+
+def load_experiment(data_dir: str,
+                    file_name: str,
+                    object_locations: dict,
+                    left_wall_coords: dict,
+                    regions_to_remove: dict = None,
+                    fish_ids: list = None,
+                    workers: int = None,
+                    metrics: tuple = None,
+                    cache: TrajectoryCache = None,
+                    invert_y: bool = True,
+                    period: slice = None,
+                    data_ext: str = ".npy",
+                    vid_ext: str = ".mp4",
+                    compact: bool = False) -> dict:
+    """
+    Loads every recording of one trial of an experiment into NovelObjectRecognitionTests, spread across a pool of
+    processes. Expects the layout {data_dir}/{fish_id}/{file_name}{data_ext}, with the video next to it.
+    Workers hand their arrays back through memory-mapped shared memory rather than pickling whole dataframes, so this
+    scales to many cores without the parent spending all its time unpickling.
+    :param data_dir: Directory containing one directory per fish
+    :param file_name: Name of the trajectories/video files, without extension (e.g. same_obj)
+    :param object_locations: dict of fish id: ((obj_a_X, obj_a_Y), (obj_b_X, obj_b_Y))
+    :param left_wall_coords: dict of fish id: coords of the ends of the left wall
+    :param regions_to_remove: dict of fish id: list of polygons to remove. Polygons can be lists of vertices or anything
+    with a .v attribute holding them
+    :param fish_ids: Fish to load, defaults to every directory in data_dir
+    :param workers: Number of processes to use, defaults to the number of CPUs. 1 loads everything in this process
+    :param metrics: Kinematic columns to calculate, see TrajectoryObject
+    :param cache: Cache of processed trajectories to use
+    :param invert_y: Invert y positions, see TrajectoryObject
+    :param period: Slice of frames to keep, see TrajectoryObject
+    :param data_ext: Extension of trajectory files
+    :param vid_ext: Extension of video files
+    :param compact: Keep positions_df in compact dtypes, see TrajectoryObject
+    :return: dict of fish id: NovelObjectRecognitionTest
+    """
+    if fish_ids is None:
+        fish_ids = sorted(fish for fish in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, fish)))
+    if regions_to_remove is None:
+        regions_to_remove = {}
+
+    jobs: list = [{'fish_id': fish,
+                   'trajectories_path': os.path.join(data_dir, fish, file_name + data_ext),
+                   'video_path': os.path.join(data_dir, fish, file_name + vid_ext),
+                   'object_locations': object_locations[fish],
+                   'left_wall_coords': left_wall_coords[fish],
+                   'regions_to_remove': [getattr(polygon, 'v', polygon) for polygon in regions_to_remove.get(fish, [])],
+                   'metrics': metrics,
+                   'cache': cache,
+                   'invert_y': invert_y,
+                   'period': period,
+                   'compact': compact} for fish in fish_ids]
+
+    if workers == 1:
+        return {job['fish_id']: _load_recording(job) for job in jobs}
+
+    loaded: dict = {}
+    pool: ProcessPoolExecutor = ProcessPoolExecutor(max_workers=workers)
+    futures: list = [pool.submit(_load_shared_recording, job) for job in jobs]
+    try:
+        for future in as_completed(futures):
+            fish, state, shared = future.result()
+            loaded[fish] = _unshare_object(NovelObjectRecognitionTest, state, shared)
+    finally:
+        # If a job failed, the recordings that did load are still sat in shared memory, which is RAM. Anything not
+        # started is dropped, and we wait for the rest so their files can go too
+        pool.shutdown(wait=True, cancel_futures=True)
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                _remove_shared(future.result()[2])
+    # Keep the order fish were asked for in, rather than the order they finished in
+    return {fish: loaded[fish] for fish in fish_ids}
+
+
+def map_experiment(func,
+                   data_dir: str,
+                   file_name: str,
+                   fish_ids: list = None,
+                   workers: int = None,
+                   cache: TrajectoryCache = None,
+                   invert_y: bool = True,
+                   data_ext: str = ".npy",
+                   vid_ext: str = ".mp4",
+                   **params) -> dict:
+    """
+    Runs a function over the positions of every recording of one trial of an experiment, spread across a pool of
+    processes. Only the trajectories are loaded, not whole objects, so this is much quicker than load_experiment for
+    anything that just needs to look at where the fish went. Expects the same layout as load_experiment.
+    :param func: Module level function taking (positions, **params), positions being an np.ndarray of shape (frames,
+    fish, 2) in the same coordinates as positions_df
+    :param data_dir: Directory containing one directory per fish
+    :param file_name: Name of the trajectories/video files, without extension (e.g. same_obj)
+    :param fish_ids: Fish to run over, defaults to every directory in data_dir
+    :param workers: Number of processes to use, defaults to the number of CPUs. 1 does everything in this process
+    :param cache: Cache of processed trajectories to use
+    :param invert_y: Invert y positions, as TrajectoryObject does. Needs the video (or its entry in the metadata
+    index) for its height
+    :param data_ext: Extension of trajectory files
+    :param vid_ext: Extension of video files
+    :param params: Passed on to func
+    :return: dict of fish id: whatever func returned
+    """
+    if fish_ids is None:
+        fish_ids = sorted(fish for fish in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, fish)))
+
+    jobs: list = [{'func': func,
+                   'trajectories_path': os.path.join(data_dir, fish, file_name + data_ext),
+                   'video_path': os.path.join(data_dir, fish, file_name + vid_ext),
+                   'cache': cache,
+                   'invert_y': invert_y,
+                   'params': params} for fish in fish_ids]
+
+    if workers == 1:
+        return {fish: _map_recording(job) for fish, job in zip(fish_ids, jobs)}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(fish_ids, pool.map(_map_recording, jobs)))
+
+
+def _map_recording(job: dict):
+    """
+    Worker side of map_experiment
+    """
+    positions: np.ndarray = load_gapless_trajectories(job['trajectories_path'], cache=job['cache']).s
+    if job['invert_y']:
+        positions[:, :, 1] = get_video_metadata(job['video_path']).height - positions[:, :, 1]
+    return job['func'](positions, **job['params'])
+
+
+def _load_recording(job: dict) -> NovelObjectRecognitionTest:
+    """
+    Loads and cleans up a single recording
+    """
+    tr = NovelObjectRecognitionTest(load_gapless_trajectories(job['trajectories_path'], cache=job['cache']),
+                                    object_locations=job['object_locations'],
+                                    left_wall_coords=job['left_wall_coords'],
+                                    video_path=job['video_path'],
+                                    invert_y=job['invert_y'],
+                                    period=job['period'],
+                                    metrics=job['metrics'],
+                                    cache=job['cache'],
+                                    compact=job['compact'])
+    if job['regions_to_remove']:
+        tr.remove_polygon_from_frames(job['regions_to_remove'], inplace=True)
+    return tr
+
+
+def _load_shared_recording(job: dict) -> tuple:
+    """
+    Worker side of load_experiment. Loads a recording, then packs its arrays into shared memory
+    :return: tuple: (fish id, picklable state of the object, shared memory description from _share_object)
+    """
+    tr: NovelObjectRecognitionTest = _load_recording(job)
+    state, shared = _share_object(tr)
+    return job['fish_id'], state, shared
+
+
+def _share_object(tr: NovelObjectRecognitionTest) -> tuple:
+    """
+    Packs positions and every column (and the index) of positions_df into one memory-mapped file. Everything else
+    on the object is small, so gets pickled as normal.
+    :return: tuple: (object __dict__ minus the arrays and caches, (path of the file, [(key, dtype, shape, offset), ...]))
+    """
+    arrays: dict = {('positions', None): tr.positions, ('index', None): tr.positions_df.index.to_numpy()}
+    for column in tr.positions_df.columns:
+        arrays[('column', column)] = tr.positions_df[column].to_numpy()
+
+    layout: list = []
+    offset: int = 0
+    for key, array in arrays.items():
+        layout.append((key, array.dtype.str, array.shape, offset))
+        offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+    handle, path = tempfile.mkstemp(suffix='.za', dir=_SHARED_DIR)
+    os.close(handle)
+    block: np.memmap = np.memmap(path, dtype=np.uint8, mode='w+', shape=(max(offset, 1),))
+    for (key, dtype, shape, start), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=block, offset=start)[...] = array
+    block.flush()
+    del block
+
+    state: dict = {name: value for name, value in tr.__dict__.items() if name not in _UNSHARED_ATTRIBUTES}
+    return state, (path, layout)
+
+
+def _unshare_object(cls: type,
+                    state: dict,
+                    shared: tuple):
+    """
+    Rebuilds an object packed by _share_object, copying its arrays out of shared memory and removing the file
+    """
+    path, layout = shared
+    try:
+        block: np.memmap = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays: dict = {key: np.ndarray(shape, dtype=dtype, buffer=block, offset=start).copy()
+                        for key, dtype, shape, start in layout}
+        del block
+    finally:
+        _remove_shared(shared)
+
+    obj = cls.__new__(cls)
+    obj.__dict__.update(state)
+    obj.positions = arrays.pop(('positions', None))
+    index: np.ndarray = arrays.pop(('index', None))
+    obj.positions_df = pd.DataFrame({column: array for (_, column), array in arrays.items()}, index=index)
+    return obj
+
+
+def _remove_shared(shared: tuple) -> None:
+    """
+    Removes the file behind a _share_object description, if it's still there
+    """
+    try:
+        os.remove(shared[0])
+    except FileNotFoundError:
+        pass
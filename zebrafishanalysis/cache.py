@@ -0,0 +1,280 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+import trajectorytools as tt
+from PIL import Image
+from zebrafishanalysis.compact import pack_mask, unpack_mask
+
+
+# Name the dataframe index is stored under in .npz entries
+_INDEX_KEY: str = '__index__'
+# Boolean columns are bit-packed, and stored under their name with this prefix
+_PACKED_PREFIX: str = '__bits__'
+
+
+class TrajectoryCache:
+    """
+    On-disk cache of processed trajectories, positions dataframes, video frames and small results, so repeat runs can
+    skip interpolating, smoothing, building dataframes and decoding video. Entries are keyed by the source file (path,
+    size and mtime, or a hash of its contents) and every parameter that affects the result, so changing either just
+    gives a cache miss. The least recently used entries are evicted once the cache grows past max_size_mb.
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 max_size_mb: float = 4096,
+                 hash_contents: bool = False):
+        """
+        :param cache_dir: Directory to keep cached files in, created if it doesn't exist
+        :param max_size_mb: Size the cache is trimmed down to after each write
+        :param hash_contents: Identify source files by a hash of their contents rather than their size and mtime.
+        Slower, but survives files being copied around
+        """
+        self.cache_dir: str = cache_dir
+        self.max_size_mb: float = max_size_mb
+        self.hash_contents: bool = hash_contents
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self,
+                 source_path: str,
+                 **params) -> str:
+        """
+        Builds a cache key for a source file and set of parameters
+        :param source_path: File the cached data was derived from
+        :param params: Anything else that affects the cached data. Must be JSON serialisable once numpy types and
+        slices are converted
+        :return: str: Key of form {source hash}_{params hash}
+        """
+        source_path = os.path.abspath(source_path)
+        stat: os.stat_result = os.stat(source_path)
+        if self.hash_contents:
+            source_id: str = _hash_file(source_path)
+        else:
+            source_id: str = f"{stat.st_size}:{stat.st_mtime_ns}"
+
+        params_json: str = json.dumps({'source_id': source_id, **params}, sort_keys=True, default=_to_json)
+        return f"{_hash_str(source_path)}_{_hash_str(params_json)}"
+
+    def load_trajectories(self,
+                          path: str,
+                          interpolate_nans: bool = True,
+                          smooth: dict = None) -> tt.Trajectories:
+        """
+        Loads trajectories from an idtrackerai file through the cache, processing and storing them on a miss
+        :param path: Path to numpy file
+        :param interpolate_nans: When loading from idtrackerai interpolate NaN values
+        :param smooth: Define how to smooth params when loading from idtrackerai
+        :return: tt.Trajectories: Processed trajectories, straight out of tt.Trajectories.from_idtrackerai
+        """
+        key: str = self.make_key(path, kind='trajectories', interpolate_nans=interpolate_nans, smooth=smooth)
+        entry_path: str = self._entry_path(key, '.npy')
+
+        try:
+            trajectories: tt.Trajectories = tt.Trajectories.load(entry_path)
+            self._touch(entry_path)
+            logging.info(f'Loaded cached trajectories for {path}')
+            return trajectories
+        except FileNotFoundError:
+            # Never cached, or evicted by another process since
+            pass
+
+        trajectories: tt.Trajectories = tt.Trajectories.from_idtrackerai(path,
+                                                                        interpolate_nans=interpolate_nans,
+                                                                        smooth_params=smooth)
+        self._write(entry_path, lambda f: np.save(f, trajectories._dict_to_save()))
+        return trajectories
+
+    def get_dataframe(self,
+                      key: str) -> pd.DataFrame:
+        """
+        Gets a cached dataframe
+        :param key: Key from make_key
+        :return: pd.DataFrame, or None if it isn't cached
+        """
+        entry_path: str = self._entry_path(key, '.npz')
+        try:
+            columns = np.load(entry_path)
+        except FileNotFoundError:
+            return None
+
+        self._touch(entry_path)
+        with columns:
+            index: np.ndarray = columns[_INDEX_KEY]
+            df_columns: dict = {}
+            for name in columns.files:
+                if name.startswith(_PACKED_PREFIX):
+                    df_columns[name[len(_PACKED_PREFIX):]] = unpack_mask(columns[name], len(index))
+                elif name != _INDEX_KEY:
+                    df_columns[name] = columns[name]
+            return pd.DataFrame(df_columns, index=index)
+
+    def put_dataframe(self,
+                      key: str,
+                      df: pd.DataFrame) -> None:
+        """
+        Stores a dataframe column by column, along with its index. Boolean columns are bit-packed.
+        :param key: Key from make_key
+        :param df: Dataframe to store
+        """
+        columns: dict = {}
+        for name in df.columns:
+            if df[name].dtype == bool:
+                columns[_PACKED_PREFIX + name] = pack_mask(df[name].to_numpy())
+            else:
+                columns[name] = df[name].to_numpy()
+        columns[_INDEX_KEY] = df.index.to_numpy()
+        self._write(self._entry_path(key, '.npz'), lambda f: np.savez(f, **columns))
+
+    def get_frame(self,
+                  key: str) -> np.ndarray:
+        """
+        Gets a cached video frame
+        :param key: Key from make_key
+        :return: np.ndarray of shape (height, width, 3), or None if it isn't cached
+        """
+        entry_path: str = self._entry_path(key, '.png')
+        try:
+            image: Image.Image = Image.open(entry_path)
+        except FileNotFoundError:
+            return None
+
+        self._touch(entry_path)
+        with image:
+            return np.asarray(image.convert('RGB'))
+
+    def put_frame(self,
+                  key: str,
+                  frame: np.ndarray) -> None:
+        """
+        Stores a video frame as a PNG, so it can be opened in any image viewer too
+        :param key: Key from make_key
+        :param frame: uint8 np.ndarray of shape (height, width, 3)
+        """
+        self._write(self._entry_path(key, '.png'), lambda f: Image.fromarray(frame).save(f, format='PNG'))
+
+    def get_json(self,
+                 key: str):
+        """
+        Gets a small cached result stored as JSON
+        :param key: Key from make_key
+        :return: The stored object, or None if it isn't cached
+        """
+        entry_path: str = self._entry_path(key, '.json')
+        try:
+            f = open(entry_path)
+        except FileNotFoundError:
+            return None
+
+        self._touch(entry_path)
+        with f:
+            return json.load(f)
+
+    def put_json(self,
+                 key: str,
+                 obj) -> None:
+        """
+        Stores a small result as JSON
+        :param key: Key from make_key
+        :param obj: Anything JSON serialisable once numpy types are converted
+        """
+        self._write(self._entry_path(key, '.json'), lambda f: f.write(json.dumps(obj, default=_to_json).encode()))
+
+    def invalidate(self,
+                   source_path: str = None) -> None:
+        """
+        Removes cached entries
+        :param source_path: Only remove entries derived from this file. Removes everything if None
+        """
+        prefix: str = '' if source_path is None else _hash_str(os.path.abspath(source_path)) + '_'
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(prefix):
+                _remove_if_exists(os.path.join(self.cache_dir, entry))
+
+    def size_mb(self) -> float:
+        """
+        :return: float: Total size of cached entries in MB
+        """
+        return sum(os.path.getsize(os.path.join(self.cache_dir, entry)) for entry in os.listdir(self.cache_dir)) / 1e6
+
+    def _entry_path(self,
+                    key: str,
+                    ext: str) -> str:
+        return os.path.join(self.cache_dir, key + ext)
+
+    def _write(self,
+               entry_path: str,
+               writer) -> None:
+        """
+        Writes to a temp file then moves it into place, so other processes never see a half written entry
+        """
+        tmp_path: str = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            writer(f)
+        os.replace(tmp_path, entry_path)
+        self._evict()
+
+    @staticmethod
+    def _touch(entry_path: str) -> None:
+        # mtime doubles as last used time for eviction. An entry evicted by another process since it was opened has
+        # nothing left to touch
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        """
+        Removes least recently used entries until the cache is under max_size_mb. Other processes sharing the cache
+        (e.g. load_experiment's workers) may be evicting at the same time, so entries can vanish at any point.
+        """
+        entries: list = []
+        for entry in os.listdir(self.cache_dir):
+            if entry.endswith('.tmp'):
+                continue
+            try:
+                stat: os.stat_result = os.stat(os.path.join(self.cache_dir, entry))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total: float = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size_mb * 1e6:
+                break
+            _remove_if_exists(os.path.join(self.cache_dir, entry))
+            total -= size
+
+
+def _remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _hash_str(s: str) -> str:
+    return hashlib.sha1(s.encode()).hexdigest()[:16]
+
+
+def _hash_file(path: str) -> str:
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _to_json(obj):
+    """
+    Converts the odd types that end up in cache keys (numpy values, slices) to something json can handle
+    """
+    if isinstance(obj, slice):
+        return [obj.start, obj.stop, obj.step]
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Can't use {type(obj)} in a cache key")
@@ -0,0 +1,260 @@
+import os
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon
+from zebrafishanalysis.batch import map_experiment
+from zebrafishanalysis.cache import TrajectoryCache
+from zebrafishanalysis.structs import TrajectoryObject
+
+# Real length of the arena's left wall, which TrajectoryObject takes pixel_dist_cm from
+WALL_LENGTH_CM: float = 11.
+
+
+class ArenaCalibration:
+    """
+    Where the arena is in a recording, worked out from the trajectories by calibrate_arena. Stands in for the hand
+    measured left_wall_coords and central region polygons.
+    """
+
+    def __init__(self,
+                 corners: np.ndarray,
+                 wall_length_cm: float = WALL_LENGTH_CM):
+        """
+        :param corners: (4, 2) array of the arena's corners, in the same order as the central_regions dicts: low x
+        high y, high x high y, high x low y, low x low y
+        :param wall_length_cm: Real length of the left wall
+        """
+        self.corners: np.ndarray = np.asarray(corners, dtype=np.float64)
+        self.wall_length_cm: float = wall_length_cm
+
+    @property
+    def left_wall_coords(self) -> list:
+        """
+        :return: list: Ends of the left wall, as passed to TrajectoryObject as left_wall_coords
+        """
+        return [self.corners[0].tolist(), self.corners[3].tolist()]
+
+    @property
+    def wall_length(self) -> float:
+        """
+        :return: float: Length of the left wall in pixels
+        """
+        return float(np.hypot(*(self.corners[0] - self.corners[3])))
+
+    @property
+    def pixel_dist_cm(self) -> float:
+        """
+        :return: float: cm per pixel, as TrajectoryObject works it out
+        """
+        return self.wall_length_cm / self.wall_length
+
+    def central_region(self,
+                       inset_cm: float = 1.) -> list:
+        """
+        The arena shrunk by a distance from every wall, for edge analysis
+        :param inset_cm: Distance from the walls in cm
+        :return: list of [X, Y] vertices, in the same order as corners
+        """
+        return inset_polygon(self.corners, inset_cm / self.pixel_dist_cm).tolist()
+
+    def to_dict(self) -> dict:
+        return {'corners': self.corners.tolist(), 'wall_length_cm': self.wall_length_cm}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'ArenaCalibration':
+        return cls(**d)
+
+    def __repr__(self) -> str:
+        return f"ArenaCalibration(left wall {self.wall_length:.1f} px, {self.pixel_dist_cm:.5f} cm per px)"
+
+
+def calibrate_arena(x: np.ndarray,
+                    y: np.ndarray,
+                    trim: float = 0.001,
+                    wall_margin: float = 0.,
+                    max_points: int = 50000,
+                    wall_length_cm: float = WALL_LENGTH_CM) -> ArenaCalibration:
+    """
+    Estimates the arena from where the fish went. Fish spend plenty of time along the walls, so the arena is taken as
+    the smallest rectangle (at any angle) holding all but a trim fraction of the positions beyond each side, which
+    ignores the odd tracking glitch outside the tank. Every angle is tried at once on a coarse grid, then again
+    finely around the best one, so this is a few vectorised passes over at most max_points positions.
+    :param x: X positions, of any number of fish
+    :param y: Y positions
+    :param trim: Fraction of positions allowed beyond each side
+    :param wall_margin: Pixels to push each side out by, e.g. half a body width, as the fish's centre never quite
+    reaches the wall
+    :param max_points: Most positions to use, evenly spaced through the recording
+    :param wall_length_cm: Real length of the left wall
+    :return: ArenaCalibration
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    valid: np.ndarray = np.isfinite(x) & np.isfinite(y)
+    if not valid.any():
+        raise ValueError("Can't calibrate an arena without any positions")
+    points: np.ndarray = np.column_stack((x[valid], y[valid]))
+    points = points[::max(1, len(points) // max_points)]
+
+    # A rectangle looks the same turned by 90 degrees, so angles within 45 of the x axis cover everything, and keep
+    # the first side along x. The coarse pass only has to get near the best angle, so makes do with fewer points
+    angles: np.ndarray = np.deg2rad(np.arange(-45., 45., 2.))
+    coarse: np.ndarray = points[::max(1, len(points) // 10000)]
+    best: float = angles[np.argmin(_trimmed_extents(coarse, angles, trim)[0])]
+    angles = best + np.deg2rad(np.arange(-2., 2.05, 0.1))
+    areas, lows, highs = _trimmed_extents(points, angles, trim)
+    i: int = int(np.argmin(areas))
+
+    u: np.ndarray = np.array([np.cos(angles[i]), np.sin(angles[i])])
+    v: np.ndarray = np.array([-u[1], u[0]])
+    (u_low, v_low), (u_high, v_high) = lows[i] - wall_margin, highs[i] + wall_margin
+    corners: np.ndarray = np.array([u_low * u + v_high * v,
+                                    u_high * u + v_high * v,
+                                    u_high * u + v_low * v,
+                                    u_low * u + v_low * v])
+    return ArenaCalibration(corners, wall_length_cm)
+
+
+def _trimmed_extents(points: np.ndarray,
+                     angles: np.ndarray,
+                     trim: float) -> tuple:
+    """
+    Trimmed extent of points along each angle and its perpendicular
+    :return: tuple: (area of each rectangle, (angles, 2) lows, (angles, 2) highs), lows and highs being along the angle
+    then its perpendicular
+    """
+    u: np.ndarray = np.column_stack((np.cos(angles), np.sin(angles)))
+    v: np.ndarray = np.column_stack((-u[:, 1], u[:, 0]))
+    # (points, angles, 2) projections onto each pair of axes
+    projections: np.ndarray = np.stack((points @ u.T, points @ v.T), axis=-1)
+    lows, highs = np.quantile(projections, [trim, 1 - trim], axis=0)
+    extents: np.ndarray = highs - lows
+    return extents[:, 0] * extents[:, 1], lows, highs
+
+
+def inset_polygon(vertices: np.ndarray,
+                  distance: float) -> np.ndarray:
+    """
+    Moves every edge of a convex polygon inwards by a distance, keeping the same number of vertices
+    :param vertices: (n, 2) array of vertices, in order either way round
+    :param distance: Pixels to move each edge by
+    :return: np.ndarray of the new vertices, in the same order
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    directions: np.ndarray = np.roll(vertices, -1, axis=0) - vertices
+    directions /= np.hypot(directions[:, 0], directions[:, 1])[:, None]
+    normals: np.ndarray = np.column_stack((-directions[:, 1], directions[:, 0]))
+    # Point the normals at the middle of the polygon, whichever way round it's wound
+    normals *= np.sign(np.sum((vertices.mean(axis=0) - vertices) * normals, axis=1))[:, None]
+    starts: np.ndarray = vertices + distance * normals
+
+    # Vertex i is where the moved edges i - 1 and i meet
+    previous_starts: np.ndarray = np.roll(starts, 1, axis=0)
+    previous_directions: np.ndarray = np.roll(directions, 1, axis=0)
+    cross: np.ndarray = previous_directions[:, 0] * directions[:, 1] - previous_directions[:, 1] * directions[:, 0]
+    offset: np.ndarray = starts - previous_starts
+    t: np.ndarray = (offset[:, 0] * directions[:, 1] - offset[:, 1] * directions[:, 0]) / cross
+    return previous_starts + t[:, None] * previous_directions
+
+
+def calibrate_recording(tr: TrajectoryObject,
+                        **params) -> ArenaCalibration:
+    """
+    calibrate_arena for a loaded recording
+    :param tr: TrajectoryObject
+    :param params: Passed on to calibrate_arena
+    :return: ArenaCalibration
+    """
+    return calibrate_arena(tr.column('x_pos'), tr.column('y_pos'), **params)
+
+
+def calibrate_experiment(data_dir: str,
+                         file_name: str,
+                         fish_ids: list = None,
+                         workers: int = None,
+                         cache: TrajectoryCache = None,
+                         invert_y: bool = True,
+                         data_ext: str = ".npy",
+                         vid_ext: str = ".mp4",
+                         **params) -> dict:
+    """
+    Calibrates every recording of one trial of an experiment in parallel, see map_experiment. Calibrations are kept
+    in cache if given, so only new (or changed) recordings are worked out again.
+    :param data_dir: Directory containing one directory per fish
+    :param file_name: Name of the trajectories/video files, without extension (e.g. same_obj)
+    :param fish_ids: Fish to calibrate, defaults to every directory in data_dir
+    :param workers: Number of processes to use, defaults to the number of CPUs
+    :param cache: Cache of processed trajectories, and calibrations, to use
+    :param invert_y: Invert y positions, as TrajectoryObject does
+    :param data_ext: Extension of trajectory files
+    :param vid_ext: Extension of video files
+    :param params: Passed on to calibrate_arena
+    :return: dict of fish id: ArenaCalibration
+    """
+    if fish_ids is None:
+        fish_ids = sorted(fish for fish in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, fish)))
+
+    calibrations: dict = {}
+    keys: dict = {}
+    if cache is not None:
+        for fish in fish_ids:
+            keys[fish] = cache.make_key(os.path.join(data_dir, fish, file_name + data_ext), kind='arena_calibration',
+                                        invert_y=invert_y, **params)
+            cached: dict = cache.get_json(keys[fish])
+            if cached is not None:
+                calibrations[fish] = ArenaCalibration.from_dict(cached)
+
+    missing: list = [fish for fish in fish_ids if fish not in calibrations]
+    if missing:
+        new: dict = map_experiment(_calibrate_positions, data_dir, file_name, missing, workers, cache, invert_y,
+                                   data_ext, vid_ext, **params)
+        for fish, calibration in new.items():
+            calibrations[fish] = calibration
+            if cache is not None:
+                cache.put_json(keys[fish], calibration.to_dict())
+    return {fish: calibrations[fish] for fish in fish_ids}
+
+
+def _calibrate_positions(positions: np.ndarray,
+                         **params) -> ArenaCalibration:
+    """
+    calibrate_arena for a (frames, fish, 2) positions array
+    """
+    return calibrate_arena(positions[:, :, 0], positions[:, :, 1], **params)
+
+
+def calibration_report(calibrations: dict,
+                       left_wall_coords: dict = None,
+                       central_regions: dict = None,
+                       inset_cm: float = 1.) -> pd.DataFrame:
+    """
+    Compares calibrations against hand measured walls and central regions
+    :param calibrations: dict of fish id: ArenaCalibration
+    :param left_wall_coords: dict of fish id: hand measured ends of the left wall, e.g. lengths_1m_same
+    :param central_regions: dict of fish id: hand drawn central region, e.g. central_regions_same_1_m
+    :param inset_cm: Inset of the central regions to compare against, see ArenaCalibration.central_region
+    :return: pd.DataFrame with a row per fish: wall_length_px and pixel_dist_cm, then for fish with hand measured
+    walls the hand measured values and the % error in wall length, and for fish with hand drawn central regions the
+    intersection over union of the two regions and the mean distance between their corners
+    """
+    rows: dict = {}
+    for fish, calibration in calibrations.items():
+        row: dict = {'wall_length_px': calibration.wall_length, 'pixel_dist_cm': calibration.pixel_dist_cm}
+
+        if left_wall_coords is not None and fish in left_wall_coords:
+            hand_length: float = float(np.hypot(*np.subtract(*np.asarray(left_wall_coords[fish], dtype=np.float64))))
+            row['hand_wall_length_px'] = hand_length
+            row['hand_pixel_dist_cm'] = calibration.wall_length_cm / hand_length
+            row['wall_length_error_pc'] = (calibration.wall_length - hand_length) / hand_length * 100
+
+        if central_regions is not None and fish in central_regions:
+            estimated: np.ndarray = np.asarray(calibration.central_region(inset_cm))
+            hand: np.ndarray = np.asarray(central_regions[fish], dtype=np.float64)
+            estimated_polygon, hand_polygon = Polygon(estimated), Polygon(hand)
+            row['central_iou'] = estimated_polygon.intersection(hand_polygon).area / \
+                estimated_polygon.union(hand_polygon).area
+            # Hand drawn corners aren't always in the same order, so each is matched to the nearest estimated one
+            distances: np.ndarray = np.hypot(*(hand[:, None, :] - estimated[None, :, :]).transpose(2, 0, 1))
+            row['central_corner_error_px'] = float(distances.min(axis=1).mean())
+        rows[fish] = row
+    return pd.DataFrame(rows).transpose()
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# dtypes used by compact mode. Ids are stored exactly: int32 frame ids cover ~400 days at 60fps, and uint16 fish ids
+# cover 65535 fish. Everything else that's a float becomes float32, which holds 24 significant bits, so:
+#   - positions are within 2 ** -24 * 2048 ~= 0.00012 px of the float64 value anywhere in a 2048 px wide frame
+#   - kinematics are calculated in float64 from those positions, then rounded to within a relative 2 ** -24 (~6e-8).
+#     The rounding of the positions dominates, so distance is within ~0.00025 px per frame, and speed within
+#     ~0.00025 * frame_rate px/s (0.015 px/s at 60fps)
+#   - dist_obj_a/dist_obj_b are within ~0.0003 px, so only points that close to an exploration radius could change
+#     which side of it they fall
+# Boolean flags are kept as bool, and bit-packed (8 to a byte) when written to disk by TrajectoryCache.
+COMPACT_ID_DTYPES: dict = {'frame_id': np.int32, 'fish_id': np.uint16}
+COMPACT_FLOAT_DTYPE: np.dtype = np.dtype(np.float32)
+MASK_COLUMNS: tuple = ('fish_match', 'freezing')
+
+
+def compact_dataframe(df: pd.DataFrame,
+                      inplace: bool = False) -> pd.DataFrame:
+    """
+    Converts a positions_df to the compact dtypes above
+    :param df: Dataframe to convert
+    :param inplace: Convert df's columns in place rather than returning a converted copy
+    :return: pd.DataFrame
+    """
+    if inplace is False:
+        df = df.copy()
+
+    for name in df.columns:
+        column: pd.Series = df[name]
+        if name in COMPACT_ID_DTYPES:
+            df[name] = column.to_numpy().astype(COMPACT_ID_DTYPES[name], copy=False)
+        elif name in MASK_COLUMNS:
+            # Older dataframes can hold flags as objects (with NaNs from shifting), which are just not set
+            df[name] = column.fillna(False).to_numpy().astype(bool, copy=False)
+        elif pd.api.types.is_float_dtype(column.dtype):
+            df[name] = column.to_numpy().astype(COMPACT_FLOAT_DTYPE, copy=False)
+    return df
+
+
+def is_compact(df: pd.DataFrame) -> bool:
+    """
+    Checks if a dataframe already uses the compact dtypes
+    :param df: Dataframe to check
+    :return: bool
+    """
+    for name, dtype in df.dtypes.items():
+        if name in COMPACT_ID_DTYPES and dtype != COMPACT_ID_DTYPES[name]:
+            return False
+        if name not in COMPACT_ID_DTYPES and pd.api.types.is_float_dtype(dtype) and dtype != COMPACT_FLOAT_DTYPE:
+            return False
+    return True
+
+
+def pack_mask(mask: np.ndarray) -> np.ndarray:
+    """
+    Packs a boolean mask 8 values to a byte
+    :param mask: Array of bools
+    :return: np.ndarray of uint8, an eighth of the length (rounded up)
+    """
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+
+def unpack_mask(packed: np.ndarray,
+                length: int) -> np.ndarray:
+    """
+    Reverses pack_mask
+    :param packed: Packed mask
+    :param length: Length of the original mask
+    :return: np.ndarray of bools
+    """
+    return np.unpackbits(packed, count=length).astype(bool)
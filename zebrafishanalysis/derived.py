@@ -0,0 +1,139 @@
+import numpy as np
+from typing import Callable
+
+
+class DerivedColumn:
+    """
+    A column of positions_df worked out from other columns of the same fish, e.g. freezing from distance. A row's value
+    may only depend on the inputs of rows up to before rows earlier and after rows later (in the same fish), so when
+    some inputs change, only the rows near them need working out again. See update_derived_columns.
+    """
+
+    def __init__(self,
+                 name: str,
+                 inputs: tuple,
+                 compute: Callable,
+                 before: int = 0,
+                 after: int = 0):
+        """
+        :param name: Column to fill
+        :param inputs: Columns it's worked out from
+        :param compute: Function taking ({input name: np.ndarray}, offsets) for some rows, sorted by fish then frame
+        with fish boundaries at offsets, and returning the column for those rows
+        :param before: How many rows back a row's value can look
+        :param after: How many rows ahead a row's value can look
+        """
+        self.name: str = name
+        self.inputs: tuple = tuple(inputs)
+        self.compute: Callable = compute
+        self.before: int = before
+        self.after: int = after
+
+    def __repr__(self) -> str:
+        return f"DerivedColumn({self.name} from {', '.join(self.inputs)})"
+
+
+def update_derived_columns(columns: dict,
+                           derived: list,
+                           changed: dict,
+                           offsets: np.ndarray) -> dict:
+    """
+    Patches derived columns after some of their inputs changed. Changes are followed through derived in order, so a
+    column made from another derived column should come after it.
+    :param columns: dict of {column name: np.ndarray} holding every input and derived column. Derived columns are
+    patched in place
+    :param derived: DerivedColumns to keep up to date
+    :param changed: dict of {column name: rows changed}
+    :param offsets: Fish boundaries, see fish_offsets
+    :return: dict: changed, plus the rows of each derived column worked out again
+    """
+    changed = dict(changed)
+    for column in derived:
+        changed_inputs: list = [changed[name] for name in column.inputs if name in changed]
+        if not changed_inputs:
+            continue
+        rows: np.ndarray = np.unique(np.concatenate(changed_inputs).astype(np.int64))
+        if len(rows) == 0:
+            continue
+
+        # A change at row r reaches back to the rows looking ahead to it, and on to the rows looking back to it
+        fish: np.ndarray = np.searchsorted(offsets, rows, side='right') - 1
+        lo, hi, fish, _ = merge_row_ranges(np.maximum(rows - column.after, offsets[fish]),
+                                           np.minimum(rows + column.before, offsets[fish + 1] - 1), fish)
+        changed[column.name] = patch_ranges({name: columns[name] for name in column.inputs},
+                                            {column.name: columns[column.name]},
+                                            _as_dict(column),
+                                            lo, hi, np.maximum(lo - column.before, offsets[fish]),
+                                            np.minimum(hi + column.after + 1, offsets[fish + 1]))
+    return changed
+
+
+def patch_ranges(inputs: dict,
+                 outputs: dict,
+                 compute: Callable,
+                 lo: np.ndarray,
+                 hi: np.ndarray,
+                 context_start: np.ndarray,
+                 context_end: np.ndarray) -> np.ndarray:
+    """
+    Works out rows lo[i]:hi[i] (inclusive) of some columns again, from the rows context_start[i]:context_end[i] around
+    them. All the stretches are gathered up and worked out in one call, each treated as if it were its own fish, so
+    there's no per stretch overhead.
+    :param inputs: dict of {column name: np.ndarray} to work from
+    :param outputs: dict of {column name: np.ndarray} to patch in place
+    :param compute: Function taking ({input name: np.ndarray}, offsets) and returning {output name: np.ndarray}
+    :param lo: First row of each stretch to redo
+    :param hi: Last row of each stretch to redo
+    :param context_start: First row each stretch's values can depend on
+    :param context_end: One past the last row each stretch's values can depend on
+    :return: np.ndarray: Rows redone
+    """
+    context_offsets: np.ndarray = np.concatenate(([0], np.cumsum(context_end - context_start)))
+    context: np.ndarray = ranges_to_rows(context_start, context_end - 1)
+    patch: dict = compute({name: column[context] for name, column in inputs.items()}, context_offsets)
+
+    redone: np.ndarray = ranges_to_rows(lo, hi)
+    # Where each redone row ended up among the gathered ones
+    source: np.ndarray = ranges_to_rows(context_offsets[:-1] + lo - context_start,
+                                        context_offsets[:-1] + hi - context_start)
+    for name, column in outputs.items():
+        column[redone] = patch[name][source]
+    return redone
+
+
+def _as_dict(column: DerivedColumn) -> Callable:
+    """
+    Wraps a DerivedColumn's compute to return {name: column}, as patch_ranges expects
+    """
+    return lambda inputs, offsets: {column.name: column.compute(inputs, offsets)}
+
+
+def merge_row_ranges(lo: np.ndarray,
+                     hi: np.ndarray,
+                     fish: np.ndarray) -> tuple:
+    """
+    Merges inclusive row ranges that overlap or touch, without merging across fish
+    :param lo: First row of each range, in order
+    :param hi: Last row of each range
+    :param fish: Fish of each range
+    :return: tuple: (lo, hi, fish) of the merged ranges, and the index of the first range going into each of them (to
+    combine anything else kept per range with reduceat)
+    """
+    if len(lo) == 0:
+        return lo, hi, fish, np.zeros(0, dtype=np.int64)
+    new_range: np.ndarray = (lo[1:] > np.maximum.accumulate(hi)[:-1] + 1) | (fish[1:] != fish[:-1])
+    starts: np.ndarray = np.flatnonzero(np.concatenate(([True], new_range)))
+    return lo[starts], np.maximum.reduceat(hi, starts), fish[starts], starts
+
+
+def ranges_to_rows(lo: np.ndarray,
+                   hi: np.ndarray) -> np.ndarray:
+    """
+    Lists every row of some inclusive, non-overlapping ranges
+    :param lo: First row of each range
+    :param hi: Last row of each range
+    :return: np.ndarray of rows
+    """
+    lengths: np.ndarray = np.asarray(hi) - np.asarray(lo) + 1
+    return np.repeat(np.asarray(lo) - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + \
+        np.arange(lengths.sum())
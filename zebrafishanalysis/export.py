@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Formats a dataset can be written in, with the extension of their files. Parquet and feather (Arrow IPC) keep column
+# types and are far smaller and quicker than text; csv is there for anything that can't read them. Any of them can be
+# read back as one table by R's arrow package, e.g.
+#   arrow::open_dataset("speeds", format = "parquet") %>% filter(month == 1) %>% collect()
+# (format = "feather" or "csv" for the others), or by pyarrow.dataset.dataset("speeds", partitioning="hive")
+EXPORT_FORMATS: dict = {'parquet': '.parquet', 'feather': '.arrow', 'csv': '.csv'}
+
+
+class DatasetWriter:
+    """
+    Writes all the results of one analysis as a single dataset: a directory split up hive-style by the partition
+    columns, e.g. speeds/month=1/trial=same/part-0.parquet. Tables are written along with keys (fish, trial, month,
+    window, ...) saying where they came from, which become columns of the dataset, so there's no globbing and
+    rbinding of files to get everything back. Rows are held per partition and written out rows_per_file at a time.
+        with DatasetWriter("speeds", partition_by=('month', 'trial')) as writer:
+            writer.write(df, fish='m_1_f_4', trial='same', month=1)
+    """
+
+    def __init__(self,
+                 path: str,
+                 partition_by: tuple = (),
+                 format: str = 'parquet',
+                 rows_per_file: int = 5000000):
+        """
+        Part files left in path by an earlier run are removed, so they don't end up mixed in with the new ones
+        :param path: Directory to write the dataset to
+        :param partition_by: Keys to split the dataset into subdirectories by. Every write has to give these
+        :param format: One of EXPORT_FORMATS
+        :param rows_per_file: Most rows to put in one file
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {format}, expected one of {tuple(EXPORT_FORMATS)}")
+        self.path: str = path
+        self.partition_by: tuple = tuple(partition_by)
+        self.format: str = format
+        self.rows_per_file: int = rows_per_file
+        # dict of {partition directory: [tables waiting to be written, rows in them, files written so far]}
+        self._pending: dict = {}
+
+        # Bottom up, so partition directories emptied out can go too
+        for directory, _, files in os.walk(path, topdown=False):
+            for file in files:
+                if file.startswith('part-') and file.endswith(tuple(EXPORT_FORMATS.values())):
+                    os.remove(os.path.join(directory, file))
+            if directory != path and not os.listdir(directory):
+                os.rmdir(directory)
+        os.makedirs(path, exist_ok=True)
+
+    def write(self,
+              table,
+              **keys) -> None:
+        """
+        Adds a table to the dataset
+        :param table: pd.DataFrame, or dict of {column name: np.ndarray}
+        :param keys: Values saying where the table came from, e.g. fish='m_1_f_4', month=1. Partition keys go into
+        the directory name, the rest are added as columns (before the table's own)
+        """
+        missing: list = [key for key in self.partition_by if key not in keys]
+        if missing:
+            raise ValueError(f"Missing partition keys {missing} when writing to {self.path}")
+
+        table = pd.DataFrame(table).reset_index(drop=True)
+        columns: list = [key for key in keys if key not in self.partition_by]
+        for position, key in enumerate(columns):
+            table.insert(position, key, np.repeat(keys[key], len(table)))
+
+        directory: str = os.path.join(self.path, *[f"{key}={keys[key]}" for key in self.partition_by])
+        pending: list = self._pending.setdefault(directory, [[], 0, 0])
+        pending[0].append(table)
+        pending[1] += len(table)
+        if pending[1] >= self.rows_per_file:
+            self._flush(directory)
+
+    def close(self) -> None:
+        """
+        Writes out everything still held
+        """
+        for directory in list(self._pending):
+            self._flush(directory)
+
+    def _flush(self,
+               directory: str) -> None:
+        """
+        Writes the tables held for one partition, rows_per_file rows per file
+        """
+        tables, num_rows, num_files = self._pending[directory]
+        if num_rows == 0:
+            return
+        os.makedirs(directory, exist_ok=True)
+        combined: pd.DataFrame = pd.concat(tables, ignore_index=True)
+        for start in range(0, num_rows, self.rows_per_file):
+            part: pd.DataFrame = combined.iloc[start:start + self.rows_per_file].reset_index(drop=True)
+            file: str = os.path.join(directory, f"part-{num_files}{EXPORT_FORMATS[self.format]}")
+            if self.format == 'parquet':
+                part.to_parquet(file, index=False)
+            elif self.format == 'feather':
+                part.to_feather(file)
+            else:
+                part.to_csv(file, index=False)
+            num_files += 1
+        self._pending[directory] = [[], 0, num_files]
+
+    def __enter__(self) -> 'DatasetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import av
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from zebrafishanalysis.cache import TrajectoryCache
+
+# Ways get_reference_frame can pick the frame shown behind polygon selection etc.:
+#   - 'first': the first frame of the video
+#   - 'median': the background, see background_frame
+REFERENCE_METHODS: tuple = ('first', 'median')
+
+# In process memo of {(absolute path, size, mtime, method, samples): frame}
+_frame_memo: dict = {}
+
+
+def read_frames(path: str,
+                times: list,
+                exact: bool = False) -> list:
+    """
+    Reads frames at some times in a video by seeking, rather than decoding everything before them. The video is only
+    opened once however many frames are read.
+    :param path: Path to the video
+    :param times: Times, in seconds, to read frames at
+    :param exact: Decode on from the keyframe before each time to the frame at it. Otherwise the keyframe itself is
+    returned, which is far quicker and fine for anything that doesn't need a particular frame
+    :return: list of uint8 np.ndarrays of shape (height, width, 3), in the same order as times
+    """
+    with _open_video(path) as container:
+        return [_seek_frame(container, time, exact).to_ndarray(format='rgb24') for time in times]
+
+
+def _open_video(path: str):
+    """
+    Opens a video for decoding, letting FFmpeg use threads within each frame
+    """
+    container = av.open(path)
+    container.streams.video[0].thread_type = 'AUTO'
+    return container
+
+
+def _seek_frame(container,
+                time: float,
+                exact: bool) -> av.VideoFrame:
+    """
+    Reads the frame at (or the keyframe before, if not exact) a time from an open video
+    """
+    stream = container.streams.video[0]
+    container.seek((stream.start_time or 0) + int(time / stream.time_base), stream=stream, backward=True,
+                   any_frame=False)
+    frame = None
+    for frame in container.decode(stream):
+        if not exact or frame.time is None or frame.time >= time - 0.5 / float(stream.average_rate or 60):
+            break
+    if frame is None:
+        raise ValueError(f"Couldn't read a frame at {time}s from {container.name}")
+    return frame
+
+
+def read_frame(path: str,
+               time: float = 0.0) -> np.ndarray:
+    """
+    Reads the frame at a time in a video
+    :param path: Path to the video
+    :param time: Time, in seconds
+    :return: uint8 np.ndarray of shape (height, width, 3)
+    """
+    return read_frames(path, [time], exact=True)[0]
+
+
+def video_duration(path: str) -> float:
+    """
+    Gets the length of a video from its container, without decoding anything
+    :param path: Path to the video
+    :return: float: Length in seconds
+    """
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        if stream.duration is not None:
+            return float(stream.duration * stream.time_base)
+        return container.duration / av.time_base
+
+
+def sample_times(duration: float,
+                 num_samples: int) -> np.ndarray:
+    """
+    Spreads sample times evenly across a video, each in the middle of its share of it, so the very start and end
+    (often the experimenter's hand, or a fade) aren't sampled
+    :param duration: Length of the video in seconds
+    :param num_samples: Number of times
+    :return: np.ndarray of times in seconds
+    """
+    return (np.arange(num_samples) + 0.5) * duration / num_samples
+
+
+def sample_frames(path: str,
+                  times: list,
+                  workers: int = 4,
+                  batch_size: int = 32,
+                  exact: bool = False):
+    """
+    Reads the keyframes at (or just before) some times in a video, or the exact frames if asked, decoding them in a
+    thread pool. PyAV lets go of the GIL while decoding, so threads are enough. Each thread keeps its own container
+    open, as they can't be shared.
+    Times landing on a frame that's already been read are skipped, so in video with few keyframes (a long GOP) far
+    fewer frames than times can come back.
+    :param path: Path to the video
+    :param times: Times, in seconds, to read frames at
+    :param workers: Threads to decode with
+    :param batch_size: Most frames to have read but not yet handed over at once
+    :param exact: Decode on to the frame at each time rather than stopping at the keyframe, see read_frames
+    :return: Generator of uint8 np.ndarrays of shape (height, width, 3), in the same order as times
+    """
+    local: threading.local = threading.local()
+    containers: list = []
+
+    def read(time: float) -> tuple:
+        if not hasattr(local, 'container'):
+            local.container = _open_video(path)
+            containers.append(local.container)
+        frame = _seek_frame(local.container, time, exact)
+        return frame.pts, frame.to_ndarray(format='rgb24')
+
+    seen: set = set()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(times), batch_size):
+                for pts, frame in executor.map(read, times[start:start + batch_size]):
+                    if pts is None or pts not in seen:
+                        seen.add(pts)
+                        yield frame
+    finally:
+        for container in containers:
+            container.close()
+
+
+def background_frame(path: str,
+                     num_samples: int = 25,
+                     workers: int = 4,
+                     max_frames_in_memory: int = 32,
+                     chunk_rows: int = 64,
+                     min_distinct: float = 0.5) -> np.ndarray:
+    """
+    Works out a clean background for a video: the per pixel median of num_samples frames spread across it, so fish
+    and anything else moving about drop out. Only keyframes are decoded, found by seeking, so the cost depends on
+    num_samples rather than the length of the video. In video with few keyframes many sample times land on the same
+    one, so if fewer than min_distinct of the samples are different frames, they're taken again decoding on to the
+    exact frame at each time, which is slower but doesn't leave the fish sat in the background.
+    Up to max_frames_in_memory samples the median is exact. Past that, samples are taken max_frames_in_memory at a
+    time and replaced by their median, and those medians in turn (the remedian, Rousseeuw & Bassett 1990), so memory
+    stays bounded however many samples are taken.
+    :param path: Path to the video
+    :param num_samples: Frames to take the median of
+    :param workers: Threads to decode with
+    :param max_frames_in_memory: Most frames to take the median of in one go
+    :param chunk_rows: Rows of pixels to work out the median of at a time, to bound temporary memory
+    :param min_distinct: Fewest distinct keyframes, as a fraction of num_samples, before decoding exact frames
+    :return: uint8 np.ndarray of shape (height, width, 3)
+    """
+    times: np.ndarray = sample_times(video_duration(path), num_samples)
+    background, num_frames = _remedian(sample_frames(path, times, workers, max_frames_in_memory),
+                                       max_frames_in_memory, chunk_rows)
+    if num_frames < min_distinct * num_samples:
+        logging.warning(f'Only {num_frames} of {num_samples} samples of {path} were different keyframes, decoding '
+                        f'exact frames for its background instead')
+        background, num_frames = _remedian(sample_frames(path, times, workers, max_frames_in_memory, exact=True),
+                                           max_frames_in_memory, chunk_rows)
+    if num_frames < num_samples:
+        logging.info(f'Background of {path} is the median of {num_frames} different frames, of {num_samples} samples')
+    return background
+
+
+def _remedian(frames,
+              max_frames_in_memory: int,
+              chunk_rows: int) -> tuple:
+    """
+    Remedian of some frames, see background_frame
+    :return: tuple: (median frame, number of frames)
+    """
+    # levels[i] holds frames standing in for max_frames_in_memory ** i samples each
+    levels: list = [[]]
+    num_frames: int = 0
+    for frame in frames:
+        num_frames += 1
+        levels[0].append(frame)
+        level: int = 0
+        while len(levels[level]) == max_frames_in_memory:
+            merged: np.ndarray = median_frame(levels[level], chunk_rows=chunk_rows)
+            levels[level] = []
+            if level + 1 == len(levels):
+                levels.append([])
+            levels[level + 1].append(merged)
+            level += 1
+
+    frames: list = [frame for level in levels for frame in level]
+    weights: np.ndarray = np.concatenate([np.full(len(level), max_frames_in_memory ** i)
+                                          for i, level in enumerate(levels)])
+    return median_frame(frames, weights, chunk_rows), num_frames
+
+
+def median_frame(frames: list,
+                 weights: np.ndarray = None,
+                 chunk_rows: int = 64) -> np.ndarray:
+    """
+    Per pixel (lower) median of some frames, a band of rows at a time
+    :param frames: uint8 np.ndarrays, all the same shape
+    :param weights: How many samples each frame stands in for. Defaults to one each
+    :param chunk_rows: Rows of pixels to work out at a time
+    :return: uint8 np.ndarray, the shape of one frame
+    """
+    stack: np.ndarray = np.stack(frames)
+    median: np.ndarray = np.empty(stack.shape[1:], dtype=stack.dtype)
+    middle: int = (len(frames) - 1) // 2
+    uniform: bool = weights is None or np.all(weights == weights[0])
+
+    for start in range(0, stack.shape[1], chunk_rows):
+        chunk: np.ndarray = stack[:, start:start + chunk_rows]
+        if uniform:
+            median[start:start + chunk_rows] = np.partition(chunk, middle, axis=0)[middle]
+        else:
+            # First value, in order, at which the running weight reaches half the total
+            order: np.ndarray = np.argsort(chunk, axis=0, kind='stable')
+            cumulative: np.ndarray = np.cumsum(np.asarray(weights)[order], axis=0)
+            first: np.ndarray = np.sum(cumulative < cumulative[-1] / 2, axis=0)
+            median[start:start + chunk_rows] = np.take_along_axis(np.take_along_axis(chunk, order, axis=0),
+                                                                  first[np.newaxis], axis=0)[0]
+    return median
+
+
+def get_reference_frame(path: str,
+                        method: str = 'first',
+                        num_samples: int = 25,
+                        cache: TrajectoryCache = None,
+                        workers: int = 4) -> np.ndarray:
+    """
+    Gets a frame to draw on or look at for a video, working it out at most once. Frames are memoised in process, and
+    stored as PNGs in cache if given, so GUIs and batch code working through the same videos share them.
+    :param path: Path to the video
+    :param method: One of REFERENCE_METHODS
+    :param num_samples: Frames to take the median of, for method 'median'
+    :param cache: Cache to keep frames in between runs
+    :param workers: Threads to decode with, for method 'median'
+    :return: uint8 np.ndarray of shape (height, width, 3)
+    """
+    if method not in REFERENCE_METHODS:
+        raise ValueError(f"Unknown reference frame method {method}, expected one of {REFERENCE_METHODS}")
+    if method == 'first':
+        num_samples = 1
+
+    stat: os.stat_result = os.stat(path)
+    memo_key: tuple = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, method, num_samples)
+    frame: np.ndarray = _frame_memo.get(memo_key)
+    if frame is not None:
+        return frame
+
+    cache_key: str = None
+    if cache is not None:
+        cache_key = cache.make_key(path, kind='frame', method=method, num_samples=num_samples)
+        frame = cache.get_frame(cache_key)
+
+    if frame is None:
+        if method == 'first':
+            frame = read_frame(path)
+        else:
+            frame = background_frame(path, num_samples, workers)
+        if cache is not None:
+            cache.put_frame(cache_key, frame)
+
+    _frame_memo[memo_key] = frame
+    return frame
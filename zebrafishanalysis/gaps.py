@@ -0,0 +1,133 @@
+import numpy as np
+
+# How kinematics treat rows with no position (e.g. points removed by remove_polygon_from_frames):
+#   - 'still': a step to or from a missing point counts as not moving, the original behaviour
+#   - 'split': each run of rows with positions is handled as if it were its own fish, so kinematics are NaN at the
+#     start of every run and nothing is worked out across a gap
+#   - 'bridge': missing rows are skipped over, so the step across a gap is scaled by the time it took
+GAP_MODES: tuple = ('still', 'split', 'bridge')
+
+
+class SegmentIndex:
+    """
+    Run-length index of the rows holding a position. Each segment is a run of consecutive rows of one fish with
+    non-NaN x and y, stored as [start, end) row ranges in (fish, frame) order. Lets kinematics be worked out per
+    segment, and be patched up after removing points, without scanning the whole table for NaNs again.
+    """
+
+    def __init__(self,
+                 starts: np.ndarray,
+                 ends: np.ndarray,
+                 offsets: np.ndarray):
+        """
+        :param starts: First row of each segment
+        :param ends: One past the last row of each segment
+        :param offsets: Fish boundaries of the table, see fish_offsets
+        """
+        self.starts: np.ndarray = np.asarray(starts, dtype=np.int64)
+        self.ends: np.ndarray = np.asarray(ends, dtype=np.int64)
+        self.offsets: np.ndarray = np.asarray(offsets, dtype=np.int64)
+        # Number of rows with positions before each segment, i.e. the rank of its first row among them
+        self.ranks: np.ndarray = np.concatenate(([0], np.cumsum(self.ends - self.starts)))
+
+    @classmethod
+    def from_positions(cls,
+                       x: np.ndarray,
+                       y: np.ndarray,
+                       offsets: np.ndarray) -> 'SegmentIndex':
+        """
+        Builds the index from position columns
+        :param x: x_pos column, sorted by fish then frame
+        :param y: y_pos column, same order
+        :param offsets: Fish boundaries, see fish_offsets
+        :return: SegmentIndex
+        """
+        valid: np.ndarray = ~(np.isnan(x) | np.isnan(y))
+        # A segment starts wherever a valid row follows an invalid one, or starts a fish
+        boundary: np.ndarray = np.zeros(len(valid) + 1, dtype=bool)
+        boundary[np.asarray(offsets, dtype=np.int64)] = True
+        edges: np.ndarray = np.diff(np.concatenate(([False], valid, [False])).astype(np.int8))
+        starts: np.ndarray = np.flatnonzero((edges[:-1] == 1) | (boundary[:-1] & valid))
+        ends: np.ndarray = np.flatnonzero((edges[1:] == -1) | (boundary[1:] & valid))
+        return cls(starts, ends + 1, offsets)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def num_valid(self) -> int:
+        """
+        :return: int: Rows holding a position
+        """
+        return int(self.ranks[-1])
+
+    @property
+    def has_gaps(self) -> bool:
+        """
+        :return: bool: True if any row is missing a position, in which case the gap modes give different kinematics
+        """
+        return self.num_valid != self.offsets[-1]
+
+    def rows(self) -> np.ndarray:
+        """
+        :return: np.ndarray: Every row holding a position, in order
+        """
+        lengths: np.ndarray = self.ends - self.starts
+        return np.repeat(self.starts - self.ranks[:-1], lengths) + np.arange(self.num_valid)
+
+    def valid_offsets(self,
+                      by_fish: bool) -> np.ndarray:
+        """
+        Boundaries to pass to compute_kinematics with just the rows from rows()
+        :param by_fish: Give fish boundaries (to bridge gaps), rather than segment boundaries (to split at them)
+        :return: np.ndarray of offsets into rows()
+        """
+        if by_fish:
+            return self.rank_at_or_after(self.offsets)
+        return self.ranks
+
+    def rank_at_or_after(self,
+                         rows: np.ndarray) -> np.ndarray:
+        """
+        Gets the rank among valid rows of the first valid row at or after each of rows
+        :param rows: Row numbers
+        :return: np.ndarray of ranks, num_valid if there's no valid row after
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(self) == 0:
+            return np.zeros(len(rows), dtype=np.int64)
+        segment: np.ndarray = np.searchsorted(self.starts, rows, side='right') - 1
+        inside: np.ndarray = (segment >= 0) & (rows < self.ends[np.maximum(segment, 0)])
+        return np.where(inside, self.ranks[segment + 1] - (self.ends[np.maximum(segment, 0)] - rows),
+                        self.ranks[segment + 1])
+
+    def row_at_rank(self,
+                    ranks: np.ndarray) -> np.ndarray:
+        """
+        Reverses rank_at_or_after for valid rows
+        :param ranks: Ranks among valid rows, below num_valid
+        :return: np.ndarray of row numbers
+        """
+        ranks = np.asarray(ranks, dtype=np.int64)
+        segment: np.ndarray = np.searchsorted(self.ranks, ranks, side='right') - 1
+        return self.starts[segment] + ranks - self.ranks[segment]
+
+    def remove_rows(self,
+                    rows: np.ndarray) -> 'SegmentIndex':
+        """
+        Splits segments around rows that have lost their positions. Only touches the segments, not the table.
+        :param rows: Rows now missing a position, in any order. Rows that were already missing one are ignored
+        :return: SegmentIndex
+        """
+        if len(self) == 0:
+            return self
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        segment: np.ndarray = np.searchsorted(self.starts, rows, side='right') - 1
+        rows = rows[(segment >= 0) & (rows < self.ends[np.maximum(segment, 0)])]
+
+        # Every removed row ends the piece before it and starts the piece after it. Pieces stay in order, as each
+        # removed row lies inside the segment it cuts
+        starts: np.ndarray = np.sort(np.concatenate((self.starts, rows + 1)))
+        ends: np.ndarray = np.sort(np.concatenate((self.ends, rows)))
+        keep: np.ndarray = starts < ends
+        return SegmentIndex(starts[keep], ends[keep], self.offsets)
@@ -0,0 +1,227 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from zebrafishanalysis.occupancy import bin_positions
+from zebrafishanalysis.structs import TrajectoryObject
+
+
+class HeatmapGrid:
+    """
+    The bins occupancy maps are counted in. Maps are only comparable (or averageable) on the same grid, so one grid
+    is normally made for a whole experiment, e.g. HeatmapGrid((0, 1280, 0, 720), 64) for every video of that size.
+    """
+
+    def __init__(self,
+                 extent: tuple,
+                 bins):
+        """
+        :param extent: (x_min, x_max, y_min, y_max) covered by the grid, in pixels
+        :param bins: Number of bins along each axis, or (x bins, y bins)
+        """
+        self.extent: tuple = tuple(float(value) for value in extent)
+        self.bins: tuple = tuple(int(b) for b in np.broadcast_to(bins, (2,)))
+        self.cell_size: tuple = ((self.extent[1] - self.extent[0]) / self.bins[0],
+                                 (self.extent[3] - self.extent[2]) / self.bins[1])
+
+    @classmethod
+    def covering(cls,
+                 objects: list,
+                 bins,
+                 dimensions: tuple = None) -> 'HeatmapGrid':
+        """
+        Makes a grid big enough for some recordings: the whole video if its dimensions are known, otherwise the
+        furthest any position goes
+        :param objects: TrajectoryObjects and/or (n, 2) arrays of positions
+        :param bins: Number of bins along each axis, or (x bins, y bins)
+        :param dimensions: (width, height) of the videos, if not known from the objects
+        :return: HeatmapGrid
+        """
+        if dimensions is None and objects and all(getattr(obj, 'video_dimensions', None) is not None
+                                                  for obj in objects):
+            dimensions = tuple(np.max([obj.video_dimensions for obj in objects], axis=0))
+        if dimensions is not None:
+            return cls((0, dimensions[0], 0, dimensions[1]), bins)
+
+        ranges: list = [(np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y))
+                        for x, y in map(positions_xy, objects) if np.isfinite(x).any()]
+        if not ranges:
+            return cls((0, 1, 0, 1), bins)
+        x_min, x_max, y_min, y_max = np.array(ranges).T
+        # Nudged out a touch, so the furthest points don't land on the far edge and fall off the grid
+        return cls((x_min.min(), np.nextafter(x_max.max(), np.inf), y_min.min(), np.nextafter(y_max.max(), np.inf)),
+                   bins)
+
+    @property
+    def shape(self) -> tuple:
+        """
+        :return: tuple: (rows, cols) of a map, i.e. (y bins, x bins)
+        """
+        return self.bins[1], self.bins[0]
+
+    @property
+    def key(self) -> tuple:
+        return self.extent + self.bins
+
+    def cells(self,
+              x: np.ndarray,
+              y: np.ndarray) -> np.ndarray:
+        """
+        :return: np.ndarray: Cell of each position, -1 for NaNs and positions off the grid
+        """
+        return bin_positions(x, y, self.cell_size, (self.extent[0], self.extent[2]), self.shape)[0]
+
+    def __repr__(self) -> str:
+        return f"HeatmapGrid({self.extent}, {self.bins[0]}x{self.bins[1]} bins)"
+
+
+def positions_xy(obj) -> tuple:
+    """
+    Gets the positions heatmaps are made from: positions_df of a TrajectoryObject (so removed points stay removed),
+    read through the store if it's in one, or the columns of an (n, 2) array
+    :return: tuple: (x, y) np.ndarrays
+    """
+    if isinstance(obj, TrajectoryObject):
+        if obj.store is not None:
+            return np.asarray(obj.store.column('x_pos')), np.asarray(obj.store.column('y_pos'))
+        return obj.positions_df['x_pos'].to_numpy(), obj.positions_df['y_pos'].to_numpy()
+    obj = np.asarray(obj)
+    return obj[:, 0], obj[:, 1]
+
+
+def occupancy_maps(objects: dict,
+                   grid: HeatmapGrid,
+                   normalise: bool = True) -> dict:
+    """
+    Counts how many frames each recording spent in each bin of a grid. Every recording is binned then counted in one
+    np.bincount, with each recording's cells offset into its own block of the counts. Counts for TrajectoryObjects
+    are kept on the object per grid, so asking again (e.g. for another group or difference map) is free until
+    positions_df changes.
+    :param objects: dict of name (e.g. fish id): TrajectoryObject or (n, 2) array of positions
+    :param grid: HeatmapGrid to count in
+    :param normalise: Give the fraction of the recording's positions on the grid in each bin, rather than frame counts,
+    so recordings of different lengths can be averaged
+    :return: dict of name: np.ndarray of shape grid.shape, row 0 being the lowest y
+    """
+    maps: dict = {}
+    to_count: list = []
+    for name, obj in objects.items():
+        cached: np.ndarray = getattr(obj, '_heatmap_cache', {}).get(grid.key)
+        if cached is not None:
+            maps[name] = cached
+        else:
+            to_count.append(name)
+
+    if to_count:
+        cells: list = [grid.cells(*positions_xy(objects[name])) for name in to_count]
+        recording: np.ndarray = np.repeat(np.arange(len(to_count)), [len(c) for c in cells])
+        cells: np.ndarray = np.concatenate(cells)
+        on_grid: np.ndarray = cells >= 0
+        size: int = grid.shape[0] * grid.shape[1]
+        counts: np.ndarray = np.bincount(recording[on_grid] * size + cells[on_grid],
+                                         minlength=len(to_count) * size).reshape((len(to_count),) + grid.shape)
+        for name, count in zip(to_count, counts):
+            maps[name] = count
+            if isinstance(objects[name], TrajectoryObject):
+                if getattr(objects[name], '_heatmap_cache', None) is None:
+                    objects[name]._heatmap_cache = {}
+                objects[name]._heatmap_cache[grid.key] = count
+
+    maps = {name: maps[name] for name in objects}
+    if normalise:
+        return {name: count / max(count.sum(), 1) for name, count in maps.items()}
+    return maps
+
+
+def average_map(maps) -> np.ndarray:
+    """
+    Mean of some maps, e.g. every fish in a group
+    :param maps: dict of name: map, or list of maps, all on the same grid
+    :return: np.ndarray
+    """
+    maps = list(maps.values()) if isinstance(maps, dict) else list(maps)
+    return np.mean(np.stack(maps), axis=0)
+
+
+def difference_map(maps_a: dict,
+                   maps_b: dict,
+                   paired: bool = True) -> np.ndarray:
+    """
+    Mean of maps_a less mean of maps_b, e.g. same less diff trial, so positive where group a spent more of its time
+    :param maps_a: dict of name: map
+    :param maps_b: dict of name: map, on the same grid
+    :param paired: Only use names in both, e.g. the fish that did both trials
+    :return: np.ndarray
+    """
+    if paired:
+        names: list = [name for name in maps_a if name in maps_b]
+        maps_a, maps_b = {name: maps_a[name] for name in names}, {name: maps_b[name] for name in names}
+    return average_map(maps_a) - average_map(maps_b)
+
+
+def render_heatmap(heatmap: np.ndarray,
+                   grid: HeatmapGrid,
+                   path: str,
+                   title: str = None,
+                   cmap: str = None,
+                   dpi: int = 150) -> str:
+    """
+    Draws a map to an image file, without pyplot, so it works headless and alongside other renders. Maps with
+    negative values (differences) get a diverging colour map centred on 0.
+    :param heatmap: Map of shape grid.shape
+    :param grid: HeatmapGrid it was counted in
+    :param path: File to write, its extension picking the format (.png, .pdf, .svg, ...)
+    :param title: Title to put above the map
+    :param cmap: Matplotlib colour map, defaults to viridis, or RdBu_r for differences
+    :param dpi: Resolution of raster formats
+    :return: str: path
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure: Figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    if np.nanmin(heatmap) < 0:
+        limit: float = float(np.nanmax(np.abs(heatmap)))
+        image = ax.imshow(heatmap, extent=grid.extent, origin='lower', cmap=cmap or 'RdBu_r', vmin=-limit, vmax=limit)
+    else:
+        image = ax.imshow(heatmap, extent=grid.extent, origin='lower', cmap=cmap or 'viridis')
+    figure.colorbar(image, ax=ax)
+    if title is not None:
+        ax.set_title(title)
+    figure.savefig(path, dpi=dpi)
+    return path
+
+
+def render_heatmaps(heatmaps: dict,
+                    grid: HeatmapGrid,
+                    output_dir: str,
+                    ext: str = ".png",
+                    workers: int = None,
+                    **kwargs) -> dict:
+    """
+    Draws many maps to files at once, spread across a pool of processes
+    :param heatmaps: dict of name: map. Names are used for the file names and titles
+    :param grid: HeatmapGrid they were counted in
+    :param output_dir: Directory to write to, created if it doesn't exist
+    :param ext: Extension of the files, picking the format
+    :param workers: Number of processes to use, defaults to the number of CPUs. 1 draws everything in this process
+    :param kwargs: Passed on to render_heatmap (cmap, dpi)
+    :return: dict of name: path written
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs: list = [(heatmap, grid, os.path.join(output_dir, f"{name}{ext}"), str(name), kwargs)
+                  for name, heatmap in heatmaps.items()]
+
+    if workers == 1:
+        return dict(zip(heatmaps, map(_render_job, jobs)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(heatmaps, pool.map(_render_job, jobs)))
+
+
+def _render_job(job: tuple) -> str:
+    """
+    Worker side of render_heatmaps
+    """
+    heatmap, grid, path, title, kwargs = job
+    return render_heatmap(heatmap, grid, path, title, **kwargs)
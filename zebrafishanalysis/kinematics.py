@@ -0,0 +1,315 @@
+import numpy as np
+from zebrafishanalysis.derived import merge_row_ranges, patch_ranges
+from zebrafishanalysis.gaps import GAP_MODES, SegmentIndex
+from zebrafishanalysis.rolling import rolling_stats
+
+# Columns calculate_speeds adds to positions_df, in the order they're added
+KINEMATIC_COLUMNS: tuple = ('fish_match', 'distance', 'speed', 'speed_cm', 'acceleration', 'acceleration_cm',
+                            'erraticness', 'raw_bearing', 'deg_bearing', 'angle_diff_deg')
+
+# Which columns each column needs calculating first
+METRIC_DEPENDENCIES: dict = {'fish_match': (),
+                             'distance': (),
+                             'speed': ('distance',),
+                             'speed_cm': ('distance',),
+                             'acceleration': ('speed',),
+                             'acceleration_cm': ('speed_cm',),
+                             'erraticness': ('distance',),
+                             'raw_bearing': (),
+                             'deg_bearing': ('raw_bearing',),
+                             'angle_diff_deg': ('raw_bearing',)}
+
+
+def resolve_metrics(metrics: tuple) -> tuple:
+    """
+    Works out every column that needs calculating to produce the requested ones
+    :param metrics: Names of kinematic columns wanted
+    :return: tuple: Requested columns and their dependencies, in KINEMATIC_COLUMNS order
+    """
+    unknown: set = set(metrics) - set(KINEMATIC_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown kinematic metrics {sorted(unknown)}, expected some of {KINEMATIC_COLUMNS}")
+
+    needed: set = set()
+    to_visit: list = list(metrics)
+    while to_visit:
+        metric: str = to_visit.pop()
+        if metric not in needed:
+            needed.add(metric)
+            to_visit.extend(METRIC_DEPENDENCIES[metric])
+    return tuple(name for name in KINEMATIC_COLUMNS if name in needed)
+
+
+def fish_offsets(fish_ids: np.ndarray) -> np.ndarray:
+    """
+    Gets the row boundaries of each fish in fish-sorted data, so fish i lives in rows offsets[i]:offsets[i + 1]
+    :param fish_ids: fish_id column, with each fish's rows contiguous
+    :return: np.ndarray: Offsets, one longer than the number of fish
+    """
+    starts: np.ndarray = np.flatnonzero(np.diff(fish_ids.astype(np.int64))) + 1
+    return np.concatenate(([0], starts, [len(fish_ids)])).astype(np.int64)
+
+
+def is_fish_frame_sorted(fish_ids: np.ndarray,
+                         frame_ids: np.ndarray) -> bool:
+    """
+    Checks if rows are already in (fish, frame) order, so we can skip sorting
+    :param fish_ids: fish_id column
+    :param frame_ids: frame_id column
+    :return: bool: True if sorted by fish, then by frame
+    """
+    # Ids can be unsigned (see compact mode), so widen them before differencing
+    fish_step: np.ndarray = np.diff(fish_ids.astype(np.int64))
+    if (fish_step < 0).any():
+        return False
+    return not ((fish_step == 0) & (np.diff(frame_ids.astype(np.int64)) <= 0)).any()
+
+
+def compute_kinematics(frame_ids: np.ndarray,
+                       x: np.ndarray,
+                       y: np.ndarray,
+                       offsets: np.ndarray,
+                       frame_rate: float,
+                       pixel_dist_cm: float,
+                       erraticness_frames: int = 60,
+                       metrics: tuple = None,
+                       gap_mode: str = 'still',
+                       segments: SegmentIndex = None) -> dict:
+    """
+    Calculates distance, speed, acceleration, erraticness and bearings for every row in one pass. Each fish is a
+    contiguous block of rows (given by offsets), and all the blocks are worked on at once, with differences that would
+    cross from one block into the next masked out. Results are written straight into preallocated output arrays.
+    Only the requested metrics (and whatever they depend on) are calculated.
+    Rows without a position are handled according to gap_mode (see GAP_MODES). For 'split' and 'bridge', only the rows
+    with positions are worked on, with each segment or each fish as a block, and rows without get NaN.
+    :param frame_ids: frame_id column, sorted by fish then frame
+    :param x: x_pos column, same order
+    :param y: y_pos column, same order
+    :param offsets: Fish boundaries, see fish_offsets
+    :param frame_rate: Frames per second of the recording
+    :param pixel_dist_cm: cm per pixel
+    :param erraticness_frames: Number of frames to calculate erraticness over
+    :param metrics: Columns to return, defaults to all of KINEMATIC_COLUMNS
+    :param gap_mode: How to treat rows without a position, one of GAP_MODES
+    :param segments: SegmentIndex of the rows, if already known. Only used by 'split' and 'bridge'
+    :return: dict: {column name: np.ndarray} for each requested column, float64 whatever the dtype of the positions
+    """
+    if metrics is None:
+        metrics = KINEMATIC_COLUMNS
+    if gap_mode not in GAP_MODES:
+        raise ValueError(f"Unknown gap mode {gap_mode}, expected one of {GAP_MODES}")
+    if gap_mode != 'still':
+        return _compute_kinematics_by_segment(frame_ids, x, y, offsets, frame_rate, pixel_dist_cm, erraticness_frames,
+                                              metrics, gap_mode, segments)
+
+    # Positions may be float32 (compact mode), but everything is worked out in float64
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    num_rows: int = len(x)
+    out: dict = {name: np.full(num_rows, np.NaN) for name in resolve_metrics(metrics) if name != 'fish_match'}
+    if 'fish_match' in metrics:
+        out['fish_match'] = _fish_match(num_rows, offsets)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        _fill_blocks(out, offsets, frame_ids, x, y, frame_rate, pixel_dist_cm, erraticness_frames)
+
+    return {name: out[name] for name in KINEMATIC_COLUMNS if name in metrics}
+
+
+def update_kinematics(columns: dict,
+                      frame_ids: np.ndarray,
+                      x: np.ndarray,
+                      y: np.ndarray,
+                      offsets: np.ndarray,
+                      removed_rows: np.ndarray,
+                      frame_rate: float,
+                      pixel_dist_cm: float,
+                      erraticness_frames: int = 60,
+                      gap_mode: str = 'still',
+                      segments: SegmentIndex = None) -> np.ndarray:
+    """
+    Patches kinematic columns in place after some rows have lost their positions, or rows before them have been
+    dropped, recalculating only the rows that could have changed. A row's kinematics only depend on the
+    erraticness_frames rows (or, when bridging, positions) before it and the one after it, so each changed row only
+    affects a short stretch around it, which is worked out again from just enough rows either side.
+    :param columns: dict of {column name: np.ndarray}, as from compute_kinematics with the same gap_mode, correct for the
+    positions before the removal
+    :param frame_ids: frame_id column, sorted by fish then frame
+    :param x: x_pos column after the removal, with NaN for removed rows
+    :param y: y_pos column after the removal, same order
+    :param offsets: Fish boundaries, see fish_offsets
+    :param removed_rows: Rows that lost their positions, or whose row before was dropped
+    :param frame_rate: Frames per second of the recording
+    :param pixel_dist_cm: cm per pixel
+    :param erraticness_frames: Number of frames to calculate erraticness over
+    :param gap_mode: How to treat rows without a position, one of GAP_MODES
+    :param segments: SegmentIndex of the positions after the removal, if already known. Only used for 'bridge'
+    :return: np.ndarray: Rows worked out again
+    """
+    removed_rows = np.unique(np.asarray(removed_rows, dtype=np.int64))
+    if len(removed_rows) == 0:
+        return removed_rows
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    metrics: tuple = tuple(columns)
+    history: int = max(erraticness_frames, 2)
+
+    fish: np.ndarray = np.searchsorted(offsets, removed_rows, side='right') - 1
+    fish_start: np.ndarray = offsets[fish]
+    fish_end: np.ndarray = offsets[fish + 1]
+
+    if gap_mode == 'bridge':
+        if segments is None:
+            segments = SegmentIndex.from_positions(x, y, offsets)
+        if segments.num_valid == 0:
+            for name, column in compute_kinematics(frame_ids, x, y, offsets, frame_rate, pixel_dist_cm,
+                                                   erraticness_frames, metrics, gap_mode, segments).items():
+                columns[name][:] = column
+            return np.arange(len(x))
+
+        def row_at(ranks: np.ndarray) -> np.ndarray:
+            return segments.row_at_rank(np.clip(ranks, 0, segments.num_valid - 1))
+
+        # Work in ranks among the rows with positions, from the last position before each gap to history positions
+        # after it
+        first_rank: np.ndarray = segments.rank_at_or_after(fish_start)
+        last_rank: np.ndarray = segments.rank_at_or_after(fish_end) - 1
+        next_rank: np.ndarray = segments.rank_at_or_after(removed_rows)
+        lo_rank: np.ndarray = np.maximum(next_rank - 1, first_rank)
+        hi_rank: np.ndarray = np.minimum(next_rank + history - 1, last_rank)
+        lo: np.ndarray = np.minimum(np.where(lo_rank <= last_rank, row_at(lo_rank), removed_rows), removed_rows)
+        hi: np.ndarray = np.maximum(np.where(hi_rank >= first_rank, row_at(hi_rank), removed_rows), removed_rows)
+        context_start: np.ndarray = np.where(lo_rank - history <= first_rank, fish_start, row_at(lo_rank - history))
+        context_end: np.ndarray = np.where(hi_rank + 1 <= last_rank, row_at(hi_rank + 1) + 1, fish_end)
+    else:
+        lo = np.maximum(removed_rows - 1, fish_start)
+        hi = np.minimum(removed_rows + history, fish_end - 1)
+        context_start = np.maximum(lo - history, fish_start)
+        context_end = np.minimum(hi + 2, fish_end)
+
+    # Merge overlapping stretches of the same fish, so each row is only worked out once. Contexts only grow along
+    # with the stretches, so the merged ones run from the first context start to the last context end
+    lo, hi, _, group_start = merge_row_ranges(lo, hi, fish)
+    return patch_ranges({'frame_id': frame_ids, 'x_pos': x, 'y_pos': y}, columns,
+                        lambda context, context_offsets: compute_kinematics(context['frame_id'], context['x_pos'],
+                                                                            context['y_pos'], context_offsets,
+                                                                            frame_rate, pixel_dist_cm,
+                                                                            erraticness_frames, metrics, gap_mode),
+                        lo, hi, context_start[group_start], np.maximum.reduceat(context_end, group_start))
+
+
+def _fish_match(num_rows: int,
+                offsets: np.ndarray) -> np.ndarray:
+    """
+    True for every row but the first of each fish
+    """
+    fish_match: np.ndarray = np.ones(num_rows, dtype=bool)
+    fish_match[offsets[:-1][offsets[:-1] < num_rows]] = False
+    return fish_match
+
+
+def _compute_kinematics_by_segment(frame_ids: np.ndarray,
+                                   x: np.ndarray,
+                                   y: np.ndarray,
+                                   offsets: np.ndarray,
+                                   frame_rate: float,
+                                   pixel_dist_cm: float,
+                                   erraticness_frames: int,
+                                   metrics: tuple,
+                                   gap_mode: str,
+                                   segments: SegmentIndex) -> dict:
+    """
+    compute_kinematics for the 'split' and 'bridge' gap modes. The rows with positions are gathered up and handed to
+    the 'still' engine, with segments as the blocks when splitting and fish as the blocks when bridging (where the
+    frame_id differences then scale each step by the time it took), then scattered back.
+    """
+    if segments is None:
+        segments = SegmentIndex.from_positions(np.asarray(x), np.asarray(y), offsets)
+    rows: np.ndarray = segments.rows()
+    valid: dict = compute_kinematics(frame_ids[rows], x[rows], y[rows], segments.valid_offsets(gap_mode == 'bridge'),
+                                     frame_rate, pixel_dist_cm, erraticness_frames, metrics)
+
+    out: dict = {}
+    for name, column in valid.items():
+        if name == 'fish_match':
+            # Still about whether the row before is the same fish, whatever's missing
+            out[name] = _fish_match(len(x), offsets)
+            continue
+        out[name] = np.full(len(x), np.NaN)
+        out[name][rows] = column
+    return out
+
+
+def _fill_blocks(out: dict,
+                 offsets: np.ndarray,
+                 frame_ids: np.ndarray,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 frame_rate: float,
+                 pixel_dist_cm: float,
+                 erraticness_frames: int) -> None:
+    """
+    Fills each output array for every block at once. The first row of a block has nothing to be compared to, so it
+    stays NaN for everything (and the first two rows for acceleration). Only fills arrays present in out.
+    """
+    num_rows: int = len(x)
+    if num_rows < 2:
+        return
+
+    # Row i is compared with row i - 1, unless it starts a block
+    starts: np.ndarray = np.zeros(num_rows, dtype=bool)
+    starts[offsets[:-1][offsets[:-1] < num_rows]] = True
+    compared: np.ndarray = ~starts[1:]
+    dt: np.ndarray = np.diff(frame_ids).astype(np.float64) * (1 / frame_rate)
+    dx: np.ndarray = np.diff(x)
+    dy: np.ndarray = np.diff(y)
+
+    # Bearings use the raw differences, so removed (NaN) points give NaN bearings
+    if 'raw_bearing' in out:
+        raw_bearing: np.ndarray = out['raw_bearing']
+        raw_bearing[1:] = np.where(compared, np.arctan2(dy, dx), np.NaN)
+
+    if 'deg_bearing' in out:
+        deg_bearing: np.ndarray = out['deg_bearing']
+        np.multiply(raw_bearing, 180 / np.pi, out=deg_bearing)
+        deg_bearing[deg_bearing < 0] += 360
+
+    # The change in bearing to the next row, so the last row of each block has none
+    if 'angle_diff_deg' in out:
+        angle_diff: np.ndarray = np.degrees(np.abs(raw_bearing[1:] - raw_bearing[:-1]) % (np.pi * 2))
+        angle_diff[angle_diff > 180] = np.abs(angle_diff[angle_diff > 180] - 360)
+        out['angle_diff_deg'][:-1] = np.where(compared, angle_diff, np.NaN)
+
+    if 'distance' not in out:
+        return
+
+    # Distances treat a step to or from a removed point as not moving at all
+    dx[np.isnan(dx)] = 0
+    dy[np.isnan(dy)] = 0
+    distance: np.ndarray = out['distance']
+    distance[1:] = np.where(compared, np.sqrt(np.square(dx) + np.square(dy)), np.NaN)
+
+    if 'speed' in out:
+        speed: np.ndarray = out['speed']
+        np.divide(distance[1:], dt, out=speed[1:])
+    if 'speed_cm' in out:
+        speed_cm: np.ndarray = out['speed_cm']
+        np.divide(distance[1:] * pixel_dist_cm, dt, out=speed_cm[1:])
+
+    # The speed of a block's first row is NaN, so the second row's acceleration is too
+    if 'acceleration' in out:
+        np.divide(np.diff(speed), dt, out=out['acceleration'][1:])
+        out['acceleration'][starts] = np.NaN
+    if 'acceleration_cm' in out:
+        np.divide(np.diff(speed_cm), dt, out=out['acceleration_cm'][1:])
+        out['acceleration_cm'][starts] = np.NaN
+
+    # Erraticness is the path length over the last erraticness_frames frames, divided by the straight line distance
+    # between the start and end of that path. The first row's distance is NaN, so the rolling sum only becomes valid
+    # once there are erraticness_frames real steps to add up, all within the block.
+    n: int = erraticness_frames
+    if 'erraticness' in out and num_rows > n:
+        path_length: np.ndarray = rolling_stats(distance, [n], ('sum',), offsets)[('sum', n)]
+        displacement: np.ndarray = np.sqrt(np.square(x[n:] - x[:-n]) + np.square(y[n:] - y[:-n]))
+        np.divide(path_length[n:], displacement, out=out['erraticness'][n:])
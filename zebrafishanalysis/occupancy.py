@@ -0,0 +1,187 @@
+import numpy as np
+from zebrafishanalysis.polygons import as_polygon_list, crossing_number_test
+
+
+class OccupancyIndex:
+    """
+    Index of where a recording's positions fall, built once so many "how many frames were within r of p" and "how
+    many frames were inside P" questions can be answered without rescanning the whole recording each time.
+
+    Positions are binned into a 2D histogram of cell_size pixel cells, with the points kept sorted by cell. A polygon
+    query sums the histogram over cells lying wholly inside the polygon, and only tests the points in cells its edges
+    pass through, so costs scale with the polygon's area and perimeter rather than the recording length. Radius
+    queries around a point sort the distances to that point once, after which counts for any number of radii are a
+    binary search each. Counts are exact, and match the dataframe methods row for row (NaN positions count towards the
+    total but are never inside anything).
+    """
+
+    def __init__(self,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 cell_size: float = 1.):
+        """
+        :param x: X positions, one per row of positions_df
+        :param y: Y positions, one per row of positions_df
+        :param cell_size: Width/height of each histogram cell in pixels
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.total: int = len(x)
+        self.cell_size: float = cell_size
+
+        valid: np.ndarray = np.isfinite(x) & np.isfinite(y)
+        x, y = x[valid], y[valid]
+        if len(x) == 0:
+            self.origin: np.ndarray = np.zeros(2)
+            self.shape: tuple = (1, 1)
+        else:
+            self.origin: np.ndarray = np.floor(np.array([x.min(), y.min()]) / cell_size) * cell_size
+            self.shape: tuple = (int((y.max() - self.origin[1]) // cell_size) + 1,
+                                 int((x.max() - self.origin[0]) // cell_size) + 1)
+
+        cells: np.ndarray = self._cell_ids(x, y)
+        order: np.ndarray = np.argsort(cells, kind='stable')
+        self.x: np.ndarray = x[order]
+        self.y: np.ndarray = y[order]
+        self.histogram: np.ndarray = np.bincount(cells, minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+        # Points in cell c are self.x[cell_starts[c]:cell_starts[c + 1]]
+        self.cell_starts: np.ndarray = np.concatenate(([0], np.cumsum(self.histogram.ravel())))
+        self._distance_profiles: dict = {}
+
+    def count_within(self,
+                     point: tuple,
+                     radius: float) -> int:
+        """
+        Number of frames strictly closer than radius to a point
+        :param point: (X, Y)
+        :param radius: Radius in pixels
+        :return: int
+        """
+        return int(self.count_within_radii(point, [radius])[0])
+
+    def count_within_radii(self,
+                           point: tuple,
+                           radii: np.ndarray) -> np.ndarray:
+        """
+        Number of frames strictly closer than each of an array of radii to a point
+        :param point: (X, Y)
+        :param radii: Radii in pixels
+        :return: np.ndarray of counts, one per radius
+        """
+        return np.searchsorted(self._distance_profile(point), np.asarray(radii, dtype=np.float64), side='left')
+
+    def count_in_polygon(self,
+                         vertices: list) -> int:
+        """
+        Number of frames inside a polygon
+        :param vertices: List of vertices bounding the polygon
+        :return: int
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        cell_min: np.ndarray = np.maximum(self._cell_coords(vertices.min(axis=0)), 0)
+        cell_max: np.ndarray = np.minimum(self._cell_coords(vertices.max(axis=0)), np.array(self.shape)[::-1] - 1)
+        if np.any(cell_max < cell_min):
+            return 0
+
+        # Cells the polygon's edges pass through need their points checking individually. Everything else is wholly
+        # inside or outside, which its centre tells us.
+        col_range: np.ndarray = np.arange(cell_min[0], cell_max[0] + 1)
+        row_range: np.ndarray = np.arange(cell_min[1], cell_max[1] + 1)
+        cols, rows = np.meshgrid(col_range, row_range)
+        centres_inside: np.ndarray = crossing_number_test(vertices,
+                                                          self.origin[0] + (cols + 0.5) * self.cell_size,
+                                                          self.origin[1] + (rows + 0.5) * self.cell_size)
+        boundary: np.ndarray = self._boundary_cells(vertices, cell_min, cols.shape)
+
+        count: int = int(self.histogram[rows, cols][centres_inside & ~boundary].sum())
+
+        boundary_cells: np.ndarray = rows[boundary] * self.shape[1] + cols[boundary]
+        starts: np.ndarray = self.cell_starts[boundary_cells]
+        lengths: np.ndarray = self.cell_starts[boundary_cells + 1] - starts
+        points: np.ndarray = np.repeat(starts - np.cumsum(np.concatenate(([0], lengths[:-1]))), lengths) + \
+                             np.arange(lengths.sum())
+        return count + int(np.count_nonzero(crossing_number_test(vertices, self.x[points], self.y[points])))
+
+    def count_in_polygons(self,
+                          polygons: list) -> np.ndarray:
+        """
+        count_in_polygon for each of a list of polygons
+        :param polygons: List of polygons, each a list of vertices or anything with a .v attribute holding them
+        :return: np.ndarray of counts, one per polygon
+        """
+        return np.array([self.count_in_polygon(vertices) for vertices in as_polygon_list(polygons)], dtype=np.int64)
+
+    def _distance_profile(self,
+                          point: tuple) -> np.ndarray:
+        """
+        Sorted distances from every (non-NaN) position to a point, worked out once per point
+        """
+        key: tuple = (float(point[0]), float(point[1]))
+        if key not in self._distance_profiles:
+            # Same formula as dist_obj_a/dist_obj_b, so comparisons against a radius come out identically
+            self._distance_profiles[key] = np.sort(np.sqrt((key[0] - self.x) ** 2 + (key[1] - self.y) ** 2))
+        return self._distance_profiles[key]
+
+    def _cell_coords(self,
+                     xy: np.ndarray) -> np.ndarray:
+        return np.floor((np.asarray(xy) - self.origin) / self.cell_size).astype(np.int64)
+
+    def _cell_ids(self,
+                  x: np.ndarray,
+                  y: np.ndarray) -> np.ndarray:
+        cols: np.ndarray = np.minimum(((x - self.origin[0]) // self.cell_size).astype(np.int64), self.shape[1] - 1)
+        rows: np.ndarray = np.minimum(((y - self.origin[1]) // self.cell_size).astype(np.int64), self.shape[0] - 1)
+        return rows * self.shape[1] + cols
+
+    def _boundary_cells(self,
+                        vertices: np.ndarray,
+                        cell_min: np.ndarray,
+                        shape: tuple) -> np.ndarray:
+        """
+        Marks cells (within the polygon's bounding box) that its edges pass through. Edges are sampled every half cell
+        and the result grown by a cell in each direction, so cells an edge only clips a corner of are caught too.
+        """
+        boundary: np.ndarray = np.zeros((shape[0] + 2, shape[1] + 2), dtype=bool)
+        starts: np.ndarray = vertices
+        ends: np.ndarray = np.roll(vertices, -1, axis=0)
+        for start, end in zip(starts, ends):
+            steps: int = int(np.ceil(np.abs(end - start).max() / self.cell_size * 2)) + 1
+            samples: np.ndarray = start + np.linspace(0, 1, steps + 1)[:, None] * (end - start)
+            cells: np.ndarray = self._cell_coords(samples) - cell_min + 1
+            cells = np.clip(cells, 0, np.array([shape[1] + 1, shape[0] + 1]))
+            boundary[cells[:, 1], cells[:, 0]] = True
+
+        grown: np.ndarray = boundary.copy()
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                grown[1:-1, 1:-1] |= boundary[1 + d_row:boundary.shape[0] - 1 + d_row,
+                                              1 + d_col:boundary.shape[1] - 1 + d_col]
+        return grown[1:-1, 1:-1]
+
+
+def bin_positions(x: np.ndarray,
+                  y: np.ndarray,
+                  cell_size: float,
+                  origin: tuple = (0., 0.),
+                  shape: tuple = None) -> tuple:
+    """
+    Works out which cell of a grid each position falls in, so any number of per cell totals (frames, speeds, ...) can
+    then be had with np.bincount
+    :param x: X positions
+    :param y: Y positions
+    :param cell_size: Width/height of each cell in pixels, or (width, height) for cells that aren't square
+    :param origin: (X, Y) of the corner of cell 0
+    :param shape: (rows, cols) of the grid. Defaults to just big enough for every position
+    :return: tuple: (cell of each position as row * cols + col, -1 for NaNs and positions off the grid, shape)
+    """
+    cell_width, cell_height = np.broadcast_to(np.asarray(cell_size, dtype=np.float64), (2,))
+    cols: np.ndarray = np.floor((np.asarray(x, dtype=np.float64) - origin[0]) / cell_width)
+    rows: np.ndarray = np.floor((np.asarray(y, dtype=np.float64) - origin[1]) / cell_height)
+    valid: np.ndarray = np.isfinite(cols) & np.isfinite(rows) & (cols >= 0) & (rows >= 0)
+    if shape is None:
+        shape = (int(rows[valid].max()) + 1, int(cols[valid].max()) + 1) if valid.any() else (1, 1)
+    valid &= (cols < shape[1]) & (rows < shape[0])
+
+    cells: np.ndarray = np.full(len(cols), -1, dtype=np.int64)
+    cells[valid] = rows[valid].astype(np.int64) * shape[1] + cols[valid].astype(np.int64)
+    return cells, tuple(shape)
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class PolygonMask:
+    """
+    Tests points against many polygons in one go. Each polygon is checked with a vectorised crossing-number test, but
+    only against the points inside its bounding box, so small regions (the usual case when removing tracking errors)
+    cost next to nothing. Given a raster_shape, the polygons are also rasterised into a pixel lookup grid, and contains
+    becomes a single index per point.
+    """
+
+    def __init__(self,
+                 polygons: list,
+                 raster_shape: tuple = None):
+        """
+        :param polygons: List of polygons, each a list of vertices or anything with a .v attribute holding them. A single
+        polygon (list of vertices) is fine too
+        :param raster_shape: (width, height) of the grid to rasterise to, normally the video dimensions. Leave as None to
+        test points exactly. Raster lookups treat each point as the centre of the pixel it falls in, so can differ from
+        the exact test for points within a pixel of a polygon's edge.
+        """
+        self.polygons: list = [np.asarray(vertices, dtype=np.float64) for vertices in as_polygon_list(polygons)]
+        self.bounds: list = [(vertices.min(axis=0), vertices.max(axis=0)) for vertices in self.polygons]
+
+        self.raster: np.ndarray = None
+        if raster_shape is not None:
+            width, height = raster_shape
+            centre_x, centre_y = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+            self.raster = self.contains(centre_x.ravel(), centre_y.ravel(), exact=True).reshape(height, width)
+
+    def __len__(self) -> int:
+        return len(self.polygons)
+
+    def contains(self,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 exact: bool = False) -> np.ndarray:
+        """
+        Checks which points fall inside any of the polygons. NaN points are never inside.
+        :param x: X positions
+        :param y: Y positions
+        :param exact: Use the exact test even if there's a raster
+        :return: np.ndarray of bools, one per point
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.raster is not None and exact is False:
+            return self._lookup(x, y)
+
+        inside: np.ndarray = np.zeros(x.shape, dtype=bool)
+        for polygon in range(len(self.polygons)):
+            candidates: np.ndarray = self._candidates(polygon, x, y) & ~inside
+            inside[candidates] = crossing_number_test(self.polygons[polygon], x[candidates], y[candidates])
+        return inside
+
+    def contains_each(self,
+                      x: np.ndarray,
+                      y: np.ndarray) -> np.ndarray:
+        """
+        Checks which points fall inside each polygon separately
+        :param x: X positions
+        :param y: Y positions
+        :return: np.ndarray of bools, shape (number of polygons, number of points)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        inside: np.ndarray = np.zeros((len(self.polygons), *x.shape), dtype=bool)
+        for polygon in range(len(self.polygons)):
+            candidates: np.ndarray = self._candidates(polygon, x, y)
+            inside[polygon][candidates] = crossing_number_test(self.polygons[polygon], x[candidates], y[candidates])
+        return inside
+
+    def _candidates(self,
+                    polygon: int,
+                    x: np.ndarray,
+                    y: np.ndarray) -> np.ndarray:
+        """
+        Points inside a polygon's bounding box. NaNs fail every comparison so drop out here.
+        """
+        (min_x, min_y), (max_x, max_y) = self.bounds[polygon]
+        return (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+
+    def _lookup(self,
+                x: np.ndarray,
+                y: np.ndarray) -> np.ndarray:
+        height, width = self.raster.shape
+        in_grid: np.ndarray = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        inside: np.ndarray = np.zeros(x.shape, dtype=bool)
+        inside[in_grid] = self.raster[y[in_grid].astype(np.intp), x[in_grid].astype(np.intp)]
+        return inside
+
+
+def crossing_number_test(vertices: np.ndarray,
+                         x: np.ndarray,
+                         y: np.ndarray) -> np.ndarray:
+    """
+    Even-odd crossing-number point in polygon test, vectorised over the points. Casts a ray from each point in the +x
+    direction and counts how many edges it crosses, odd meaning inside. The polygon is closed automatically.
+    :param vertices: (n, 2) array of vertices
+    :param x: X positions
+    :param y: Y positions
+    :return: np.ndarray of bools, one per point
+    """
+    inside: np.ndarray = np.zeros(x.shape, dtype=bool)
+    x1, y1 = vertices[-1]
+    for x2, y2 in vertices:
+        # Only edges spanning the point's y can be crossed, which also rules out dividing by zero on flat edges
+        spans: np.ndarray = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x: np.ndarray = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= spans & (x < crossing_x)
+        x1, y1 = x2, y2
+    return inside
+
+
+def as_polygon_list(polygons: list) -> list:
+    """
+    Normalises polygons to a list of lists of vertices
+    :param polygons: A single polygon (list of vertices), or a list of polygons. Polygons can be anything with a .v
+    attribute holding their vertices
+    :return: list of lists of vertices
+    """
+    polygons = getattr(polygons, 'v', polygons)
+    if len(polygons) == 0:
+        return []
+    # A single polygon's first item is a vertex, i.e. a pair of numbers
+    if np.ndim(getattr(polygons[0], 'v', polygons[0])) == 1:
+        return [polygons]
+    return [getattr(polygon, 'v', polygon) for polygon in polygons]
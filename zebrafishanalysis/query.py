@@ -0,0 +1,196 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+from zebrafishanalysis.kinematics import KINEMATIC_COLUMNS
+from zebrafishanalysis.polygons import PolygonMask
+from zebrafishanalysis.views import FrameView
+
+
+class _QueryBuilder(ABC):
+    """
+    The chainable half of a query. Each call returns a new query with one more step, nothing is worked out until
+    one of the results is asked for.
+    """
+
+    def __init__(self,
+                 steps: tuple = (),
+                 columns: tuple = None):
+        self.steps: tuple = steps
+        self.columns: tuple = columns
+
+    def drop_errors(self,
+                    factor: str,
+                    cutoff: float,
+                    sds: float = None):
+        """
+        Keeps rows drop_errors would keep (within +-cutoff, and sds standard deviations of the mean if given)
+        """
+        return self._copy(self.steps + (('drop_errors', factor, cutoff, sds),), self.columns)
+
+    def near(self,
+             obj: str,
+             exploration_area_radius: float):
+        """
+        Keeps rows closer than exploration_area_radius to an object ('obj_a' or 'obj_b'), as trim_based_on_objs
+        """
+        return self._copy(self.steps + (('near', obj, exploration_area_radius),), self.columns)
+
+    def inside(self,
+               vertices: list):
+        """
+        Keeps rows inside a polygon, as trim_to_polygon
+        """
+        return self._copy(self.steps + (('inside', tuple(map(tuple, vertices))),), self.columns)
+
+    def select(self,
+               *columns: str):
+        """
+        Sets the columns results are given for, defaults to all of them
+        """
+        return self._copy(self.steps, columns)
+
+    @abstractmethod
+    def _copy(self,
+              steps: tuple,
+              columns: tuple):
+        """
+        Makes a query of the same kind over the same recordings, with different steps and columns
+        """
+
+
+class TrajectoryQuery(_QueryBuilder):
+    """
+    Lazy filter of a TrajectoryObject's positions_df, e.g.
+        tr.query().drop_errors('speed', 2500).near('obj_a', 200).select('speed_cm').to_numpy()
+    All steps are worked out as boolean masks over positions_df, so no intermediate tables get made. Masks are cached
+    on the object by the steps leading to them, so queries sharing a prefix (e.g. the same drop_errors before near
+    obj_a and near obj_b) only work it out once. The cache is cleared whenever positions_df is replaced.
+    """
+
+    def __init__(self,
+                 tr,
+                 steps: tuple = (),
+                 columns: tuple = None):
+        """
+        :param tr: TrajectoryObject (or NovelObjectRecognitionTest, for near) to query
+        :param steps: Filters to apply, normally built up with the chainable methods
+        :param columns: Columns to return, normally set with select
+        """
+        _QueryBuilder.__init__(self, steps, columns)
+        self.tr = tr
+
+    def _copy(self,
+              steps: tuple,
+              columns: tuple) -> 'TrajectoryQuery':
+        return TrajectoryQuery(self.tr, steps, columns)
+
+    def mask(self) -> np.ndarray:
+        """
+        :return: np.ndarray: Boolean mask over positions_df of the rows passing every step
+        """
+        # Anything drop_errors needs adding has to be there before we grab its column
+        for step in self.steps:
+            if step[0] == 'drop_errors' and step[1] in KINEMATIC_COLUMNS:
+                self.tr.ensure_metrics(step[1])
+
+        cache: dict = self.tr.query_cache()
+        # Start from the longest prefix of steps we've already got a mask for
+        done: int = len(self.steps)
+        while done > 0 and self.steps[:done] not in cache:
+            done -= 1
+        mask: np.ndarray = cache[self.steps[:done]] if done > 0 else np.ones(self.tr.num_rows(), dtype=bool)
+
+        for i in range(done, len(self.steps)):
+            mask = mask & self._step_mask(self.steps[i], mask)
+            cache[self.steps[:i + 1]] = mask
+        return mask
+
+    def view(self) -> FrameView:
+        """
+        :return: FrameView of positions_df with the rows passing every step. If the object is in a store only those
+        rows are read in, so the view's base is just them (indexed by row in the store) rather than the whole table
+        """
+        if self.tr.store is not None:
+            return FrameView(self.tr.store.to_dataframe(rows=np.flatnonzero(self.mask())))
+        return FrameView(self.tr.positions_df, self.mask())
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame of the selected columns of the rows passing every step
+        """
+        columns: list = None if self.columns is None else list(self.columns)
+        if self.tr.store is not None:
+            return self.tr.store.to_dataframe(columns, np.flatnonzero(self.mask()))
+        return self.view().materialize(columns)
+
+    def to_numpy(self) -> np.ndarray:
+        """
+        :return: np.ndarray of shape (rows, selected columns)
+        """
+        view: FrameView = self.view()
+        return view.to_numpy(list(view.columns) if self.columns is None else list(self.columns))
+
+    def count(self) -> int:
+        """
+        :return: int: Number of rows passing every step
+        """
+        return int(np.count_nonzero(self.mask()))
+
+    def _step_mask(self,
+                   step: tuple,
+                   mask: np.ndarray) -> np.ndarray:
+        """
+        Works out which rows of positions_df pass a step, a column at a time, so a store is never read in whole. mask
+        is the rows passing the steps before, which only matters for steps depending on the other rows (drop_errors
+        with sds)
+        """
+        kind: str = step[0]
+        if kind == 'drop_errors':
+            _, factor, cutoff, sds = step
+            return self.tr._error_mask(self.tr.column(factor), cutoff, sds, mask)
+        if kind == 'near':
+            _, obj, radius = step
+            return self.tr.column(f'dist_{obj}') < radius
+        if kind == 'inside':
+            return PolygonMask(step[1]).contains(self.tr.column('x_pos'), self.tr.column('y_pos'))
+        raise ValueError(f"Unknown query step {kind}")
+
+
+class BatchQuery(_QueryBuilder):
+    """
+    The same query run over a whole dict of fish, e.g.
+        BatchQuery(same_fish).drop_errors('speed', 2500).near('obj_a', 200).select('speed_cm').to_numpy()
+    Results come back as dicts of fish id: result, in the same order as the fish.
+    """
+
+    def __init__(self,
+                 objects: dict,
+                 steps: tuple = (),
+                 columns: tuple = None):
+        """
+        :param objects: dict of fish id: TrajectoryObject
+        :param steps: Filters to apply, normally built up with the chainable methods
+        :param columns: Columns to return, normally set with select
+        """
+        _QueryBuilder.__init__(self, steps, columns)
+        self.objects: dict = objects
+
+    def _copy(self,
+              steps: tuple,
+              columns: tuple) -> 'BatchQuery':
+        return BatchQuery(self.objects, steps, columns)
+
+    def queries(self) -> dict:
+        """
+        :return: dict of fish id: TrajectoryQuery
+        """
+        return {fish: TrajectoryQuery(tr, self.steps, self.columns) for fish, tr in self.objects.items()}
+
+    def to_dataframe(self) -> dict:
+        return {fish: query.to_dataframe() for fish, query in self.queries().items()}
+
+    def to_numpy(self) -> dict:
+        return {fish: query.to_numpy() for fish, query in self.queries().items()}
+
+    def count(self) -> dict:
+        return {fish: query.count() for fish, query in self.queries().items()}
@@ -0,0 +1,134 @@
+import numpy as np
+
+ROLLING_STATS: tuple = ('sum', 'mean', 'std', 'min', 'max')
+
+
+def rolling_stats(values: np.ndarray,
+                  windows: list,
+                  stats: tuple = ('mean',),
+                  offsets: np.ndarray = None,
+                  frame_ids: np.ndarray = None,
+                  min_periods: int = None) -> dict:
+    """
+    Trailing rolling statistics over several window sizes at once. Windows never cross a fish boundary (given by
+    offsets) or, if frame_ids are given, a gap in the frames, so each fish/run of consecutive frames is treated as its
+    own series. Like pandas' rolling(window, min_periods), a row gets NaN unless there are at least min_periods
+    values that aren't NaN in the window up to and including it in its series (the window being cut short at the
+    start of the series).
+    Sums, means and sds come from cumulative sums (of values centred on their series' mean, to keep the sds
+    accurate), and mins/maxes from the van Herk/Gil-Werman block scan, so every window size is a handful of
+    vectorised passes however long the windows are.
+    :param values: Values, with each fish's rows contiguous and in frame order
+    :param windows: Window sizes, in rows
+    :param stats: Any of 'sum', 'mean', 'std' (sample sd, like pandas), 'min', 'max'
+    :param offsets: Fish boundaries, see fish_offsets. Defaults to treating values as one fish
+    :param frame_ids: frame_id of each row. If given, windows also stop at gaps between frames
+    :param min_periods: Fewest values a window needs to get a result. Defaults to the whole window. Only sum, mean and
+    std can be worked out from part of a window
+    :return: dict of {(stat, window): np.ndarray}
+    """
+    for stat in stats:
+        if stat not in ROLLING_STATS:
+            raise ValueError(f"Unknown rolling stat {stat}, expected one of {ROLLING_STATS}")
+    if min_periods is not None and any(min_periods > w for w in windows):
+        raise ValueError(f"min_periods {min_periods} is longer than a window of {windows}")
+    if min_periods is not None and ('min' in stats or 'max' in stats) and any(min_periods < w for w in windows):
+        raise ValueError("Rolling min and max need whole windows, so can't be used with min_periods")
+
+    values = np.asarray(values, dtype=np.float64)
+    num_rows: int = len(values)
+    if num_rows == 0:
+        return {(stat, window): np.zeros(0) for window in windows for stat in stats}
+    segment_start: np.ndarray = _segment_starts(num_rows, offsets, frame_ids)
+    rows: np.ndarray = np.arange(num_rows)
+
+    nans: np.ndarray = np.isnan(values)
+    nan_counts: np.ndarray = np.concatenate(([0], np.cumsum(nans)))
+
+    if 'sum' in stats or 'mean' in stats or 'std' in stats:
+        # Centring on each series' mean keeps the cumulative sums small, so differencing them doesn't lose precision
+        starts: np.ndarray = np.flatnonzero(np.diff(segment_start, prepend=-1))
+        lengths: np.ndarray = np.diff(np.append(starts, num_rows))
+        clean: np.ndarray = np.where(nans, 0, values)
+        shift: np.ndarray = np.repeat(np.add.reduceat(clean, starts) / np.maximum(np.add.reduceat(~nans, starts), 1),
+                                      lengths)
+        centred: np.ndarray = np.where(nans, 0, values - shift)
+        sums: np.ndarray = np.concatenate(([0], np.cumsum(centred)))
+        squares: np.ndarray = np.concatenate(([0], np.cumsum(np.square(centred))))
+
+    results: dict = {}
+    for window in windows:
+        # Rows in each window, cut short at the start of the series, and how many of them aren't NaN
+        first: np.ndarray = np.maximum(rows - window + 1, segment_start)
+        ends: np.ndarray = rows + 1
+        counts: np.ndarray = ends - first - (nan_counts[ends] - nan_counts[first])
+        valid: np.ndarray = counts >= (window if min_periods is None else max(min_periods, 1))
+
+        if 'sum' in stats or 'mean' in stats or 'std' in stats:
+            window_sum: np.ndarray = np.full(num_rows, np.NaN)
+            centred_sum: np.ndarray = sums[ends[valid]] - sums[first[valid]]
+            window_sum[valid] = centred_sum + shift[valid] * counts[valid]
+            if 'sum' in stats:
+                results[('sum', window)] = window_sum
+            if 'mean' in stats:
+                results[('mean', window)] = window_sum / np.maximum(counts, 1)
+            if 'std' in stats:
+                std: np.ndarray = np.full(num_rows, np.NaN)
+                spread: np.ndarray = valid & (counts > 1)
+                n: np.ndarray = counts[spread]
+                centred_spread: np.ndarray = sums[ends[spread]] - sums[first[spread]]
+                variance: np.ndarray = (squares[ends[spread]] - squares[first[spread]] - centred_spread ** 2 / n) / \
+                                       (n - 1)
+                std[spread] = np.sqrt(np.maximum(variance, 0))
+                results[('std', window)] = std
+
+        if 'min' in stats:
+            window_min: np.ndarray = np.full(num_rows, np.NaN)
+            window_min[valid] = _sliding_extreme(np.where(nans, np.inf, values), window, np.minimum)[valid]
+            results[('min', window)] = window_min
+        if 'max' in stats:
+            window_max: np.ndarray = np.full(num_rows, np.NaN)
+            window_max[valid] = _sliding_extreme(np.where(nans, -np.inf, values), window, np.maximum)[valid]
+            results[('max', window)] = window_max
+
+    return results
+
+
+def _segment_starts(num_rows: int,
+                    offsets: np.ndarray,
+                    frame_ids: np.ndarray) -> np.ndarray:
+    """
+    Gets the first row of the series each row belongs to
+    """
+    breaks: np.ndarray = np.zeros(num_rows, dtype=bool)
+    breaks[0] = True
+    if offsets is not None:
+        breaks[np.asarray(offsets[:-1])[np.asarray(offsets[:-1]) < num_rows]] = True
+    if frame_ids is not None and num_rows > 1:
+        breaks[1:] |= np.diff(np.asarray(frame_ids, dtype=np.int64)) != 1
+    return np.maximum.accumulate(np.where(breaks, np.arange(num_rows), 0))
+
+
+def _sliding_extreme(values: np.ndarray,
+                     window: int,
+                     func: np.ufunc) -> np.ndarray:
+    """
+    Trailing sliding min/max (func is np.minimum or np.maximum) with the van Herk/Gil-Werman algorithm. Values are cut
+    into blocks of window rows; any window then spans the end of one block and the start of the next, so its
+    extreme is func of a suffix scan and a prefix scan. Rows without a full window before them are garbage.
+    """
+    num_rows: int = len(values)
+    if window <= 1 or num_rows == 0:
+        return values.copy()
+
+    num_blocks: int = -(-num_rows // window)
+    padded: np.ndarray = np.full(num_blocks * window, values[-1])
+    padded[:num_rows] = values
+    blocks: np.ndarray = padded.reshape(num_blocks, window)
+    prefix: np.ndarray = func.accumulate(blocks, axis=1).ravel()
+    suffix: np.ndarray = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    result: np.ndarray = prefix[:num_rows].copy()
+    ends: np.ndarray = np.arange(window - 1, num_rows)
+    result[window - 1:] = func(suffix[ends - window + 1], prefix[ends])
+    return result
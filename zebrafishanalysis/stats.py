@@ -1,9 +1,14 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 import pandas as pd
 from scipy import stats
 from typing import Callable
-from zebrafishanalysis.structs import TrajectoryObject, NovelObjectRecognitionTest
+from zebrafishanalysis.export import EXPORT_FORMATS
+from zebrafishanalysis.heatmaps import HeatmapGrid, occupancy_maps
+from zebrafishanalysis.rolling import rolling_stats
+from zebrafishanalysis.structs import TrajectoryObject, NovelObjectRecognitionTest, rolling_column
+from zebrafishanalysis.views import FrameView
 
 def draw_figure(func: Callable) -> Callable:
     """
@@ -20,23 +25,19 @@ def draw_figure(func: Callable) -> Callable:
 
 @draw_figure
 def draw_heatmap(trajectories: np.ndarray or TrajectoryObject,
-                 bins: int) -> np.ndarray:
+                 bins: int,
+                 dimensions: tuple = None) -> np.ndarray:
     """
-    Plots a heatmap of fish positions
-    :param trajectories: tuple containing two arrays, x and y pos to use. Can be an array,
-    or pass an entire TrajectoryObject and the decorator extracts it
+    Plots a heatmap of fish positions. To draw many heatmaps to files, use occupancy_maps and render_heatmaps
+    :param trajectories: (n, 2) array of x and y positions to use, or an entire TrajectoryObject
     :param bins: Number of bins to use when plotting
+    :param dimensions: (width, height) of the video to bin over. Defaults to the TrajectoryObject's video, or the
+    extent of the positions
     :return: Plot
     """
-    if isinstance(trajectories, TrajectoryObject) or isinstance(trajectories, NovelObjectRecognitionTest):
-        dimensions = trajectories.video_dimensions
-        trajectories = trajectories.flatten_fish_positions()
-
-    x, y = trajectories[:, 0], trajectories[:, 1]
-
-    heatmap, x_edges, y_edges = np.histogram2d(x, y, bins=(bins, bins), range=[[100, 1200], [0, dimensions[1]]])
-    extent = [x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]]
-    return plt.imshow(heatmap.T, extent=extent, origin='lower')
+    grid: HeatmapGrid = HeatmapGrid.covering([trajectories], bins, dimensions)
+    heatmap: np.ndarray = occupancy_maps({0: trajectories}, grid, normalise=False)[0]
+    return plt.imshow(heatmap, extent=grid.extent, origin='lower')
 
 
 @draw_figure
@@ -52,7 +53,7 @@ def draw_histogram(trajectories: TrajectoryObject or pd.DataFrame,
     :return:
     """
     if isinstance(trajectories, TrajectoryObject) or isinstance(trajectories, NovelObjectRecognitionTest):
-        trajectories = trajectories.positions_df[factor]
+        trajectories = trajectories.column(factor)
     else:
         trajectories = trajectories[factor]
 
@@ -76,25 +77,164 @@ def draw_rolling(series_to_plot):
 
 def calculate_rolling_sd(df: pd.DataFrame,
                          factor: str,
-                         window: int = 600):
+                         window: int = 600,
+                         break_on_gaps: bool = False) -> pd.Series:
+    """
+    Rolling sd of a factor. For a positions_df, each fish gets its own windows, so they never mix fish
+    :param df: Dataframe to use
+    :param factor: Column to get the rolling sd of
+    :param window: Window length in rows
+    :param break_on_gaps: Also stop windows at gaps in the frames
+    :return: pd.Series indexed like df
+    """
+    if 'fish_id' in df.columns and 'frame_id' in df.columns:
+        return rolling_column(df, factor, [window], ('std',), break_on_gaps)[('std', window)]
     datapoints = pd.Series(df[factor])
     return datapoints.rolling(window).std()
 
 
+def align_on_frames(df_list: list,
+                    factor: str) -> tuple:
+    """
+    Lines recordings up by frame_id in one (series, frames) array, so frame i of every recording sits in column i
+    whatever frames each of them dropped. Frames a series doesn't have (dropped, or outside its recording) are NaN.
+    Each fish of each recording is its own series.
+    :param df_list: Dataframes (or FrameViews) with fish_id, frame_id and factor cols
+    :param factor: Column to align
+    :return: tuple: (frame_ids, values array of shape (series, frames), list of (recording index, fish_id) labels)
+    """
+    columns: list = []
+    for i, df in enumerate(df_list):
+        get = df.column if isinstance(df, FrameView) else lambda name: df[name].to_numpy()
+        fish_ids: np.ndarray = get('fish_id')
+        frame_ids: np.ndarray = get('frame_id').astype(np.int64)
+        values: np.ndarray = get(factor)
+        for fish in np.unique(fish_ids):
+            rows: np.ndarray = fish_ids == fish
+            columns.append(((i, int(fish)), frame_ids[rows], values[rows]))
+
+    if not columns or all(len(frame_ids) == 0 for _, frame_ids, _ in columns):
+        return np.zeros(0, dtype=np.int64), np.zeros((len(columns), 0)), [label for label, _, _ in columns]
+
+    first: int = min(frame_ids.min() for _, frame_ids, _ in columns if len(frame_ids))
+    last: int = max(frame_ids.max() for _, frame_ids, _ in columns if len(frame_ids))
+    aligned: np.ndarray = np.full((len(columns), last - first + 1), np.NaN)
+    for row, (_, frame_ids, values) in enumerate(columns):
+        aligned[row, frame_ids - first] = values
+    return np.arange(first, last + 1), aligned, [label for label, _, _ in columns]
+
+
+def rolling_sd_array(aligned: np.ndarray,
+                     window: int,
+                     min_periods: int = None) -> np.ndarray:
+    """
+    Rolling sd along each row of an aligned array (see align_on_frames). Windows are in frames rather than rows, so a
+    frame the series doesn't have (e.g. dropped by drop_errors) counts against every window it falls in. By default a
+    frame only gets an sd if the series has all window frames up to it, so each dropped row blanks window frames;
+    lower min_periods to keep windows with a few frames missing.
+    :param aligned: (series, frames) array
+    :param window: Window length in frames
+    :param min_periods: Fewest frames a window needs to get an sd, defaults to window
+    :return: np.ndarray of the same shape
+    """
+    num_series, num_frames = aligned.shape
+    offsets: np.ndarray = np.arange(num_series + 1) * num_frames
+    return rolling_stats(aligned.ravel(), [window], ('std',), offsets,
+                         min_periods=min_periods)[('std', window)].reshape(aligned.shape)
+
+
+def summarise_across_series(aligned: np.ndarray,
+                            confidence: float = 0.95) -> dict:
+    """
+    Mean, sd and t confidence interval of every frame across the series of an aligned array, ignoring NaNs
+    :param aligned: (series, frames) array
+    :param confidence: Confidence level of the interval
+    :return: dict of n, mean, sd, ci_low, ci_high arrays, one value per frame
+    """
+    present: np.ndarray = ~np.isnan(aligned)
+    n: np.ndarray = present.sum(axis=0)
+    total: np.ndarray = np.where(present, aligned, 0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean: np.ndarray = np.where(n > 0, total / n, np.NaN)
+        squares: np.ndarray = np.where(present, np.square(aligned - mean), 0).sum(axis=0)
+        sd: np.ndarray = np.where(n > 1, np.sqrt(squares / (n - 1)), np.NaN)
+        half_width: np.ndarray = stats.t.ppf(0.5 + confidence / 2, n - 1) * sd / np.sqrt(n)
+    return {'n': n, 'mean': mean, 'sd': sd, 'ci_low': mean - half_width, 'ci_high': mean + half_width}
+
+
+def write_frame_table(path: str,
+                      frame_ids: np.ndarray,
+                      columns: dict,
+                      chunk_frames: int = 100000):
+    """
+    Writes per-frame columns to a CSV, Parquet or Arrow (feather) file, picked from the extension, chunk_frames at a
+    time, so only one chunk is ever held as a dataframe
+    :param path: File to write, ending .csv, .parquet or .arrow
+    :param frame_ids: frame_id of each row, written as the first column
+    :param columns: dict of column name: array, each as long as frame_ids
+    :param chunk_frames: Rows to write at a time
+    """
+    formats: dict = {extension: name for name, extension in EXPORT_FORMATS.items()}
+    format: str = formats.get(os.path.splitext(path)[1])
+    if format is None:
+        raise ValueError(f"Don't know how to write {path}, expected one of {tuple(formats)}")
+
+    writer = None
+    for start in range(0, max(len(frame_ids), 1), chunk_frames):
+        chunk: pd.DataFrame = pd.DataFrame({'frame_id': frame_ids[start:start + chunk_frames],
+                                            **{str(name): np.asarray(values)[start:start + chunk_frames]
+                                               for name, values in columns.items()}})
+        if format == 'csv':
+            chunk.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+            continue
+        import pyarrow as pa
+        table: pa.Table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            if format == 'parquet':
+                import pyarrow.parquet as pq
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                writer = pa.ipc.new_file(path, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
 def calculate_avg_rolling_sd(df_list: list,
                              factor: str,
-                             window: int = 600):
-    # for df in df_list:
-    #     df.set_index(df['frame_id'], inplace=True)
-    #     df = df[[factor, 'frame_id']]
-    #
-    # df = pd.concat([df[[factor]] for df in df_list], axis=1)
-    #
-    # return df.std(axis=1)
+                             window: int = 600,
+                             confidence: float = 0.95,
+                             output_path: str = None,
+                             min_periods: int = None) -> pd.DataFrame:
+    """
+    Rolling sd of a factor for every recording, lined up by frame_id, with the mean, sd and confidence interval across
+    recordings at each frame
+    :param df_list: Dataframes (or FrameViews), one per recording
+    :param factor: Column to get the rolling sd of
+    :param window: Window length in frames
+    :param confidence: Confidence level of the interval
+    :param output_path: If given, the table is also streamed to this .csv, .parquet or .arrow file
+    :param min_periods: Fewest frames a window needs to get an sd, defaults to window, see rolling_sd_array
+    :return: pd.DataFrame indexed by frame_id, with a column per recording named by its position in df_list (or
+    "{position}_{fish_id}" per fish, for recordings with more than one) then n, mean, sd, ci_low and ci_high
+    """
+    frame_ids, aligned, labels = align_on_frames(df_list, factor)
+    sds: np.ndarray = rolling_sd_array(aligned, window, min_periods)
+    # A recording with one fish is named by its index, one with more gets a series per fish
+    fish_counts: dict = {}
+    for recording, _ in labels:
+        fish_counts[recording] = fish_counts.get(recording, 0) + 1
+    columns: dict = {}
+    for (recording, fish), values in zip(labels, sds):
+        name = recording if fish_counts[recording] == 1 else f"{recording}_{fish}"
+        if name in columns:
+            raise ValueError(f"Two series would both be written as column {name}")
+        columns[name] = values
+    columns.update(summarise_across_series(sds, confidence))
 
-    master: pd.DataFrame = pd.DataFrame({i: calculate_rolling_sd(df, factor, window) for i, df in enumerate(df_list)})
-    # master['mean'] = master.mean(axis=1)
-    return master
+    if output_path is not None:
+        write_frame_table(output_path, frame_ids, columns)
+    return pd.DataFrame(columns, index=pd.Index(frame_ids, name='frame_id'))
 
 
 def get_recognition_indices(same_tr: NovelObjectRecognitionTest,
@@ -109,6 +249,98 @@ def get_recognition_indices(same_tr: NovelObjectRecognitionTest,
     same_pref = same_tr.determine_object_preference_by_frame(exploration_area_radius)
     diff_pref = diff_tr.determine_object_preference_by_frame(exploration_area_radius)
 
+    return _recognition_indices_from_prefs(same_pref, diff_pref, same_tr.num_rows(), diff_tr.num_rows())
+
+
+def get_recognition_indices_by_window(same_tr: NovelObjectRecognitionTest,
+                                      diff_tr: NovelObjectRecognitionTest,
+                                      exploration_area_radius: int,
+                                      window_frames: int) -> dict:
+    """
+    Gets measures of recognition for every window_frames long window of a pair of recordings. Each recording is only
+    scanned once, so remove any erroneous regions from the full recording beforehand rather than per window.
+    :param same_tr: Training phase recording
+    :param diff_tr: Testing phase recording, assuming object b is the novel object
+    :param exploration_area_radius: Radius around each object considered near it
+    :param window_frames: Length of each window in frames
+    :return: dict of {first frame of window: dict of different measures}, for each window of same_tr
+    """
+    same_prefs: pd.DataFrame = same_tr.determine_object_preference_by_window(exploration_area_radius, window_frames)
+    diff_prefs: pd.DataFrame = diff_tr.determine_object_preference_by_window(exploration_area_radius, window_frames)
+    # If the testing recording is shorter, its missing windows just have no frames in them
+    diff_prefs = diff_prefs.reindex(same_prefs.index, fill_value=0)
+
+    return {int(window): _recognition_indices_from_prefs((int(same.pref_a), int(same.pref_b), int(same.no_pref)),
+                                                         (int(diff.pref_a), int(diff.pref_b), int(diff.no_pref)),
+                                                         int(same.num_frames),
+                                                         int(diff.num_frames))
+            for (window, same), (_, diff) in zip(same_prefs.iterrows(), diff_prefs.iterrows())}
+
+
+def get_recognition_indices_grid(same_tr: NovelObjectRecognitionTest,
+                                 diff_tr: NovelObjectRecognitionTest,
+                                 exploration_area_radii: np.ndarray,
+                                 windows: np.ndarray or int = None) -> pd.DataFrame:
+    """
+    Gets measures of recognition for every combination of radius and window, for sensitivity analyses. Each recording
+    is scanned once however many radii and windows are asked for.
+    :param same_tr: Training phase recording
+    :param diff_tr: Testing phase recording, assuming object b is the novel object
+    :param exploration_area_radii: Radii around each object considered near it
+    :param windows: (start frame, end frame) of each window, end exclusive, or a window length in frames to split
+    same_tr into consecutive windows. Defaults to one window covering both recordings
+    :return: pd.DataFrame with a row per radius per window, cols radius, window_start, window_end, then the measures
+    from get_recognition_indices
+    """
+    if windows is None:
+        windows = [(0, max(len(same_tr.positions), len(diff_tr.positions)))]
+    elif np.ndim(windows) == 0:
+        windows = [(start, start + windows) for start in same_tr.get_window_starts(windows)]
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+    radii: np.ndarray = np.asarray(exploration_area_radii, dtype=np.float64).ravel()
+
+    same_a, same_b, num_frames_same = same_tr.determine_object_preference_grid(radii, windows)
+    diff_a, diff_b, num_frames_diff = diff_tr.determine_object_preference_grid(radii, windows)
+
+    # Same sums as _recognition_indices_from_prefs, over (radius, window) arrays
+    e1: np.ndarray = same_a + same_b
+    e2: np.ndarray = diff_a + diff_b
+    d1: np.ndarray = diff_b - diff_a
+    d1_familiar: np.ndarray = same_b - same_a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d2: np.ndarray = np.where(e2 > 0, d1 / e2, np.NaN)
+        d3: np.ndarray = np.where(e2 > 0, diff_b / e2, np.NaN)
+        d2_familiar: np.ndarray = np.where(e1 > 0, d1_familiar / e1, np.NaN)
+        d3_familiar: np.ndarray = np.where(e1 > 0, same_b / e1, np.NaN)
+
+    shape: tuple = (len(radii), len(windows))
+    return pd.DataFrame({"radius": np.repeat(radii, len(windows)),
+                         "window_start": np.tile(windows[:, 0], len(radii)),
+                         "window_end": np.tile(windows[:, 1], len(radii)),
+                         "e1": e1.ravel(),
+                         "e2": e2.ravel(),
+                         "d1": d1.ravel(),
+                         "d2": d2.ravel(),
+                         "d3": d3.ravel(),
+                         "d1_familiar": d1_familiar.ravel(),
+                         "d2_familiar": d2_familiar.ravel(),
+                         "d3_familiar": d3_familiar.ravel(),
+                         "num_frames_same": np.broadcast_to(num_frames_same, shape).ravel(),
+                         "num_frames_diff": np.broadcast_to(num_frames_diff, shape).ravel()})
+
+
+def _recognition_indices_from_prefs(same_pref: tuple,
+                                    diff_pref: tuple,
+                                    num_frames_same: int,
+                                    num_frames_diff: int) -> dict:
+    """
+    Works out recognition indices from object preferences
+    :param same_pref: Preferences during training phase
+    :param diff_pref: Preferences during testing phase, assuming [1] is the novel object
+    :param num_frames_same: Number of frames in the training phase
+    :param num_frames_diff: Number of frames in the testing phase
+    :return: dict of different measures
+    """
     e1 = same_pref[0] + same_pref[1]
     e2 = diff_pref[0] + diff_pref[1]
 
@@ -136,8 +368,8 @@ def get_recognition_indices(same_tr: NovelObjectRecognitionTest,
             "d1_familiar": d1_familiar,
             "d2_familiar": d2_familiar,
             "d3_familiar": d3_familiar,
-            "num_frames_same": len(same_tr.positions_df),
-            "num_frames_diff": len(diff_tr.positions_df)}
+            "num_frames_same": num_frames_same,
+            "num_frames_diff": num_frames_diff}
 
 
 def get_ri_significance(index: list,
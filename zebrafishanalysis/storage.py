@@ -0,0 +1,199 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Describes the columns in a store, kept alongside the column files
+_MANIFEST_NAME: str = "manifest.json"
+
+
+class MemmapTrajectoryStore:
+    """
+    Column store backed by memory-mapped .npy files, one per column, for recordings too big to keep in RAM. Rows are
+    kept in the same (fish, frame) order as positions_df, and fish_offsets gives where each fish's rows start and end.
+    Only the pages actually touched get read in, so working through iter_chunks keeps memory use bounded by the chunk
+    size rather than the recording length.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 chunk_rows: int = 1_000_000):
+        """
+        Opens an existing store. Use from_dataframe to make one.
+        :param directory: Directory the store was written to
+        :param chunk_rows: Default number of rows per chunk when iterating
+        """
+        self.directory: str = directory
+        self.chunk_rows: int = chunk_rows
+        with open(os.path.join(directory, _MANIFEST_NAME)) as f:
+            manifest: dict = json.load(f)
+        self.num_rows: int = manifest['num_rows']
+        self.column_names: list = manifest['columns']
+        self.fish_offsets: np.ndarray = np.array(manifest['fish_offsets'], dtype=np.int64)
+        self._columns: dict = {}
+
+    @classmethod
+    def from_dataframe(cls,
+                       df: pd.DataFrame,
+                       directory: str,
+                       chunk_rows: int = 1_000_000) -> 'MemmapTrajectoryStore':
+        """
+        Writes a dataframe out to a new store. The index isn't kept.
+        :param df: Dataframe to store, normally a positions_df sorted by fish then frame
+        :param directory: Directory to write to, created if it doesn't exist
+        :param chunk_rows: Rows copied at a time
+        :return: MemmapTrajectoryStore
+        """
+        os.makedirs(directory, exist_ok=True)
+        for column in df.columns:
+            values: np.ndarray = df[column].to_numpy()
+            out: np.memmap = np.lib.format.open_memmap(cls._column_path(directory, column), mode='w+',
+                                                       dtype=values.dtype, shape=values.shape)
+            for start in range(0, len(values), chunk_rows):
+                out[start:start + chunk_rows] = values[start:start + chunk_rows]
+            out.flush()
+            del out
+
+        if 'fish_id' in df.columns:
+            starts: np.ndarray = np.flatnonzero(np.diff(df['fish_id'].to_numpy())) + 1
+            fish_offsets: list = [0, *starts.tolist(), len(df)]
+        else:
+            fish_offsets: list = [0, len(df)]
+
+        cls._write_manifest(directory, len(df), list(df.columns), fish_offsets)
+        return cls(directory, chunk_rows)
+
+    @staticmethod
+    def _write_manifest(directory: str,
+                        num_rows: int,
+                        columns: list,
+                        fish_offsets: list) -> None:
+        with open(os.path.join(directory, _MANIFEST_NAME), 'w') as f:
+            json.dump({'num_rows': num_rows, 'columns': columns, 'fish_offsets': fish_offsets}, f)
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.column_names
+
+    def column(self,
+               name: str) -> np.memmap:
+        """
+        Gets a column as a read-only memory-mapped array. Nothing is read until it's indexed.
+        :param name: Column to get
+        :return: np.memmap
+        """
+        if name not in self.column_names:
+            raise KeyError(f"{name} does not exist in store {self.directory}")
+        if name not in self._columns:
+            self._columns[name] = np.load(self._column_path(self.directory, name), mmap_mode='r')
+        return self._columns[name]
+
+    def put_column(self,
+                   name: str,
+                   values: np.ndarray) -> np.memmap:
+        """
+        Adds a column (or replaces one), e.g. a kinematic worked out after the store was made. The rows already in the
+        store are never changed, so values has to be in the same row order.
+        :param name: Column name
+        :param values: One value per row
+        :return: np.memmap: The stored column, read-only
+        """
+        values = np.asarray(values)
+        if len(values) != self.num_rows:
+            raise ValueError(f"Column {name} has {len(values)} rows, but the store has {self.num_rows}")
+        out: np.memmap = np.lib.format.open_memmap(self._column_path(self.directory, name), mode='w+',
+                                                   dtype=values.dtype, shape=values.shape)
+        for start in range(0, len(values), self.chunk_rows):
+            out[start:start + self.chunk_rows] = values[start:start + self.chunk_rows]
+        out.flush()
+        del out
+
+        self._columns.pop(name, None)
+        if name not in self.column_names:
+            self.column_names.append(name)
+        self._write_manifest(self.directory, self.num_rows, self.column_names, self.fish_offsets.tolist())
+        return self.column(name)
+
+    def put_array(self,
+                  name: str,
+                  array: np.ndarray) -> np.memmap:
+        """
+        Stores an array that isn't a column (e.g. the (frames, fish, 2) positions array) alongside the columns
+        :param name: Name to store it under
+        :param array: Array to store
+        :return: np.memmap: The stored array, read-only
+        """
+        path: str = os.path.join(self.directory, 'arrays', f"{name}.npy")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, array)
+        return np.load(path, mmap_mode='r')
+
+    def iter_chunks(self,
+                    columns: list,
+                    chunk_rows: int = None):
+        """
+        Yields consecutive blocks of rows from some columns
+        :param columns: Columns to include
+        :param chunk_rows: Rows per chunk, defaults to self.chunk_rows
+        :return: generator of (first row of chunk, dict of column name: np.ndarray view)
+        """
+        if chunk_rows is None:
+            chunk_rows = self.chunk_rows
+        mapped: dict = {name: self.column(name) for name in columns}
+        for start in range(0, self.num_rows, chunk_rows):
+            yield start, {name: array[start:start + chunk_rows] for name, array in mapped.items()}
+
+    def to_dataframe(self,
+                     columns: list = None,
+                     rows: np.ndarray = None) -> pd.DataFrame:
+        """
+        Reads (part of) the store into memory
+        :param columns: Columns to read, defaults to all of them
+        :param rows: Row numbers to read, defaults to all of them
+        :return: pd.DataFrame, indexed by row number in the store
+        """
+        if columns is None:
+            columns = self.column_names
+        if rows is None:
+            return pd.DataFrame({name: np.array(self.column(name)) for name in columns})
+        return pd.DataFrame({name: self.column(name)[rows] for name in columns}, index=rows)
+
+    @staticmethod
+    def _column_path(directory: str,
+                     column: str) -> str:
+        return os.path.join(directory, f"{column}.npy")
+
+
+def chunked_moments(store: MemmapTrajectoryStore,
+                    column: str,
+                    mask_func,
+                    chunk_rows: int = None) -> tuple:
+    """
+    Gets the count, mean and sample sd of the values in a column picked out by mask_func, chunk by chunk. Chunks are
+    merged with Chan et al.'s parallel update, so precision holds up over long recordings.
+    :param store: Store to read from
+    :param column: Column to summarise
+    :param mask_func: Function of a chunk of values returning a boolean mask of the ones to include
+    :param chunk_rows: Rows per chunk, defaults to the store's
+    :return: tuple: (count, mean, sd), with NaNs for mean/sd if there aren't enough values
+    """
+    count: int = 0
+    mean: float = 0.
+    m2: float = 0.
+    for _, chunk in store.iter_chunks([column], chunk_rows):
+        values: np.ndarray = chunk[column][mask_func(chunk[column])].astype(np.float64)
+        if len(values) == 0:
+            continue
+        chunk_mean: float = values.mean()
+        chunk_m2: float = np.square(values - chunk_mean).sum()
+        delta: float = chunk_mean - mean
+        total: int = count + len(values)
+        mean += delta * len(values) / total
+        m2 += chunk_m2 + delta ** 2 * count * len(values) / total
+        count = total
+
+    if count == 0:
+        return 0, np.NaN, np.NaN
+    return count, mean, np.sqrt(m2 / (count - 1)) if count > 1 else np.NaN
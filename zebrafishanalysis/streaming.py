@@ -0,0 +1,367 @@
+import numpy as np
+from zebrafishanalysis.gaps import GAP_MODES
+from zebrafishanalysis.kinematics import compute_kinematics
+from zebrafishanalysis.polygons import PolygonMask
+
+# Chunks passed between stages are dicts of {'start_frame': first frame of the chunk, column name: (frames, fish) array},
+# using the same column names as positions_df. Each stage is a generator taking and yielding chunks, so a whole
+# recording is never in memory at once.
+
+
+def iter_position_chunks(positions: np.ndarray,
+                         chunk_frames: int = 36000):
+    """
+    First stage of a pipeline, splits a (frames, fish, 2) positions array into chunks. To keep memory bounded, pass
+    something that's read lazily, e.g. an array opened with np.load(mmap_mode='r') or MemmapTrajectoryStore.put_array
+    :param positions: Positions array
+    :param chunk_frames: Number of frames per chunk
+    :return: generator of chunks with x_pos and y_pos
+    """
+    for start in range(0, len(positions), chunk_frames):
+        block: np.ndarray = np.array(positions[start:start + chunk_frames], dtype=np.float64)
+        yield {'start_frame': start, 'x_pos': block[:, :, 0], 'y_pos': block[:, :, 1]}
+
+
+def invert_y_stage(chunks,
+                   video_height: int):
+    """
+    Flips y positions, as TrajectoryObject does with invert_y
+    :param chunks: Upstream chunks
+    :param video_height: Height of the video in pixels
+    """
+    for chunk in chunks:
+        chunk['y_pos'] = video_height - chunk['y_pos']
+        yield chunk
+
+
+def remove_polygons_stage(chunks,
+                          polygons: list):
+    """
+    Sets positions falling inside any of the polygons to NaN, as remove_polygon_from_frames does. Its kinematics come
+    from kinematics_stage downstream, with gap_mode 'split' (or 'bridge' for calc_speed_including_skipped_frames)
+    :param chunks: Upstream chunks
+    :param polygons: List of lists of vertices
+    """
+    mask: PolygonMask = PolygonMask(polygons)
+    for chunk in chunks:
+        inside: np.ndarray = mask.contains(chunk['x_pos'], chunk['y_pos'])
+        chunk['x_pos'] = np.where(inside, np.NaN, chunk['x_pos'])
+        chunk['y_pos'] = np.where(inside, np.NaN, chunk['y_pos'])
+        yield chunk
+
+
+def kinematics_stage(chunks,
+                     frame_rate: float,
+                     pixel_dist_cm: float,
+                     erraticness_frames: int = 60,
+                     metrics: tuple = None,
+                     gap_mode: str = 'split'):
+    """
+    Adds kinematic columns, giving the same values as calculate_speeds on the whole recording with the same gap_mode.
+    The default, 'split', matches remove_polygon_from_frames, and 'bridge' matches it with
+    calc_speed_including_skipped_frames. Erraticness and acceleration look back over previous rows, so the last
+    erraticness_frames rows of each fish (valid rows, for 'bridge') are carried over between chunks. angle_diff_deg
+    looks one row ahead, so the last frame of each chunk is held back and emitted with the next one. With 'bridge' the
+    next row is the next valid one, so frames are held back from each fish's last valid row, meaning a long gap is
+    held in memory until the fish comes back.
+    :param chunks: Upstream chunks
+    :param frame_rate: Frames per second of the recording
+    :param pixel_dist_cm: cm per pixel
+    :param erraticness_frames: Number of frames to calculate erraticness over
+    :param metrics: Kinematic columns to add, defaults to all of them
+    :param gap_mode: How to handle removed (NaN) positions, one of GAP_MODES
+    """
+    if gap_mode not in GAP_MODES:
+        raise ValueError(f"gap_mode must be one of {GAP_MODES}, not {gap_mode}")
+    history: int = max(erraticness_frames, 2)
+    tail: list = None
+    held: dict = None
+
+    for chunk in chunks:
+        pending: dict = chunk if held is None else _concat_chunks(held, chunk)
+        hold_back: int = _frames_to_hold_back(pending, gap_mode)
+        emitted, tail = _chunk_kinematics(pending, tail, history, frame_rate, pixel_dist_cm, erraticness_frames,
+                                          metrics, gap_mode, hold_back)
+        held = _slice_chunk(pending, _num_frames(pending) - hold_back, _num_frames(pending))
+        if _num_frames(emitted) > 0:
+            yield emitted
+
+    if held is not None:
+        emitted, _ = _chunk_kinematics(held, tail, history, frame_rate, pixel_dist_cm, erraticness_frames, metrics,
+                                       gap_mode, hold_back=0)
+        yield emitted
+
+
+def freezing_stage(chunks,
+                   period: int = 120,
+                   threshold: float = 10):
+    """
+    Adds a freezing column, as determine_freezing does: the fish moved no more than threshold pixels over the last
+    period frames. The last period - 1 distances are carried over between chunks. Needs the distance column.
+    :param chunks: Upstream chunks
+    :param period: Number of frames to sum distance over
+    :param threshold: Maximum distance in pixels to count as freezing
+    """
+    carry: np.ndarray = None
+    for chunk in chunks:
+        sums, carry = rolling_sum_with_carry(chunk['distance'], carry, period)
+        chunk['freezing'] = sums <= threshold
+        yield chunk
+
+
+def object_distance_stage(chunks,
+                          object_a: tuple,
+                          object_b: tuple):
+    """
+    Adds dist_obj_a and dist_obj_b columns, as NovelObjectRecognitionTest does
+    :param chunks: Upstream chunks
+    :param object_a: (X, Y) of object a
+    :param object_b: (X, Y) of object b
+    """
+    for chunk in chunks:
+        chunk['dist_obj_a'] = np.sqrt((object_a[0] - chunk['x_pos']) ** 2 + (object_a[1] - chunk['y_pos']) ** 2)
+        chunk['dist_obj_b'] = np.sqrt((object_b[0] - chunk['x_pos']) ** 2 + (object_b[1] - chunk['y_pos']) ** 2)
+        yield chunk
+
+
+def stream_recording(positions: np.ndarray,
+                     frame_rate: float,
+                     pixel_dist_cm: float,
+                     chunk_frames: int = 36000,
+                     video_height: int = None,
+                     polygons_to_remove: list = None,
+                     object_locations: tuple = None,
+                     erraticness_frames: int = 60,
+                     freezing_period: int = None,
+                     metrics: tuple = None,
+                     gap_mode: str = 'split'):
+    """
+    Chains the stages above into the usual pipeline: load -> invert y -> polygon removal -> kinematics -> (freezing)
+    -> object distances. Feed the result to reduce_stream.
+    :param positions: (frames, fish, 2) positions array, ideally memory-mapped
+    :param frame_rate: Frames per second of the recording
+    :param pixel_dist_cm: cm per pixel
+    :param chunk_frames: Number of frames per chunk
+    :param video_height: Height of the video, to invert y. Leave as None to not invert
+    :param polygons_to_remove: List of lists of vertices of regions to remove
+    :param object_locations: ((obj_a_X, obj_a_Y), (obj_b_X, obj_b_Y)), to add object distances
+    :param erraticness_frames: Number of frames to calculate erraticness over
+    :param freezing_period: Number of frames to determine freezing over. Leave as None to skip freezing
+    :param metrics: Kinematic columns to add, defaults to all of them
+    :param gap_mode: How kinematics handle removed positions, see kinematics_stage
+    :return: generator of chunks
+    """
+    if freezing_period is not None and metrics is not None and 'distance' not in metrics:
+        metrics = (*metrics, 'distance')
+
+    chunks = iter_position_chunks(positions, chunk_frames)
+    if video_height is not None:
+        chunks = invert_y_stage(chunks, video_height)
+    if polygons_to_remove:
+        chunks = remove_polygons_stage(chunks, polygons_to_remove)
+    chunks = kinematics_stage(chunks, frame_rate, pixel_dist_cm, erraticness_frames, metrics, gap_mode)
+    if freezing_period is not None:
+        chunks = freezing_stage(chunks, freezing_period)
+    if object_locations is not None:
+        chunks = object_distance_stage(chunks, object_locations[0], object_locations[1])
+    return chunks
+
+
+def reduce_stream(chunks,
+                  accumulators: dict) -> dict:
+    """
+    Runs a stream through to the end, feeding every chunk to each accumulator
+    :param chunks: Chunks, e.g. from stream_recording
+    :param accumulators: dict of name: accumulator (anything with update(chunk) and result())
+    :return: dict of name: result of each accumulator
+    """
+    for chunk in chunks:
+        for accumulator in accumulators.values():
+            accumulator.update(chunk)
+    return {name: accumulator.result() for name, accumulator in accumulators.items()}
+
+
+class ObjectPreferenceCounter:
+    """
+    Streaming version of NovelObjectRecognitionTest.determine_object_preference_by_frame
+    """
+
+    def __init__(self, exploration_area_radius: float):
+        self.exploration_area_radius: float = exploration_area_radius
+        self.pref_a: int = 0
+        self.pref_b: int = 0
+        self.total: int = 0
+
+    def update(self, chunk: dict) -> None:
+        self.pref_a += int(np.count_nonzero(chunk['dist_obj_a'] < self.exploration_area_radius))
+        self.pref_b += int(np.count_nonzero(chunk['dist_obj_b'] < self.exploration_area_radius))
+        self.total += chunk['dist_obj_a'].size
+
+    def result(self) -> tuple:
+        """
+        :return: tuple: num frames near object a, num frames near object b, num frames near neither
+        """
+        return self.pref_a, self.pref_b, self.total - (self.pref_a + self.pref_b)
+
+
+class EdgeFrameCounter:
+    """
+    Counts frames spent outside a central region, as in the edge analysis
+    """
+
+    def __init__(self, central_region: list):
+        self.central_region: PolygonMask = PolygonMask(central_region)
+        self.total: int = 0
+        self.inside: int = 0
+
+    def update(self, chunk: dict) -> None:
+        self.inside += int(np.count_nonzero(self.central_region.contains(chunk['x_pos'], chunk['y_pos'])))
+        self.total += chunk['x_pos'].size
+
+    def result(self) -> dict:
+        """
+        :return: dict: Total frames and frames at edge
+        """
+        return {"Total Frames": self.total, "Frames at edge": self.total - self.inside}
+
+
+class StreamingHistogram:
+    """
+    Histogram of a column over fixed bin edges, e.g. of speed_cm
+    """
+
+    def __init__(self, column: str, bins: np.ndarray):
+        self.column: str = column
+        self.bins: np.ndarray = np.asarray(bins)
+        self.counts: np.ndarray = np.zeros(len(self.bins) - 1, dtype=np.int64)
+
+    def update(self, chunk: dict) -> None:
+        values: np.ndarray = chunk[self.column].ravel()
+        self.counts += np.histogram(values[np.isfinite(values)], bins=self.bins)[0]
+
+    def result(self) -> tuple:
+        """
+        :return: tuple: (counts, bin edges), as np.histogram
+        """
+        return self.counts, self.bins
+
+
+def rolling_sum_with_carry(values: np.ndarray,
+                           carry: np.ndarray,
+                           window: int) -> tuple:
+    """
+    Rolling sum down axis 0 of a chunk, continuing on from the previous chunk. Like pandas' rolling(window).sum(), a
+    window with any NaN in it, or without enough frames before it, gives NaN.
+    :param values: (frames, fish) values of this chunk
+    :param carry: Carry returned for the previous chunk, or None for the first chunk
+    :param window: Window length in frames
+    :return: tuple: ((frames, fish) rolling sums, carry for the next chunk)
+    """
+    if carry is None:
+        carry = values[:0]
+    extended: np.ndarray = np.concatenate((carry, values))
+    nans: np.ndarray = np.isnan(extended)
+
+    zero: np.ndarray = np.zeros((1, extended.shape[1]))
+    value_sums: np.ndarray = np.concatenate((zero, np.cumsum(np.where(nans, 0, extended), axis=0)))
+    nan_counts: np.ndarray = np.concatenate((zero, np.cumsum(nans, axis=0)))
+
+    # Window ending at row j of extended covers rows j - window + 1 to j
+    ends: np.ndarray = np.arange(len(carry), len(extended)) + 1
+    starts: np.ndarray = ends - window
+    valid: np.ndarray = starts >= 0
+    sums: np.ndarray = np.full(values.shape, np.NaN)
+    sums[valid] = value_sums[ends[valid]] - value_sums[starts[valid]]
+    sums[valid] = np.where(nan_counts[ends[valid]] - nan_counts[starts[valid]] > 0, np.NaN, sums[valid])
+
+    return sums, extended[-(window - 1):] if window > 1 else extended[:0]
+
+
+def _chunk_kinematics(pending: dict,
+                      tail: list,
+                      history: int,
+                      frame_rate: float,
+                      pixel_dist_cm: float,
+                      erraticness_frames: int,
+                      metrics: tuple,
+                      gap_mode: str,
+                      hold_back: int) -> tuple:
+    """
+    Works out kinematics for pending, using the rows in tail as history
+    :param tail: Per fish (frame ids, x, y) of earlier rows, as returned by the last call, or None for the first chunk
+    :return: tuple: (pending minus the last hold_back frames, with kinematic cols; tail for the next call)
+    """
+    num_frames, num_fish = pending['x_pos'].shape
+    frames: np.ndarray = pending['start_frame'] + np.arange(num_frames)
+    if tail is None:
+        tail = [(frames[:0], pending['x_pos'][:0, fish], pending['y_pos'][:0, fish]) for fish in range(num_fish)]
+
+    # compute_kinematics wants fish-major rows, each fish's tail then its pending frames. Tails can differ in length
+    # between fish, as 'bridge' only keeps valid rows
+    rows: list = [(np.concatenate((tail_frames, frames)),
+                   np.concatenate((tail_x, pending['x_pos'][:, fish])),
+                   np.concatenate((tail_y, pending['y_pos'][:, fish])))
+                  for fish, (tail_frames, tail_x, tail_y) in enumerate(tail)]
+    offsets: np.ndarray = np.concatenate(([0], np.cumsum([len(fish_frames) for fish_frames, _, _ in rows])))
+    kinematics: dict = compute_kinematics(np.concatenate([fish_frames for fish_frames, _, _ in rows]),
+                                          np.concatenate([x for _, x, _ in rows]),
+                                          np.concatenate([y for _, _, y in rows]),
+                                          offsets,
+                                          frame_rate,
+                                          pixel_dist_cm,
+                                          erraticness_frames,
+                                          metrics,
+                                          gap_mode)
+
+    end: int = num_frames - hold_back
+    # Row of each emitted frame for each fish, skipping its tail
+    emitted_rows: np.ndarray = (offsets[:-1] + [len(tail_frames) for tail_frames, _, _ in tail]) + \
+        np.arange(end)[:, np.newaxis]
+    emitted: dict = _slice_chunk(pending, 0, end)
+    for name, column in kinematics.items():
+        emitted[name] = column[emitted_rows]
+
+    # Keep enough already-emitted rows to look back over next time. 'bridge' looks back over valid rows only
+    new_tail: list = []
+    for fish, (fish_frames, x, y) in enumerate(rows):
+        keep: np.ndarray = np.arange(len(tail[fish][0]) + end)
+        if gap_mode == 'bridge':
+            keep = keep[~(np.isnan(x[keep]) | np.isnan(y[keep]))]
+        keep = keep[-history:]
+        new_tail.append((fish_frames[keep], x[keep], y[keep]))
+    return emitted, new_tail
+
+
+def _frames_to_hold_back(pending: dict,
+                         gap_mode: str) -> int:
+    """
+    Number of frames at the end of pending whose angle_diff_deg can't be known until the next chunk arrives
+    """
+    num_frames: int = _num_frames(pending)
+    if gap_mode != 'bridge':
+        return min(1, num_frames)
+    # Each fish's last valid row looks ahead to its next valid row, which may be in a later chunk. Every fish has its
+    # last valid row in pending, unless it's had none yet, as rows are only emitted once they have a next valid row
+    valid: np.ndarray = ~(np.isnan(pending['x_pos']) | np.isnan(pending['y_pos']))
+    seen: np.ndarray = valid.any(axis=0)
+    last_valid: np.ndarray = num_frames - 1 - np.argmax(valid[::-1], axis=0)
+    return num_frames - int(np.min(last_valid[seen], initial=max(num_frames - 1, 0)))
+
+
+def _num_frames(chunk: dict) -> int:
+    return len(chunk['x_pos'])
+
+
+def _slice_chunk(chunk: dict,
+                 start: int,
+                 end: int) -> dict:
+    sliced: dict = {name: value[start:end] for name, value in chunk.items() if name != 'start_frame'}
+    sliced['start_frame'] = chunk['start_frame'] + start
+    return sliced
+
+
+def _concat_chunks(first: dict,
+                   second: dict) -> dict:
+    joined: dict = {name: np.concatenate((first[name], second[name])) for name in first if name != 'start_frame'}
+    joined['start_frame'] = first['start_frame']
+    return joined
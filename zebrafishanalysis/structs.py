@@ -1,8 +1,19 @@
 import numpy as np
 import pandas as pd
 import trajectorytools as tt
-import matplotlib.path as pltpath
-from pymediainfo import MediaInfo
+from zebrafishanalysis.cache import TrajectoryCache
+from zebrafishanalysis.compact import COMPACT_FLOAT_DTYPE, compact_dataframe
+from zebrafishanalysis.derived import DerivedColumn, update_derived_columns
+from zebrafishanalysis.gaps import SegmentIndex
+from zebrafishanalysis.kinematics import KINEMATIC_COLUMNS, compute_kinematics, fish_offsets, is_fish_frame_sorted, \
+    update_kinematics
+from zebrafishanalysis.occupancy import OccupancyIndex
+from zebrafishanalysis.polygons import PolygonMask
+from zebrafishanalysis.query import TrajectoryQuery
+from zebrafishanalysis.rolling import rolling_stats
+from zebrafishanalysis.storage import MemmapTrajectoryStore, chunked_moments
+from zebrafishanalysis.video import VideoMetadata, get_video_metadata
+from zebrafishanalysis.views import FrameView
 
 
 class TrajectoryObject:
@@ -14,7 +25,11 @@ class TrajectoryObject:
                  video_path: str = None,
                  invert_y: bool = True,
                  period: slice = None,
-                 left_wall_coords: tuple = None):
+                 left_wall_coords: tuple = None,
+                 metrics: tuple = None,
+                 cache: TrajectoryCache = None,
+                 video_metadata: VideoMetadata = None,
+                 compact: bool = False):
 
         # Set some generic params for easy inspection at a later date. Mostly just pull from tt properties
         self.num_fish: int = len(raw_loaded_trajectories.identity_labels)
@@ -26,10 +41,14 @@ class TrajectoryObject:
         self.pixel_dist_cm: float =  11 / self.distance_between_points(left_wall_coords[0], left_wall_coords[1])
 
         # If a video path is supplied, we set the path as a property and extract the dimensions. A video path isn't
-        # necessary though, it's really only helpful for the GUI helpers
-        if video_path:
-            self.video_path: str = video_path
-            self.video_dimensions: tuple = get_video_dimensions(self.video_path)
+        # necessary though, it's really only helpful for the GUI helpers. Metadata can also be given directly, so
+        # objects can be built on machines that don't have the video.
+        if video_metadata is None and video_path:
+            video_metadata = get_video_metadata(video_path)
+        if video_metadata is not None:
+            self.video_metadata: VideoMetadata = video_metadata
+            self.video_path: str = video_metadata.path
+            self.video_dimensions: tuple = video_metadata.dimensions
         # period allows for slicing. So, we could (e.g.) grab recordings by 10 minute periods by passing incrementing
         # slices. We apply this **before** frame removal for several important reasons.
         if period is None:
@@ -42,22 +61,163 @@ class TrajectoryObject:
         if invert_y is True:
             self.positions[:, :, 1] = self.video_dimensions[1] - self.positions[:, :, 1]
 
+        # Compact mode keeps everything in smaller dtypes (see compact.py for what precision that costs), roughly
+        # halving memory use. Kinematics are still worked out in float64, only the stored results are rounded.
+        self.compact: bool = compact
+        if compact is True:
+            self.positions = self.positions.astype(COMPACT_FLOAT_DTYPE)
+
         # Now we've inverted the positions array, we need to turn it into a dataframe. This is because we're giving the
         # option of removing frames. Calculations of speed assume the same time difference between datapoints, if we're
         # removing all points that lie in one area, then we're creating irregular periods between datapoints. We want
         # to store data in a table with cols X, Y, fish_id, frame_id. This is also good from a tidy-data pov.
 
-        list_of_dicts: list = []
-        # There's probably a better way of doing this, but this way turned out to take <1second anyway, which seems
-        # odd to me. Might require changing if we have a really big dataset
-        for frame_id, frame in enumerate(self.positions):
-            for fish_id, fish in enumerate(frame):
-                list_of_dicts.append({'frame_id': frame_id,
-                                      'fish_id': fish_id,
-                                      'x_pos': fish[0],
-                                      'y_pos': fish[1]})
-        self.positions_df = pd.DataFrame(list_of_dicts, columns=['frame_id', 'fish_id', 'x_pos', 'y_pos'])
-        self.calculate_speeds(inplace=True)
+        # Kinematic columns to keep in positions_df. Most analyses only need one or two of them, so asking for just
+        # those saves a lot of time and memory. Anything left out can still be added later with ensure_metrics.
+        self.metrics: tuple = KINEMATIC_COLUMNS if metrics is None else tuple(metrics)
+        # How kinematics treat rows with no position, see GAP_MODES. Set by remove_polygon_from_frames.
+        self.gap_mode: str = 'still'
+
+        # If we've built this exact dataframe before (same file, same params), we can pull it from the cache. Only
+        # possible if tt knows which file the trajectories came from.
+        cache_key: str = None
+        cached_df: pd.DataFrame = None
+        if cache is not None and 'path' in raw_loaded_trajectories.params:
+            cache_key = cache.make_key(raw_loaded_trajectories.params['path'],
+                                       kind='positions_df',
+                                       interpolate_nans=raw_loaded_trajectories.params.get('interpolate_nans'),
+                                       smooth=raw_loaded_trajectories.params.get('smooth_params'),
+                                       invert_y=invert_y,
+                                       video_dimensions=getattr(self, 'video_dimensions', None),
+                                       period=period,
+                                       left_wall_coords=left_wall_coords,
+                                       metrics=self.metrics,
+                                       compact=compact)
+            cached_df = cache.get_dataframe(cache_key)
+
+        if cached_df is not None:
+            self.positions_df = cached_df
+        else:
+            self.positions_df = positions_to_dataframe(self.positions)
+            self.calculate_speeds(inplace=True)
+            if cache_key is not None:
+                cache.put_dataframe(cache_key, self.positions_df)
+
+    @property
+    def positions_df(self) -> pd.DataFrame:
+        """
+        Table with a row per fish per frame, holding positions and kinematics. If the object has been moved to a
+        MemmapTrajectoryStore (see move_to_store) this reads the whole table back into memory, so prefer methods that
+        work through the store in chunks.
+        """
+        if self.store is not None:
+            return self.store.to_dataframe()
+        return self._positions_df
+
+    @positions_df.setter
+    def positions_df(self, df: pd.DataFrame):
+        # A new dataframe replaces whatever was in the store, and any index built from the old one
+        self._positions_df = df
+        self.store = None
+        self._occupancy_index = None
+        self._segment_index = None
+        self._query_cache = {}
+        self._heatmap_cache = {}
+
+    def num_rows(self) -> int:
+        """
+        :return: int: Number of rows in positions_df, without reading it in if it's in a store
+        """
+        if self.store is not None:
+            return len(self.store)
+        return len(self._positions_df)
+
+    def column(self,
+               name: str) -> np.ndarray:
+        """
+        Gets a column of positions_df as an array. If the object is in a store the column comes memory-mapped, so
+        only the parts actually indexed get read in.
+        :param name: Column to get
+        :return: np.ndarray, or np.memmap from a store
+        """
+        if self.store is not None:
+            return self.store.column(name)
+        if name not in self._positions_df.columns:
+            raise KeyError(f"{name} does not exist in positions_df")
+        return self._positions_df[name].to_numpy()
+
+    def move_to_store(self,
+                      directory: str,
+                      chunk_rows: int = 1_000_000) -> MemmapTrajectoryStore:
+        """
+        Moves positions and positions_df out of memory into memory-mapped files. flatten_fish_positions,
+        get_point_bools, drop_errors and determine_object_preference_by_frame then work through the store chunk by
+        chunk, and column, num_rows and queries read single columns from it. The store is read only, anything that
+        modifies positions_df in place brings it back into memory.
+        :param directory: Directory to keep the store in
+        :param chunk_rows: Rows to work on at a time
+        :return: MemmapTrajectoryStore
+        """
+        store: MemmapTrajectoryStore = MemmapTrajectoryStore.from_dataframe(self._positions_df, directory, chunk_rows)
+        self.positions = store.put_array('positions', self.positions)
+        self._positions_df = None
+        self.store = store
+        return store
+
+    def view(self) -> FrameView:
+        """
+        Gets a FrameView of positions_df, for chaining filters without copying the table at every step. Pass it as df
+        to drop_errors, trim_to_polygon or trim_based_on_objs, then materialize the result once at the end, e.g.
+        tr.trim_based_on_objs('obj_a', 200, df=tr.drop_errors('speed', 2500, df=tr.view())).materialize()
+        :return: FrameView with every row kept
+        """
+        return FrameView(self.positions_df)
+
+    def query(self) -> TrajectoryQuery:
+        """
+        Starts a lazy query of positions_df, e.g. tr.query().drop_errors('speed', 2500).near('obj_a', 200)
+        .select('speed_cm').to_numpy(). See TrajectoryQuery.
+        :return: TrajectoryQuery with no steps
+        """
+        return TrajectoryQuery(self)
+
+    def query_cache(self) -> dict:
+        """
+        :return: dict: Masks worked out by queries, keyed by the steps leading to them. Cleared with positions_df
+        """
+        if getattr(self, '_query_cache', None) is None:
+            self._query_cache = {}
+        return self._query_cache
+
+    def occupancy_index(self,
+                        cell_size: float = 1.) -> OccupancyIndex:
+        """
+        Gets an OccupancyIndex of positions_df, for counting frames near points or inside polygons without rescanning
+        the dataframe each time. Built on first use and kept until positions_df is replaced.
+        :param cell_size: Width/height of the index's cells in pixels
+        :return: OccupancyIndex
+        """
+        index: OccupancyIndex = getattr(self, '_occupancy_index', None)
+        if index is None or index.cell_size != cell_size:
+            index = OccupancyIndex(self.column('x_pos'), self.column('y_pos'), cell_size)
+            self._occupancy_index = index
+        return index
+
+    def segment_index(self) -> SegmentIndex:
+        """
+        Gets a SegmentIndex of the runs of rows in positions_df (sorted by fish, then frame, as calculate_speeds leaves
+        it) holding a position. Built on first use and kept until positions_df is replaced.
+        :return: SegmentIndex
+        """
+        index: SegmentIndex = getattr(self, '_segment_index', None)
+        if index is None:
+            offsets: np.ndarray = self.store.fish_offsets if self.store is not None else \
+                fish_offsets(self.column('fish_id'))
+            index = SegmentIndex.from_positions(np.asarray(self.column('x_pos'), dtype=np.float64),
+                                                np.asarray(self.column('y_pos'), dtype=np.float64),
+                                                offsets)
+            self._segment_index = index
+        return index
 
     def get_fish_pos(self,
                      fish_num: int,
@@ -71,9 +231,8 @@ class TrajectoryObject:
         Returns:
             tuple: (X,Y) coordinates of a fish at a particular time
         """
-        fish = self.positions_df[self.positions_df['fish_id'] == fish_num]
-        row = fish[fish['frame_id'] == frame_num]
-        return float(row['x_pos']), float(row['y_pos'])
+        row: np.ndarray = np.flatnonzero((self.column('fish_id') == fish_num) & (self.column('frame_id') == frame_num))
+        return float(self.column('x_pos')[row].item()), float(self.column('y_pos')[row].item())
 
     @staticmethod
     def distance_between_points(point_a: tuple,
@@ -96,54 +255,104 @@ class TrajectoryObject:
         :return: np.ndarray: list of fish positions
         """
         # todo: re-implement fish-index based slicing
+        if self.store is not None:
+            flattened: np.ndarray = np.empty((len(self.store), 2))
+            for start, chunk in self.store.iter_chunks(['x_pos', 'y_pos']):
+                flattened[start:start + len(chunk['x_pos']), 0] = chunk['x_pos']
+                flattened[start:start + len(chunk['y_pos']), 1] = chunk['y_pos']
+            return flattened
+
         df_sel = self.positions_df[['x_pos', 'y_pos']]
         return df_sel.to_numpy()
 
+    def get_window_starts(self,
+                          window_frames: int) -> np.ndarray:
+        """
+        Gets the first frame of each window_frames long window of the recording. The last window may be shorter.
+        :param window_frames: Length of each window in frames
+        :return: np.ndarray of frame ids
+        """
+        return np.arange(0, len(self.positions), window_frames)
+
     def remove_polygon_from_frames(self,
                                    raw_vertices: list,
                                    df: pd.DataFrame = None,
                                    inplace: bool = False,
                                    calc_speed_including_skipped_frames: bool = False) -> pd.DataFrame:
         """
-        Removes all points falling inside a particular polygon from the positions_df array
-        :param raw_vertices: List of vertices bounding the polygon of interest
-        :param df: Dataframe to perform removal on
+        Removes all points falling inside a particular polygon (or any of a list of polygons) from the positions_df
+        array. All the polygons are checked in one pass, and kinematics are only recalculated once at the end.
+        :param raw_vertices: List of vertices bounding the polygon of interest, or a list of such polygons
+        :param df: Dataframe to perform removal on. Defaults to positions_df, read in once if the object is in a store
         :param inplace: Modify the object dataframe if true
-        :param calc_speed_including_skipped_frames: Should speeds after skipped frames be NaN or calculated based on the
-        time elapsed? Defaults to NaN
+        :param calc_speed_including_skipped_frames: Should kinematics after skipped frames be NaN or calculated based on
+        the time elapsed? Defaults to NaN. See the 'split' and 'bridge' GAP_MODES
         :return:
         """
+        gap_mode: str = 'bridge' if calc_speed_including_skipped_frames else 'split'
+        before: SegmentIndex = None
         if df is None:
-            df = self.positions_df.copy()
+            df = self.positions_df
+            before = self.segment_index()
 
-        df.reset_index(drop=True, inplace=True)
-        point_bools: pd.Series = self.get_point_bools(raw_vertices, df)
+        # Only x_pos and y_pos change, so rather than copying everything we take a shallow copy sharing the other
+        # columns, and give it new position columns
+        df = df.copy(deep=False)
+        df.index = pd.RangeIndex(len(df))
+        point_bools: np.ndarray = self.get_point_bools(raw_vertices, df).to_numpy()
+        fish_ids: np.ndarray = df['fish_id'].to_numpy()
+        frame_ids: np.ndarray = df['frame_id'].to_numpy()
+        sorted_rows: bool = is_fish_frame_sorted(fish_ids, frame_ids)
+        if sorted_rows:
+            offsets: np.ndarray = fish_offsets(fish_ids)
+            if before is None:
+                before = SegmentIndex.from_positions(df['x_pos'].to_numpy(dtype=np.float64),
+                                                     df['y_pos'].to_numpy(dtype=np.float64), offsets)
         # Set both positions to not a number
-        df['x_pos'].loc[-point_bools] = np.NaN
-        df['y_pos'].loc[-point_bools] = np.NaN
-        df_w_speeds = self.calculate_speeds(df)
+        df['x_pos'] = np.where(point_bools, np.NaN, df['x_pos'].to_numpy())
+        df['y_pos'] = np.where(point_bools, np.NaN, df['y_pos'].to_numpy())
+
+        # If df's kinematics were worked out the way we want, only the rows around the removed points need redoing.
+        # Without any gaps every gap mode gives the same kinematics, so that's also true of a fresh object.
+        after: SegmentIndex = None
+        if sorted_rows and all(name in df.columns for name in self.metrics) and \
+                (getattr(self, 'gap_mode', 'still') == gap_mode or not before.has_gaps):
+            removed_rows: np.ndarray = np.flatnonzero(point_bools)
+            after = before.remove_rows(removed_rows)
+            df = self._recalculate_near(df, {'x_pos': removed_rows, 'y_pos': removed_rows}, offsets, gap_mode, after)
+        else:
+            df = self._update_derived_columns(self.calculate_speeds(df, gap_mode=gap_mode))
+
         if inplace is True:
             self.positions_df = df
+            self.gap_mode = gap_mode
+            self._segment_index = after
         return df
 
     def trim_to_polygon(self,
                         vertices: list,
-                        df: pd.DataFrame = None,
+                        df: pd.DataFrame or FrameView = None,
                         inplace: bool = False):
         """
         Trims out a polygon and returns all points lying within it
         :param vertices:
-        :param df:
+        :param df: Dataframe, or FrameView to narrow down without copying
         :param inplace:
-        :return:
+        :return: pd.DataFrame, or a FrameView if given one
         """
+        if isinstance(df, FrameView):
+            view: FrameView = df.where(PolygonMask(vertices).contains(df.base_column('x_pos'), df.base_column('y_pos')))
+            if inplace is True:
+                self.positions_df = view.materialize()
+            return view
 
         if df is None:
-            df = self.positions_df.copy()
+            df = self.positions_df
 
-        df.reset_index(drop=True, inplace=True)
-        point_bools = self.get_point_bools(vertices, df)
-        df = df[point_bools]
+        # Rows keep their position in the original table as their index
+        rows: np.ndarray = np.flatnonzero(self.get_point_bools(vertices, df).to_numpy())
+        df = df.iloc[rows]
+        df.index = pd.Index(rows)
 
         if inplace is True:
             self.positions_df = df
@@ -155,29 +364,232 @@ class TrajectoryObject:
                         df: pd.DataFrame) -> pd.Series:
         """
         Method to return boolean values if point within bounded area
-        :param raw_vertices: Vertices binding the polygon
-        :param df: Dataframe to inspect
+        :param raw_vertices: Vertices binding the polygon, or a list of polygons to check all at once
+        :param df: Dataframe (or MemmapTrajectoryStore, which is checked chunk by chunk) to inspect
         :return: np.ndarray True/False
         """
-        vertices: np.ndarray = np.array(raw_vertices)
-        path: pltpath.Path = pltpath.Path(vertices)
-        points_to_check: np.ndarray = df[['x_pos', 'y_pos']].to_numpy().astype(float)
-        return pd.Series(path.contains_points(points_to_check)).astype(bool)
+        mask: PolygonMask = PolygonMask(raw_vertices)
+        if isinstance(df, MemmapTrajectoryStore):
+            inside: np.ndarray = np.empty(len(df), dtype=bool)
+            for start, chunk in df.iter_chunks(['x_pos', 'y_pos']):
+                inside[start:start + len(chunk['x_pos'])] = mask.contains(chunk['x_pos'], chunk['y_pos'])
+            return pd.Series(inside)
+
+        return pd.Series(mask.contains(df['x_pos'].to_numpy(), df['y_pos'].to_numpy()))
+
+    def _derived_columns(self,
+                         df: pd.DataFrame) -> list:
+        """
+        Hook for subclasses to add columns worked out from positions or kinematics, which are then kept up to date
+        whenever positions change
+        :param df: Dataframe the columns are for
+        :return: list of DerivedColumns, each after any it's worked out from
+        """
+        derived: list = []
+        if 'freezing' in df.columns and 'distance' in df.columns:
+            period: int = getattr(self, 'freezing_period', 120)
+
+            def freezing(columns: dict, offsets: np.ndarray) -> np.ndarray:
+                path_length: np.ndarray = rolling_stats(columns['distance'], [period], ('sum',), offsets,
+                                                        columns['frame_id'])[('sum', period)]
+                return path_length <= 10
+
+            derived.append(DerivedColumn('freezing', ('distance', 'frame_id'), freezing, before=period - 1))
+        return derived
+
+    def _update_derived_columns(self,
+                                df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Refreshes every derived column (see _derived_columns), after positions have changed
+        :param df: Dataframe with updated positions, sorted by fish then frame
+        :return: pd.DataFrame
+        """
+        derived: list = self._derived_columns(df)
+        if derived:
+            offsets: np.ndarray = fish_offsets(df['fish_id'].to_numpy())
+            for column in derived:
+                df[column.name] = column.compute({name: df[name].to_numpy() for name in column.inputs}, offsets)
+        return df
+
+    def _recalculate_kept(self,
+                          df: pd.DataFrame,
+                          kept_rows: np.ndarray,
+                          num_rows: int) -> pd.DataFrame:
+        """
+        Recalculates kinematic and derived columns for some rows kept from a bigger dataframe. Only the rows next to
+        dropped ones get new neighbours, so if the kept rows are still in order only those are worked out again.
+        :param df: The kept rows, with the columns they had in the bigger dataframe
+        :param kept_rows: Positions of the kept rows in the bigger dataframe
+        :param num_rows: Number of rows in the bigger dataframe
+        :return: pd.DataFrame
+        """
+        fish_ids: np.ndarray = df['fish_id'].to_numpy()
+        if not is_fish_frame_sorted(fish_ids, df['frame_id'].to_numpy()) or \
+                not all(name in df.columns for name in self.metrics):
+            return self._update_derived_columns(self.calculate_speeds(raw_df=df))
+
+        # Both sides of each dropped stretch have a new neighbour, which matters when it's also a change of fish
+        after_gap: np.ndarray = np.flatnonzero(np.diff(kept_rows) > 1) + 1
+        changed_rows: np.ndarray = np.concatenate((after_gap - 1, after_gap))
+        if len(kept_rows) > 0:
+            changed_rows = np.concatenate((changed_rows, [0] if kept_rows[0] > 0 else [],
+                                           [len(kept_rows) - 1] if kept_rows[-1] < num_rows - 1 else []))
+        return self._recalculate_near(df.copy(deep=False), {'frame_id': changed_rows.astype(np.int64)},
+                                      fish_offsets(fish_ids), getattr(self, 'gap_mode', 'still'))
+
+    def _recalculate_near(self,
+                          df: pd.DataFrame,
+                          changed: dict,
+                          offsets: np.ndarray,
+                          gap_mode: str,
+                          segments: SegmentIndex = None) -> pd.DataFrame:
+        """
+        Brings kinematic and derived columns up to date after a few rows changed, only working out again the rows near
+        them. Everything else in df must still be valid, i.e. worked out in gap_mode from the same neighbours.
+        :param df: Dataframe sorted by fish then frame. Changed columns are replaced, not modified
+        :param changed: dict of {column name: rows changed}. x_pos/y_pos for rows that lost their positions, frame_id
+        for rows next to dropped ones
+        :param offsets: Fish boundaries of df, see fish_offsets
+        :param gap_mode: How to treat rows without a position, see GAP_MODES
+        :param segments: SegmentIndex of df's positions, if already known
+        :return: pd.DataFrame
+        """
+        for name in KINEMATIC_COLUMNS:
+            if name in df.columns and name not in self.metrics:
+                del df[name]
+        kinematics: dict = {name: df[name].to_numpy(copy=True) for name in self.metrics}
+        rows: np.ndarray = update_kinematics(kinematics, df['frame_id'].to_numpy(), df['x_pos'].to_numpy(),
+                                             df['y_pos'].to_numpy(), offsets, np.concatenate(list(changed.values())),
+                                             self.frame_rate, self.pixel_dist_cm, gap_mode=gap_mode,
+                                             segments=segments)
+        changed = {**changed, **{name: rows for name in kinematics}}
+
+        derived: list = self._derived_columns(df)
+        columns: dict = {name: df[name].to_numpy() for column in derived for name in column.inputs}
+        columns.update({column.name: df[column.name].to_numpy(copy=True) for column in derived})
+        update_derived_columns({**columns, **kinematics}, derived, changed, offsets)
+        for name in [*kinematics, *(column.name for column in derived)]:
+            df[name] = kinematics[name] if name in kinematics else columns[name]
+        return df
 
     def calculate_speeds(self,
                          raw_df: pd.DataFrame = None,
                          inplace: bool = False,
-                         erraticness_frames: int = 60) -> pd.DataFrame:
+                         erraticness_frames: int = 60,
+                         engine: str = 'numpy',
+                         metrics: tuple = None,
+                         gap_mode: str = None) -> pd.DataFrame:
         """
         Method invoked when a dataframe update occurs, e.g. when we remove rows from it
-        :return: None
+        :param raw_df: Dataframe to calculate speeds for. Defaults to positions_df
+        :param inplace: Modify the object dataframe if true
+        :param erraticness_frames: Number of frames to calculate erraticness over
+        :param engine: 'numpy' (default) works on each fish's block of rows directly, 'pandas' is the original
+        implementation, kept as a reference
+        :param metrics: Kinematic columns to calculate, defaults to self.metrics. Any other kinematic columns already in
+        the dataframe are dropped, as they'd no longer match the rows
+        :param gap_mode: How to treat rows without a position (see GAP_MODES), defaults to self.gap_mode. The pandas
+        engine only does 'still'
+        :return: pd.DataFrame sorted by fish, then frame, with kinematic cols added
         """
         if raw_df is None:
-            df = self.positions_df.copy()
+            raw_df = self.positions_df
+        if metrics is None:
+            metrics = self.metrics
+        if gap_mode is None:
+            gap_mode = getattr(self, 'gap_mode', 'still')
+
+        stale_columns: list = [name for name in KINEMATIC_COLUMNS if name in raw_df.columns and name not in metrics]
+        if engine == 'pandas':
+            if gap_mode != 'still':
+                raise ValueError(f"The pandas engine can't do gap mode {gap_mode}, only 'still'")
+            df = self._calculate_speeds_pandas(raw_df.drop(columns=stale_columns), erraticness_frames)
+            df.drop(columns=[name for name in KINEMATIC_COLUMNS if name not in metrics], inplace=True)
+        elif engine == 'numpy':
+            fish_ids: np.ndarray = raw_df['fish_id'].to_numpy()
+            frame_ids: np.ndarray = raw_df['frame_id'].to_numpy()
+            # Only pay for a full sort if the rows aren't already in (fish, frame) order. After the first call they
+            # normally are, as we store the sorted frame.
+            if is_fish_frame_sorted(fish_ids, frame_ids):
+                # Every column we set is a new array, so a shallow copy is enough to leave raw_df untouched
+                df = raw_df.copy(deep=False)
+                for name in stale_columns:
+                    del df[name]
+            else:
+                df = raw_df.drop(columns=stale_columns).sort_values(['fish_id', 'frame_id'])
+                fish_ids, frame_ids = df['fish_id'].to_numpy(), df['frame_id'].to_numpy()
+
+            kinematics: dict = compute_kinematics(frame_ids,
+                                                  df['x_pos'].to_numpy(),
+                                                  df['y_pos'].to_numpy(),
+                                                  fish_offsets(fish_ids),
+                                                  self.frame_rate,
+                                                  self.pixel_dist_cm,
+                                                  erraticness_frames,
+                                                  metrics,
+                                                  gap_mode)
+            for name, column in kinematics.items():
+                df[name] = column
         else:
-            # This is required to suppress some weird errors that occur because of
-            df = raw_df.copy()
+            raise ValueError(f"Unknown engine {engine}, expected 'numpy' or 'pandas'")
+
+        if getattr(self, 'compact', False) is True:
+            df = compact_dataframe(df, inplace=True)
+
+        if inplace is True:
+            self.positions_df = df
+        return df
+
+    def ensure_metrics(self,
+                       *metrics: str,
+                       erraticness_frames: int = 60) -> pd.DataFrame:
+        """
+        Adds any of the requested kinematic columns missing from positions_df. They're then kept up to date by any
+        later recalculation (e.g. after removing frames), like the metrics asked for when the object was made. For an
+        object moved to a store (see move_to_store) the new columns are added to the store.
+        :param metrics: Names of kinematic columns needed
+        :param erraticness_frames: Number of frames to calculate erraticness over
+        :return: pd.DataFrame: positions_df, or None if the object is in a store, so it isn't read into memory
+        """
+        columns: list = self.store.column_names if self.store is not None else self._positions_df.columns
+        missing: tuple = tuple(name for name in metrics if name not in columns)
+        if not missing:
+            return self._positions_df
+        kept_metrics: tuple = tuple(name for name in KINEMATIC_COLUMNS if name in self.metrics or name in missing)
+
+        get = self.store.column if self.store is not None else lambda name: self._positions_df[name].to_numpy()
+        fish_ids: np.ndarray = np.asarray(get('fish_id'))
+        frame_ids: np.ndarray = np.asarray(get('frame_id'))
+        if not is_fish_frame_sorted(fish_ids, frame_ids):
+            # Everything gets recalculated in order, which brings a stored object back into memory
+            self.metrics = kept_metrics
+            return self.calculate_speeds(inplace=True, erraticness_frames=erraticness_frames)
 
+        # The existing columns are still valid for these rows, so we only work out the new ones
+        kinematics: dict = compute_kinematics(frame_ids,
+                                              np.asarray(get('x_pos')),
+                                              np.asarray(get('y_pos')),
+                                              fish_offsets(fish_ids),
+                                              self.frame_rate,
+                                              self.pixel_dist_cm,
+                                              erraticness_frames,
+                                              missing,
+                                              getattr(self, 'gap_mode', 'still'))
+        for name, column in kinematics.items():
+            column = column.astype(COMPACT_FLOAT_DTYPE) if getattr(self, 'compact', False) else column
+            if self.store is not None:
+                self.store.put_column(name, column)
+            else:
+                self._positions_df[name] = column
+        self.metrics = kept_metrics
+        return self._positions_df
+
+    def _calculate_speeds_pandas(self,
+                                 df: pd.DataFrame,
+                                 erraticness_frames: int) -> pd.DataFrame:
+        """
+        Reference pandas implementation of calculate_speeds. Modifies df.
+        """
         # Sort values by fish ID, then frame ID so we have an entire fish in order
         df.sort_values(['fish_id', 'frame_id'], inplace=True)
         # Create True/False col that say if previous frame is previous fish or not
@@ -195,13 +607,13 @@ class TrajectoryObject:
         df['acceleration'] = df['speed'].diff() / (df['frame_id'].diff() * (1 / self.frame_rate))
         df['acceleration_cm'] = df['speed_cm'].diff() / (df['frame_id'].diff() * (1 / self.frame_rate))
 
-        # Eraticness is calculated using
+        # Eraticness is the path length over the window divided by the straight line distance across it
         df['erraticness'] = df['distance'].rolling(erraticness_frames).sum() / np.sqrt(
-            df.x_pos.diff(periods=erraticness_frames) ** 2 + distances.y_pos.diff(periods=erraticness_frames) ** 2)
+            df.x_pos.diff(periods=erraticness_frames) ** 2 + df.y_pos.diff(periods=erraticness_frames) ** 2)
 
-        # Calculate the raw bearing in radians
+        # Calculate the raw bearing in radians. The first frame of a fish has no previous point to take a bearing from
         df['raw_bearing'] = np.arctan2((df.y_pos - df['y_pos'].shift(1)),
-                                       (df.x_pos - df['x_pos'].shift(1)))
+                                       (df.x_pos - df['x_pos'].shift(1))).where(df['fish_match'])
         # Convert raw bearing to degrees
         df['deg_bearing'] = df['raw_bearing'] * (180 / np.pi)
         df['deg_bearing'] = df['deg_bearing'].mask(df['deg_bearing'] < 0, df['deg_bearing'] + 360)
@@ -210,52 +622,133 @@ class TrajectoryObject:
         df['angle_diff_deg'] = np.degrees(np.abs(df['raw_bearing'].shift(-1) - df['raw_bearing']) % (np.pi * 2))
         df['angle_diff_deg'] = df['angle_diff_deg'].mask(df['angle_diff_deg'] > 180, np.abs(df['angle_diff_deg'] - 360))
 
-        if inplace is True:
-            self.positions_df = df
         return df
 
-
     def drop_errors(self,
                     factor: str,
                     cutoff: int,
-                    df: pd.DataFrame = None,
+                    df: pd.DataFrame or FrameView = None,
                     sds: int = None,
                     inplace: bool = False,
                     recalculate: bool = False,
                     include_skip_frames_on_recalc: bool = False):
-        if df is None:
-            df = self.positions_df
-
-        try:
-            output_df = df[df[factor] < cutoff]
-            output_df = output_df[output_df[factor] > -cutoff]
-
-            mean = output_df[factor].mean()
-            sd = output_df[factor].std()
-            if sds:
-                output_df = output_df[output_df[factor] < mean + sd * sds]
-                output_df = output_df[output_df[factor] > mean - sd * sds]
+        # A kinematic left out of metrics is added first, if df is (a view of) our own table so it'll show up in it
+        base = df.base if isinstance(df, FrameView) else df
+        if factor in KINEMATIC_COLUMNS and (base is None or base is self._positions_df):
+            self.ensure_metrics(factor)
 
+        if df is None and self.store is not None:
+            output_df = self._drop_errors_from_store(factor, cutoff, sds)
             if recalculate is True:
                 output_df = self.calculate_speeds(raw_df=output_df)
-
             if inplace is True:
                 self.positions_df = output_df
+            return output_df
 
-        except KeyError:
+        if df is None:
+            df = self.positions_df
+
+        if isinstance(df, FrameView):
+            view: FrameView = df.where(self._error_mask(df.base_column(factor), cutoff, sds, df.mask))
+            if recalculate is True:
+                output_df = self._recalculate_kept(view.materialize(), view.rows, len(view.base))
+                if inplace is True:
+                    self.positions_df = output_df
+                return output_df
+            if inplace is True:
+                self.positions_df = view.materialize()
+            return view
+
+        if factor not in df.columns:
             raise KeyError(f"{factor} does not exist in positions_df")
 
+        # The filters are combined into one mask, so there's a single copy at the end rather than one per filter
+        keep: np.ndarray = self._error_mask(df[factor].to_numpy(), cutoff, sds)
+        output_df = df[keep]
+
+        if recalculate is True:
+            output_df = self._recalculate_kept(output_df, np.flatnonzero(keep), len(df))
+
+        if inplace is True:
+            self.positions_df = output_df
+
         return output_df
 
+    @staticmethod
+    def _error_mask(values: np.ndarray,
+                    cutoff: int,
+                    sds: int = None,
+                    within: np.ndarray = None) -> np.ndarray:
+        """
+        Rows drop_errors keeps: inside +-cutoff, and if sds is given, within sds standard deviations of the mean of
+        the rows inside the cutoff
+        :param values: Values of the factor
+        :param cutoff: Absolute cutoff
+        :param sds: Number of standard deviations to keep
+        :param within: Only consider these rows (e.g. a FrameView's mask)
+        :return: np.ndarray of bools
+        """
+        keep: np.ndarray = (values < cutoff) & (values > -cutoff)
+        if within is not None:
+            keep &= within
+        if sds:
+            # Always take moments in float64, in case the column is float32
+            kept: np.ndarray = values[keep].astype(np.float64)
+            mean: float = kept.mean() if len(kept) > 0 else np.NaN
+            sd: float = kept.std(ddof=1) if len(kept) > 1 else np.NaN
+            keep &= (values < mean + sd * sds) & (values > mean - sd * sds)
+        return keep
+
+    def _drop_errors_from_store(self,
+                                factor: str,
+                                cutoff: int,
+                                sds: int = None) -> pd.DataFrame:
+        """
+        drop_errors, working through the store chunk by chunk. Only the rows that are kept get read into memory.
+        """
+        if factor not in self.store:
+            raise KeyError(f"{factor} does not exist in positions_df")
+
+        def within_cutoff(values: np.ndarray) -> np.ndarray:
+            return (values < cutoff) & (values > -cutoff)
+
+        if sds:
+            _, mean, sd = chunked_moments(self.store, factor, within_cutoff)
+
+        rows_to_keep: list = []
+        for start, chunk in self.store.iter_chunks([factor]):
+            values: np.ndarray = chunk[factor]
+            keep: np.ndarray = within_cutoff(values)
+            if sds:
+                keep &= (values < mean + sd * sds) & (values > mean - sd * sds)
+            rows_to_keep.append(np.flatnonzero(keep) + start)
+
+        return self.store.to_dataframe(rows=np.concatenate(rows_to_keep) if rows_to_keep else np.array([], dtype=int))
+
     def determine_freezing(self, period: int = 120, df: pd.DataFrame = None, inplace: bool = False):
+        """
+        Adds a freezing column: True where the fish moved no more than 10 pixels over the last period frames. Windows
+        are per fish and stop at gaps in the frames, as we can't say a fish froze over frames we don't have.
+        :param period: Number of frames to sum distance over
+        :param df: Dataframe to use, defaults to positions_df
+        :param inplace: Modify the object dataframe if true
+        :return: pd.DataFrame
+        """
         if df is None:
-            df = self.positions_df.copy()
-
-        df['freezing'] = df['distance'].rolling(period).sum().le(10)
+            df = self.positions_df
 
+        path_length: pd.Series = rolling_column(df, 'distance', [period], ('sum',), break_on_gaps=True)[('sum', period)]
+        freezing: pd.Series = path_length.le(10)
         if inplace is True:
+            df['freezing'] = freezing
             self.positions_df = df
+            # Kept up to date with this period from now on, see _derived_columns
+            self.freezing_period = period
+            return df
 
+        # Only the new column needs its own memory, the rest can be shared with df
+        df = df.copy(deep=False)
+        df['freezing'] = freezing
         return df
 
 class NovelObjectRecognitionTest(TrajectoryObject):
@@ -267,7 +760,10 @@ class NovelObjectRecognitionTest(TrajectoryObject):
                  video_path: str = None,
                  invert_y: bool = True,
                  period: slice = None,
-                 ):
+                 metrics: tuple = None,
+                 cache: TrajectoryCache = None,
+                 video_metadata: VideoMetadata = None,
+                 compact: bool = False):
 
         # TODO: to be reworked to avoid duplication
         TrajectoryObject.__init__(self,
@@ -275,14 +771,28 @@ class NovelObjectRecognitionTest(TrajectoryObject):
                                   video_path=video_path,
                                   invert_y=invert_y,
                                   period=period,
-                                  left_wall_coords=left_wall_coords)
+                                  left_wall_coords=left_wall_coords,
+                                  metrics=metrics,
+                                  cache=cache,
+                                  video_metadata=video_metadata,
+                                  compact=compact)
         self.object_a: tuple = object_locations[0]
         self.object_b: tuple = object_locations[1]
 
-        self.positions_df['dist_obj_a'] = np.sqrt((self.object_a[0] - self.positions_df['x_pos']) ** 2 +
-                                                  (self.object_a[1] - self.positions_df['y_pos']) ** 2)
-        self.positions_df['dist_obj_b'] = np.sqrt((self.object_b[0] - self.positions_df['x_pos']) ** 2 +
-                                                  (self.object_b[1] - self.positions_df['y_pos']) ** 2)
+        self._update_derived_columns(self.positions_df)
+
+    def _derived_columns(self,
+                         df: pd.DataFrame) -> list:
+        """
+        Adds the distance to each object to the derived columns
+        """
+        def distance_to(point: tuple):
+            return lambda columns, offsets: np.sqrt((point[0] - columns['x_pos']) ** 2 +
+                                                    (point[1] - columns['y_pos']) ** 2)
+
+        return [DerivedColumn('dist_obj_a', ('x_pos', 'y_pos'), distance_to(self.object_a)),
+                DerivedColumn('dist_obj_b', ('x_pos', 'y_pos'), distance_to(self.object_b)),
+                *TrajectoryObject._derived_columns(self, df)]
 
     def determine_object_preference_by_frame(self,
                                              exploration_area_radius: float) -> tuple:
@@ -295,10 +805,14 @@ class NovelObjectRecognitionTest(TrajectoryObject):
             tuple: num frames closer to object a, num frames closer to object b
         """
 
-        if self.distance_between_points(self.object_a, self.object_b) <= exploration_area_radius:
-            raise ValueError(
-                f"Exploration area supplied ({exploration_area_radius}) is greater than distance between novel objects "
-                f"(({self.distance_between_points(self.object_a, self.object_b)}).")
+        self._check_exploration_area(exploration_area_radius)
+
+        if self.store is not None:
+            pref_a, pref_b = 0, 0
+            for _, chunk in self.store.iter_chunks(['dist_obj_a', 'dist_obj_b']):
+                pref_a += int(np.count_nonzero(chunk['dist_obj_a'] < exploration_area_radius))
+                pref_b += int(np.count_nonzero(chunk['dist_obj_b'] < exploration_area_radius))
+            return pref_a, pref_b, len(self.store) - (pref_a + pref_b)
 
         # FILTER BY dist_obj_a and DIST_obj_b!
         pref_a = len(self.positions_df[self.positions_df['dist_obj_a'] < exploration_area_radius])
@@ -306,23 +820,136 @@ class NovelObjectRecognitionTest(TrajectoryObject):
         no_pref = len(self.positions_df) - (pref_a + pref_b)
         return pref_a, pref_b, no_pref
 
+    def determine_object_preference_by_radii(self,
+                                             exploration_area_radii: np.ndarray) -> pd.DataFrame:
+        """
+        Same as determine_object_preference_by_frame, but for a whole sweep of radii at once. Counts come from the
+        occupancy index, so after the first call each extra radius costs next to nothing.
+        :param exploration_area_radii: Radii around each object considered near it
+        :return: pd.DataFrame indexed by radius, with cols pref_a, pref_b, no_pref
+        """
+        radii: np.ndarray = np.asarray(exploration_area_radii, dtype=np.float64)
+        self._check_exploration_area(radii.max())
+
+        index: OccupancyIndex = self.occupancy_index()
+        pref_a: np.ndarray = index.count_within_radii(self.object_a, radii)
+        pref_b: np.ndarray = index.count_within_radii(self.object_b, radii)
+        return pd.DataFrame({'pref_a': pref_a,
+                             'pref_b': pref_b,
+                             'no_pref': index.total - (pref_a + pref_b)},
+                            index=pd.Index(radii, name='radius'))
+
+    def determine_object_preference_by_window(self,
+                                              exploration_area_radius: float,
+                                              window_frames: int) -> pd.DataFrame:
+        """
+        Same as determine_object_preference_by_frame, but for every window_frames long window of the recording at once.
+        Counts for all windows come out of a single pass over the dataframe, so there's no need to reload the recording
+        with a period for each window.
+        :param exploration_area_radius: Radius around each object considered near it
+        :param window_frames: Length of each window in frames
+        :return: pd.DataFrame indexed by the first frame of each window, with cols pref_a, pref_b, no_pref, num_frames
+        """
+        self._check_exploration_area(exploration_area_radius)
+
+        window_starts: np.ndarray = self.get_window_starts(window_frames)
+        window_index: np.ndarray = (self.column('frame_id') // window_frames).astype(np.int64)
+        num_windows: int = len(window_starts)
+
+        num_frames: np.ndarray = np.bincount(window_index, minlength=num_windows)
+        pref_a: np.ndarray = np.bincount(window_index,
+                                         weights=self.column('dist_obj_a') < exploration_area_radius,
+                                         minlength=num_windows).astype(np.int64)
+        pref_b: np.ndarray = np.bincount(window_index,
+                                         weights=self.column('dist_obj_b') < exploration_area_radius,
+                                         minlength=num_windows).astype(np.int64)
+
+        return pd.DataFrame({'pref_a': pref_a,
+                             'pref_b': pref_b,
+                             'no_pref': num_frames - (pref_a + pref_b),
+                             'num_frames': num_frames},
+                            index=pd.Index(window_starts, name='window'))
+
+    def determine_object_preference_grid(self,
+                                         exploration_area_radii: np.ndarray,
+                                         windows: np.ndarray) -> tuple:
+        """
+        Object preferences for every combination of radius and window, from one pass over the dataframe. Rows are
+        binned by which radii they fall within and which stretch between window boundaries they're in, then cumulative
+        sums over both give the counts for every radius and window at once.
+        :param exploration_area_radii: Radii around each object considered near it
+        :param windows: (start frame, end frame) of each window, end exclusive. Windows can overlap
+        :return: tuple: (pref_a, pref_b) arrays of shape (radii, windows), and num_frames, an array of shape (windows,)
+        """
+        radii: np.ndarray = np.asarray(exploration_area_radii, dtype=np.float64)
+        windows = np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+        self._check_exploration_area(radii.max())
+
+        frame_ids: np.ndarray = self.column('frame_id')
+        dists: tuple = (self.column('dist_obj_a'), self.column('dist_obj_b'))
+
+        # Split the frames up at every window boundary. Each window is then a run of consecutive segments
+        edges: np.ndarray = np.unique(windows)
+        num_segments: int = max(len(edges) - 1, 1)
+        segment: np.ndarray = np.searchsorted(edges, frame_ids, side='right') - 1
+        in_segment: np.ndarray = (segment >= 0) & (segment < len(edges) - 1)
+        segment = segment[in_segment]
+        window_start: np.ndarray = np.searchsorted(edges, windows[:, 0])
+        window_end: np.ndarray = np.searchsorted(edges, windows[:, 1])
+
+        def sum_over_windows(per_segment: np.ndarray) -> np.ndarray:
+            cumulative: np.ndarray = np.concatenate((np.zeros((*per_segment.shape[:-1], 1), dtype=np.int64),
+                                                     np.cumsum(per_segment, axis=-1)), axis=-1)
+            return cumulative[..., window_end] - cumulative[..., window_start]
+
+        # Sorting the radii, a row is within radius k if k >= the number of radii <= its distance. NaN distances sort
+        # past every radius, so are never within any.
+        order: np.ndarray = np.argsort(radii)
+        prefs: list = []
+        for dist in dists:
+            bucket: np.ndarray = np.searchsorted(radii[order], np.asarray(dist)[in_segment], side='right')
+            counts: np.ndarray = np.bincount(bucket * num_segments + segment,
+                                             minlength=(len(radii) + 1) * num_segments)
+            within: np.ndarray = np.cumsum(counts.reshape(len(radii) + 1, num_segments), axis=0)[:len(radii)]
+            prefs.append(sum_over_windows(within)[np.argsort(order)])
+
+        num_frames: np.ndarray = sum_over_windows(np.bincount(segment, minlength=num_segments))
+        return prefs[0], prefs[1], num_frames
+
+    def _check_exploration_area(self,
+                                exploration_area_radius: float) -> None:
+        """
+        Raises a ValueError if the exploration areas around the two objects would overlap
+        :param exploration_area_radius: Radius to check
+        """
+        if self.distance_between_points(self.object_a, self.object_b) <= exploration_area_radius:
+            raise ValueError(
+                f"Exploration area supplied ({exploration_area_radius}) is greater than distance between novel objects "
+                f"(({self.distance_between_points(self.object_a, self.object_b)}).")
+
     def trim_based_on_objs(self,
                            obj: str,
                            exploration_area_radius: int,
-                           df: pd.DataFrame = None,
+                           df: pd.DataFrame or FrameView = None,
                            inplace: bool = False) -> pd.DataFrame:
         """
         Trims dataframe down to only frames where fish near objects
         :param obj: Object to inspect
         :param exploration_area_radius: Radius considered near
-        :param df: Dataframe to inspect
+        :param df: Dataframe, or FrameView to narrow down without copying
         :param inplace: Destructively change self.positions_df?
-        :return:
+        :return: pd.DataFrame, or a FrameView if given one
         """
+        if isinstance(df, FrameView):
+            view: FrameView = df.where(df.base_column(f'dist_{obj}') < exploration_area_radius)
+            if inplace is True:
+                self.positions_df = view.materialize()
+            return view
+
         if df is None:
-            df = self.positions_df.copy()
+            df = self.positions_df
 
-        df = df[df[f'dist_{obj}'] < exploration_area_radius]
+        df = df[df[f'dist_{obj}'].to_numpy() < exploration_area_radius]
 
         if inplace is True:
             self.positions_df = df
@@ -330,10 +957,71 @@ class NovelObjectRecognitionTest(TrajectoryObject):
         return df
 
 
-def get_video_dimensions(path: str) -> tuple:
-    media_info: MediaInfo.parse = MediaInfo.parse(path)
+def positions_to_dataframe(positions: np.ndarray,
+                           coord_dtype: np.dtype = None,
+                           vectorized: bool = True) -> pd.DataFrame:
+    """
+    Turns a (frames, fish, 2) positions array into a tidy dataframe with cols frame_id, fish_id, x_pos, y_pos. Rows
+    are ordered by frame, then by fish, i.e. the same order you'd get from iterating over the array.
+    :param positions: Array of positions, as given by tt.Trajectories.s
+    :param coord_dtype: dtype to use for x_pos and y_pos. Defaults to the dtype of positions (float64 from tt)
+    :param vectorized: Build the columns straight from the array. If False, falls back to the old dict-per-row loop,
+    which is only really kept around so the two can be benchmarked against each other. It's left exactly as it was,
+    so gives int64 frame_id/fish_id columns and ignores coord_dtype
+    :return: pd.DataFrame with int32 frame_id/fish_id columns
+    """
+    num_frames, num_fish = positions.shape[0], positions.shape[1]
+    if coord_dtype is None:
+        coord_dtype = positions.dtype
+
+    if vectorized is False:
+        list_of_dicts: list = []
+        for frame_id, frame in enumerate(positions):
+            for fish_id, fish in enumerate(frame):
+                list_of_dicts.append({'frame_id': frame_id,
+                                      'fish_id': fish_id,
+                                      'x_pos': fish[0],
+                                      'y_pos': fish[1]})
+        return pd.DataFrame(list_of_dicts, columns=['frame_id', 'fish_id', 'x_pos', 'y_pos'])
+
+    # The array is (frames, fish, 2) in C order, so flattening the first two axes gives frame-major rows. frame_id
+    # then repeats each frame num_fish times, and fish_id cycles through the fish once per frame.
+    flat: np.ndarray = positions.reshape(num_frames * num_fish, positions.shape[2])
+    return pd.DataFrame({'frame_id': np.repeat(np.arange(num_frames, dtype=np.int32), num_fish),
+                         'fish_id': np.tile(np.arange(num_fish, dtype=np.int32), num_frames),
+                         'x_pos': flat[:, 0].astype(coord_dtype),
+                         'y_pos': flat[:, 1].astype(coord_dtype)})
+
+
+def rolling_column(df: pd.DataFrame,
+                   column: str,
+                   windows: list,
+                   stats: tuple = ('mean',),
+                   break_on_gaps: bool = False) -> dict:
+    """
+    rolling_stats for a column of a positions_df, per fish. Rows don't have to be sorted, results line up with df.
+    :param df: Dataframe with fish_id and frame_id cols
+    :param column: Column to summarise
+    :param windows: Window sizes, in rows
+    :param stats: See rolling_stats
+    :param break_on_gaps: Also stop windows at gaps in the frames (e.g. left by drop_errors)
+    :return: dict of {(stat, window): pd.Series indexed like df}
+    """
+    fish_ids: np.ndarray = df['fish_id'].to_numpy()
+    frame_ids: np.ndarray = df['frame_id'].to_numpy()
+    values: np.ndarray = df[column].to_numpy()
+
+    order: np.ndarray = None
+    if not is_fish_frame_sorted(fish_ids, frame_ids):
+        order = np.lexsort((frame_ids, fish_ids))
+        fish_ids, frame_ids, values = fish_ids[order], frame_ids[order], values[order]
 
-    for track in media_info.tracks:
-        if track.track_type == 'Video':
-            video_dimensions = (track.width, track.height)
-    return video_dimensions
+    results: dict = rolling_stats(values, windows, stats, fish_offsets(fish_ids),
+                                  frame_ids if break_on_gaps else None)
+    for key, result in results.items():
+        if order is not None:
+            unsorted: np.ndarray = np.empty_like(result)
+            unsorted[order] = result
+            result = unsorted
+        results[key] = pd.Series(result, index=df.index, name=column)
+    return results
@@ -3,10 +3,12 @@ import trajectorytools as tt
 import tkinter as tk
 import sys
 from PIL import ImageTk, Image
-import av
 import numpy as np
 from shapely.geometry import Polygon
-from zebrafishanalysis.structs import TrajectoryObject, get_video_dimensions
+from zebrafishanalysis.cache import TrajectoryCache
+from zebrafishanalysis.frames import get_reference_frame
+from zebrafishanalysis.structs import TrajectoryObject
+from zebrafishanalysis.video import get_video_dimensions
 
 
 class SelectPolygon:
@@ -14,18 +16,16 @@ class SelectPolygon:
     def __init__(self,
                  master: tk.Tk,
                  vid_path: str,
-                 title_text: str = "za: Generic Window"):
+                 title_text: str = "za: Generic Window",
+                 frame: np.ndarray = None):
         master: tk.Tk = master
         master.title(title_text)
         self.dimensions: tuple = get_video_dimensions(vid_path)
 
-        # Get frame of video. I **really** hate this, but cannot get it to work otherwise and cannot be bothered to \
-        # improve it as it works. Urgh.
-        vid_container = av.open(vid_path)
-        for f in vid_container.decode(video=0):
-            fr = f.to_image()
-            break
-        img = ImageTk.PhotoImage(fr)
+        # Frame to draw on, see frames.get_reference_frame
+        if frame is None:
+            frame = get_reference_frame(vid_path)
+        img = ImageTk.PhotoImage(Image.fromarray(frame))
 
         # Generate canvas, pack canvas into window, fill canvas with image
         self.canvas: tk.Canvas = tk.Canvas(master)
@@ -100,37 +100,52 @@ def invert_y(v: list,
 
 
 def select_pos_from_video(tr: TrajectoryObject = None,
-                          vid_path: str = None) -> tuple:
+                          vid_path: str = None,
+                          reference: str = 'first',
+                          cache: TrajectoryCache = None) -> tuple:
     """Allows for GUI selection of objects in NORT video
     Args:
         tr (TrajectoryObject): The trajectory object to select objects from
+        reference (str): Frame to show, one of frames.REFERENCE_METHODS
+        cache (TrajectoryCache): Cache to keep the frame in, so it isn't decoded again next time
     Returns:
         tuple: Tuple of structure:
             ((obj_a_X, obj_a_Y), (obj_b_X, obj_b_Y), ((obj_a_vertices_list), (obj_b_vertices_list)))
     """
     if not vid_path:
         vid_path = tr.video_path
-    obj_a: np.ndarray = select_polygon(video_path=vid_path, window_title="Select Object A")
-    obj_b: np.ndarray = select_polygon(video_path=vid_path, window_title="Select Object B")
+    # Both windows show the same frame, so it's only got the once
+    frame: np.ndarray = get_reference_frame(vid_path, reference, cache=cache)
+    obj_a: np.ndarray = select_polygon(video_path=vid_path, window_title="Select Object A", frame=frame)
+    obj_b: np.ndarray = select_polygon(video_path=vid_path, window_title="Select Object B", frame=frame)
 
     return get_centroid(obj_a), get_centroid(obj_b), (obj_a, obj_b)
 
 
 def select_polygon(tr: TrajectoryObject = None,
                    video_path: str = None,
-                   window_title: str = "Select Polygon") -> np.ndarray:
+                   window_title: str = "Select Polygon",
+                   frame: np.ndarray = None,
+                   reference: str = 'first',
+                   cache: TrajectoryCache = None) -> np.ndarray:
     """Helper for polygonal selection from video frame
     Args:
         tr (TrajectoryObject): The trajectory object to inspect
         window_title (str): Help text to put in window title
+        frame (np.ndarray): Frame to draw on, if already got. Otherwise one is got with get_reference_frame
+        reference (str): Frame to show if one isn't given, one of frames.REFERENCE_METHODS
+        cache (TrajectoryCache): Cache to keep the frame in, so it isn't decoded again next time
     Returns:
         np.ndarray: array of vertices
     """
     if not video_path:
         video_path = tr.video_path
 
+    if frame is None:
+        frame = get_reference_frame(video_path, reference, cache=cache)
+
     root = tk.Tk()
-    win = SelectPolygon(root, vid_path=video_path, title_text=window_title)
+    win = SelectPolygon(root, vid_path=video_path, title_text=window_title, frame=frame)
     root.mainloop()
     # We need to flip the verticies
     vertices: np.array = invert_y(win.vertices, dimensions=get_video_dimensions(video_path))
@@ -139,12 +154,14 @@ def select_polygon(tr: TrajectoryObject = None,
 
 def load_gapless_trajectories(wo_gaps: str,
                               interpolate_nans: bool = True,
-                              smooth: dict = {'sigma': 1}) -> tt.Trajectories:
+                              smooth: dict = {'sigma': 1},
+                              cache: TrajectoryCache = None) -> tt.Trajectories:
     """Loads gapless trajectories from a idtrackerai numpy file
     Args:
         wo_gaps (str): Path to numpy file (should be trajectories_wo_gaps or trajectories .npy originally)
         interpolate_nans (bool): When loading from idtrackerai interpolate NaN values
         smooth (dict): Define how to smooth params when loading from idtrackerai
+        cache (TrajectoryCache): Cache to reuse processed trajectories from, skipping interpolation and smoothing
     Returns:
         tt.Trajectories: Processed trajectories
     """
@@ -153,9 +170,14 @@ def load_gapless_trajectories(wo_gaps: str,
 
     # Attempts to load the file, throws exception if the file isn't found
     try:
-        trajectories_raw: tt.Trajectories = tt.Trajectories.from_idtrackerai(wo_gaps,
-                                                                             interpolate_nans=interpolate_nans,
-                                                                             smooth_params=smooth)
+        if cache is None:
+            trajectories_raw: tt.Trajectories = tt.Trajectories.from_idtrackerai(wo_gaps,
+                                                                                 interpolate_nans=interpolate_nans,
+                                                                                 smooth_params=smooth)
+        else:
+            trajectories_raw: tt.Trajectories = cache.load_trajectories(wo_gaps,
+                                                                        interpolate_nans=interpolate_nans,
+                                                                        smooth=smooth)
         logging.info(f'Loaded file {wo_gaps}')
     except FileNotFoundError:
         logging.fatal(f'File {wo_gaps} not found')
@@ -196,7 +218,7 @@ def crush_multiple_objects(objects: list,
         return np.vstack(positions)
     else:
         try:
-            stack: list = [obj.positions_df[[factor]].to_numpy() for obj in objects]
+            stack: list = [np.asarray(obj.column(factor)).reshape(-1, 1) for obj in objects]
         except ValueError:
             raise ValueError("Factor not found")
         return np.vstack(stack)
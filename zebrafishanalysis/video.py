@@ -0,0 +1,173 @@
+import json
+import os
+from pymediainfo import MediaInfo
+
+# Sidecar file, kept in the same directory as the videos, holding metadata for every video probed there
+METADATA_INDEX_NAME: str = ".za_video_metadata.json"
+
+# In process memo of {absolute path: VideoMetadata}
+_metadata_memo: dict = {}
+
+
+class VideoMetadata:
+    """
+    The bits of a video's metadata we care about. Objects can be built from one of these without the video itself
+    being present, e.g. on headless compute nodes with only the trajectories and sidecar index copied over.
+    """
+
+    def __init__(self,
+                 path: str,
+                 width: int,
+                 height: int,
+                 frame_count: int = None,
+                 fps: float = None,
+                 size: int = None,
+                 mtime_ns: int = None):
+        """
+        :param path: Path to the video
+        :param width: Width in pixels
+        :param height: Height in pixels
+        :param frame_count: Number of frames, if known
+        :param fps: Frames per second, if known
+        :param size: Size of the video file when probed, used to spot changed files
+        :param mtime_ns: mtime of the video file when probed, used to spot changed files
+        """
+        self.path: str = path
+        self.width: int = width
+        self.height: int = height
+        self.frame_count: int = frame_count
+        self.fps: float = fps
+        self.size: int = size
+        self.mtime_ns: int = mtime_ns
+
+    @property
+    def dimensions(self) -> tuple:
+        """
+        :return: tuple: (width, height), as returned by get_video_dimensions
+        """
+        return self.width, self.height
+
+    def to_dict(self) -> dict:
+        return {'path': self.path,
+                'width': self.width,
+                'height': self.height,
+                'frame_count': self.frame_count,
+                'fps': self.fps,
+                'size': self.size,
+                'mtime_ns': self.mtime_ns}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'VideoMetadata':
+        return cls(**d)
+
+    def __repr__(self) -> str:
+        return f"VideoMetadata({self.path}, {self.width}x{self.height}, {self.frame_count} frames @ {self.fps} fps)"
+
+
+def probe_video(path: str) -> VideoMetadata:
+    """
+    Reads metadata from the video file itself with MediaInfo. Prefer get_video_metadata, which only does this once
+    :param path: Path to the video
+    :return: VideoMetadata
+    """
+    media_info: MediaInfo.parse = MediaInfo.parse(path)
+    stat: os.stat_result = os.stat(path)
+
+    for track in media_info.tracks:
+        if track.track_type == 'Video':
+            return VideoMetadata(path=path,
+                                 width=int(track.width),
+                                 height=int(track.height),
+                                 frame_count=int(track.frame_count) if track.frame_count else None,
+                                 fps=float(track.frame_rate) if track.frame_rate else None,
+                                 size=stat.st_size,
+                                 mtime_ns=stat.st_mtime_ns)
+    raise ValueError(f"No video track found in {path}")
+
+
+def get_video_metadata(path: str,
+                       use_index: bool = True) -> VideoMetadata:
+    """
+    Gets metadata for a video, probing it at most once. Results are memoised in process, and stored in a sidecar index
+    next to the video so later runs (or machines without the video) don't need to probe it at all.
+    :param path: Path to the video
+    :param use_index: Read and write the sidecar index
+    :return: VideoMetadata
+    """
+    abs_path: str = os.path.abspath(path)
+    video_exists: bool = os.path.exists(abs_path)
+    stat: os.stat_result = os.stat(abs_path) if video_exists else None
+
+    metadata: VideoMetadata = _metadata_memo.get(abs_path)
+    if metadata is not None and _is_current(metadata, stat):
+        return metadata
+
+    if use_index:
+        index: dict = _read_index(abs_path)
+        entry: dict = index.get(os.path.basename(abs_path))
+        if entry is not None:
+            metadata = VideoMetadata.from_dict({**entry, 'path': path})
+            if _is_current(metadata, stat):
+                _metadata_memo[abs_path] = metadata
+                return metadata
+
+    if not video_exists:
+        raise FileNotFoundError(f"Video {path} not found, and it has no entry in {METADATA_INDEX_NAME}")
+
+    metadata = probe_video(path)
+    _metadata_memo[abs_path] = metadata
+    if use_index:
+        _write_index_entry(abs_path, metadata)
+    return metadata
+
+
+def get_video_dimensions(path: str) -> tuple:
+    """
+    Gets the (width, height) of a video
+    :param path: Path to the video
+    :return: tuple: (width, height)
+    """
+    return get_video_metadata(path).dimensions
+
+
+def _is_current(metadata: VideoMetadata,
+                stat: os.stat_result) -> bool:
+    """
+    Checks metadata still describes the video on disk. If there's no video to check against, we trust it.
+    """
+    if stat is None:
+        return True
+    return metadata.size == stat.st_size and metadata.mtime_ns == stat.st_mtime_ns
+
+
+def _index_path(abs_video_path: str) -> str:
+    return os.path.join(os.path.dirname(abs_video_path), METADATA_INDEX_NAME)
+
+
+def _read_index(abs_video_path: str) -> dict:
+    try:
+        with open(_index_path(abs_video_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_index_entry(abs_video_path: str,
+                       metadata: VideoMetadata) -> None:
+    """
+    Adds a video to its directory's sidecar index. Failing to write (e.g. a read-only data dir) isn't fatal, we just
+    end up probing again next run.
+    """
+    index: dict = _read_index(abs_video_path)
+    entry: dict = metadata.to_dict()
+    del entry['path']
+    index[os.path.basename(abs_video_path)] = entry
+
+    index_path: str = _index_path(abs_video_path)
+    tmp_path: str = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
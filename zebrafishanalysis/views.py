@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+
+class FrameView:
+    """
+    A filtered view of a dataframe that doesn't copy it. The view is just the base table plus a boolean mask of the
+    rows kept, so stacking filters (e.g. drop_errors then trim_based_on_objs) only costs a mask per step rather than
+    a copy of the whole table. Nothing is copied out of the base until materialize, column or to_numpy is called, and
+    then only the rows and columns asked for.
+    The base table is shared, not copied, so it shouldn't be modified while views of it are in use.
+    """
+
+    def __init__(self,
+                 base: pd.DataFrame,
+                 mask: np.ndarray = None):
+        """
+        :param base: Dataframe to view
+        :param mask: Boolean mask over the rows of base, True for rows kept. Defaults to keeping every row
+        """
+        self.base: pd.DataFrame = base
+        self.mask: np.ndarray = np.ones(len(base), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        if len(self.mask) != len(base):
+            raise ValueError(f"Mask has {len(self.mask)} rows, but the base table has {len(base)}")
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.mask))
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.base.columns
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.base.columns
+
+    @property
+    def rows(self) -> np.ndarray:
+        """
+        :return: np.ndarray: Positions (not labels) of the kept rows in the base table
+        """
+        return np.flatnonzero(self.mask)
+
+    def base_column(self,
+                    name: str) -> np.ndarray:
+        """
+        Gets a whole column of the base table, ignoring the mask. Filters can be worked out on this without gathering
+        the kept rows first, then passed to where.
+        :param name: Column to get
+        :return: np.ndarray, no copy
+        """
+        if name not in self.base.columns:
+            raise KeyError(f"{name} does not exist in positions_df")
+        return self.base[name].to_numpy()
+
+    def column(self,
+               name: str) -> np.ndarray:
+        """
+        Gets the kept rows of a single column
+        :param name: Column to get
+        :return: np.ndarray
+        """
+        return self.base_column(name)[self.mask]
+
+    def where(self,
+              base_mask: np.ndarray) -> 'FrameView':
+        """
+        Narrows the view to rows also passing another filter
+        :param base_mask: Boolean mask over every row of the base table (not just the kept ones)
+        :return: FrameView over the same base
+        """
+        return FrameView(self.base, self.mask & base_mask)
+
+    def materialize(self,
+                    columns: list = None) -> pd.DataFrame:
+        """
+        Copies the kept rows out into a dataframe, keeping the base's index labels
+        :param columns: Columns to include, defaults to all of them
+        :return: pd.DataFrame
+        """
+        rows: np.ndarray = self.rows
+        if columns is None:
+            return self.base.iloc[rows]
+        return self.base.iloc[rows, [self.base.columns.get_loc(name) for name in columns]]
+
+    def to_numpy(self,
+                 columns: list) -> np.ndarray:
+        """
+        Kept rows of some columns as a 2D array, i.e. materialize(columns).to_numpy() without building the dataframe
+        :param columns: Columns to include
+        :return: np.ndarray of shape (rows, columns)
+        """
+        return np.column_stack([self.column(name) for name in columns])
+
+    def __repr__(self) -> str:
+        return f"FrameView({len(self)} of {len(self.base)} rows)"